@@ -1,59 +1,90 @@
+import time
+
+# Measured before any other import, to log the time to the first prompt
+PROCESS_START = time.perf_counter()
+
 import os
-from sklearn.linear_model import LogisticRegression
+import logging
 
 import src.utils as utils
-import src.train_and_test as ai
-import src.bot_fsa as fsa
+import src.metrics as metrics
+from src.engine import ConversationEngine
+from src.channel import ConsoleChannel
+from src.results_store import ResultsLog
+from src.warmup import Warmup
 
 # Setting the name of the file containing the pre-trained word2vec representations
-EMBEDDING_FILE = os.path.join("data", "w2v.pkl")
+EMBEDDING_FILE = utils.default_embedding_path()
+# Setting the storage mode of the embeddings: float32, or the quantized float16 and int8 (embedding stores only)
+EMBEDDING_MODE = "float32"
+# Setting the name of the file containing the training data
+DATASET_FILE = os.path.join("data", "dataset.csv")
+# Setting the name of the log file (the console is used by the conversation)
+LOG_FILE = "carebot.log"
+# Setting the file where the metrics are written at the end of the conversation (None to disable it)
+METRICS_FILE = None
+# Setting the duration (in milliseconds) above which a turn is profiled (None to disable the profiler)
+SLOW_TURN_MS = None
+PROFILE_DIR = "profiles"
+# Setting the directory where the outcome of the conversation (including the name and date of birth of the user)
+# is saved, e.g. os.path.join("data", "results") (None to disable it)
+RESULTS_DIR = None
+
+log = logging.getLogger("carebot")
 
 
 # model: A trained classification model
 # word2vec: The pretrained Word2Vec model, if using other classification options (leave empty otherwise)
+# loader: An optional function returning the model and word2vec, used if they are None (see src/warmup.py)
+# profiler: An optional SlowTurnProfiler (see src/metrics.py)
+# channel: The channel of the conversation (the console by default, see src/channel.py)
+# results: An optional ResultsLog, where the outcome of the conversation is saved (see src/results_store.py)
 # Returns: This function does not return any values
 #
-# This function implements the main chatbot system --- it runs different
-# dialogue states depending on rules governed by the internal dialogue
-# management logic, with each state handling its own input/output and internal
-# processing steps.
-def run_chatbot(model, word2vec):
-
-    # The first time simply go through a complete analysis
-    fsa.welcome_state()
-    fsa.get_info_state()
-    fsa.health_check_state(model, word2vec, True)
-    fsa.stylistic_analysis_state()
-
-    next_state = fsa.check_next_state()
-
-    while next_state != 'quit':
-        if next_state == 'health_check':
-            next_state = fsa.health_check_state(model, word2vec)
-            continue
-        if next_state == 'stylistic_analysis':
-            next_state = fsa.stylistic_analysis_state()
-            continue
-        if next_state == 'check_next_state':
-            next_state = fsa.check_next_state()
-            continue
-        # This case isn't really necessary, but why not be 100% sure?
-        if next_state == 'quit':
-            break
-
-    print('\nThanks for talking with me!\nSee you again!\n')
+# This function implements the main chatbot system --- it runs a single
+# conversation.  The dialogue states and their rules are managed by the
+# conversation engine: this function simply writes its replies to the channel
+# and feeds it with the user input, until the conversation is over or the
+# channel is closed.
+def run_chatbot(model, word2vec, loader=None, profiler=None, channel=None, results=None):
+    engine = ConversationEngine(model, word2vec, loader=loader, profiler=profiler, results=results)
+    channel = ConsoleChannel() if channel is None else channel
+
+    session, replies = engine.open_session()
+    channel.write(''.join(replies))
+    log.info('Time to first prompt: %.3fs', time.perf_counter() - PROCESS_START)
+
+    try:
+        while not session.is_over():
+            replies = engine.handle(session, channel.read())
+            channel.write(''.join(replies))
+    except EOFError:
+        pass
+    finally:
+        engine.close_session(session)
 
 
 if __name__ == "__main__":
-    # Load the data needed to train the model
-    lexicon, labels = utils.load_as_list(os.path.join("data", "dataset.csv"))
+    logging.basicConfig(filename=LOG_FILE, level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    # Load the Word2Vec representations and the model (trained only if there
+    # isn't already a trained artifact for the same dataset, embeddings and
+    # hyperparameters) in the background, while the conversation starts
+    warmup = Warmup(EMBEDDING_FILE, DATASET_FILE, EMBEDDING_MODE).start()
 
-    # Load the Word2Vec representations
-    word2vec = utils.load_w2v(EMBEDDING_FILE)
+    profiler = None
+    if SLOW_TURN_MS is not None:
+        profiler = metrics.SlowTurnProfiler(SLOW_TURN_MS, PROFILE_DIR)
 
-    # Instantiate and train the machine learning model
-    logistic = LogisticRegression()
-    logistic = ai.train_model(logistic, word2vec, lexicon, labels)
+    results = ResultsLog(RESULTS_DIR) if RESULTS_DIR is not None else None
 
     # Reference code to run the chatbot
-    run_chatbot(logistic, word2vec)
+    try:
+        run_chatbot(None, None, loader=warmup.wait, profiler=profiler, results=results)
+    finally:
+        if results is not None:
+            results.close()
+
+    if METRICS_FILE is not None:
+        metrics.write_textfile(METRICS_FILE)
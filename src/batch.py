@@ -0,0 +1,110 @@
+import os
+import sys
+import csv
+import json
+import time
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+
+# fname: Path of a CSV or JSONL file
+# text_field: The column (or key) containing the texts
+# id_field: The column (or key) containing the ids of the texts (the row number is used if missing)
+# file_format: 'csv', 'jsonl', or None to guess it from the file extension
+# Returns: An iterator over (id, text) pairs
+#
+# This function streams the texts, without loading the whole file in memory.
+def read_texts(fname, text_field='text', id_field='id', file_format=None):
+    if file_format is None:
+        file_format = 'jsonl' if os.path.splitext(fname)[1].lower() in ('.jsonl', '.json') else 'csv'
+
+    with open(fname, newline='', encoding='utf-8') as fin:
+        if file_format == 'csv':
+            rows = csv.DictReader(fin)
+        else:
+            rows = (json.loads(line) for line in fin if line.strip())
+
+        for idx, row in enumerate(rows):
+            if text_field not in row:
+                raise ValueError("Row {0} of {1} has no field '{2}'".format(idx, fname, text_field))
+            yield row.get(id_field, idx), row[text_field] or ''
+
+
+# items: An iterable
+# size: The size of the chunks
+# Returns: An iterator over lists of at most size items
+def chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+# executor: A ProcessPoolExecutor, or None to run everything in this process
+# chunks: An iterable of chunks
+# max_in_flight: The maximum number of chunks submitted and not yet collected
+# func: The function applied to each chunk
+# Returns: An iterator over the sizes of the chunks and the results of func, in the same order as the chunks
+#
+# Unlike executor.map, only a few chunks are submitted at a time, so the input
+# is never read entirely in memory.
+def map_chunks(executor, chunks, max_in_flight, func):
+    if executor is None:
+        for chunk in chunks:
+            yield len(chunk), func(chunk)
+        return
+
+    in_flight = collections.deque()
+    for chunk in chunks:
+        in_flight.append((len(chunk), executor.submit(func, chunk)))
+        if len(in_flight) >= max_in_flight:
+            size, future = in_flight.popleft()
+            yield size, future.result()
+    while len(in_flight) > 0:
+        size, future = in_flight.popleft()
+        yield size, future.result()
+
+
+# chunks: An iterable of chunks
+# out_fname: Path of the output CSV file
+# fields: The columns of the output file
+# func: The function turning a chunk into output rows (it runs in the worker processes)
+# workers: The number of worker processes (1 to run everything in this process)
+# unit: The name of the items of the chunks, for the progress messages (e.g. 'texts')
+# done_verb: What is done to them, for the progress messages (e.g. 'analyzed')
+# on_rows: An optional function called with the rows of each chunk, in order
+# Returns: The number of items processed
+#
+# This function streams the chunks through a process pool and writes their
+# rows to a CSV file, printing the progress and the throughput.
+def write_chunks(chunks, out_fname, fields, func, workers=None, unit='texts', done_verb='analyzed', on_rows=None):
+    workers = workers or os.cpu_count() or 1
+
+    start = time.perf_counter()
+    done = 0
+    with open(out_fname, 'w', newline='', encoding='utf-8') as fout:
+        writer = csv.writer(fout)
+        writer.writerow(fields)
+
+        executor = ProcessPoolExecutor(workers) if workers > 1 else None
+        try:
+            for size, rows in map_chunks(executor, chunks, 2 * workers, func):
+                writer.writerows(rows)
+                if on_rows is not None:
+                    on_rows(rows)
+                done += size
+                elapsed = time.perf_counter() - start
+                print('\r{0} {1} {2} ({3:.0f} {1}/s)'.format(done, unit, done_verb, done / elapsed),
+                      end='', file=sys.stderr, flush=True)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    elapsed = time.perf_counter() - start
+    print('\nDone! {0} {1} in {2:.1f}s ({3:.0f} {1}/s)'.format(done, unit, elapsed, done / max(elapsed, 1e-9)),
+          file=sys.stderr)
+    return done
@@ -0,0 +1,255 @@
+import os
+import sys
+import json
+import time
+import shutil
+import string
+import argparse
+import functools
+import platform
+import tempfile
+import tracemalloc
+import pickle as pkl
+import numpy as np
+
+import src.utils as utils
+import src.embedding_store as store
+import src.train_and_test as ai
+import src.style_analysis as style
+import src.bot_fsa as fsa
+from src.channel import ScriptedChannel
+
+# A case whose time (or peak memory) grows more than this fraction over the baseline is a regression
+DEFAULT_TOLERANCE = 0.25
+
+# Texts used by the stylistic analysis cases
+STYLE_WORDS = ("I you we he she it they my the a an in on at of to with will would can was were went had "
+               "not no never don't didn't feel think today yesterday tomorrow park doctor work home").split()
+
+
+# Synthetic data shared by all the benchmark cases: a random vocabulary and its
+# embeddings (as a dictionary, a pickle file, and an embedding store), random
+# labeled texts, and texts for the stylistic analysis and the intake.
+class Fixture:
+
+    # vocab_size: The number of words of the synthetic vocabulary
+    # dim: The dimension of the synthetic embeddings
+    # num_texts: The number of generated texts (for each kind of text)
+    # seed: The seed of the random generator
+    def __init__(self, vocab_size=50000, dim=300, num_texts=1000, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.dir = tempfile.mkdtemp(prefix='carebot-bench-')
+
+        letters = np.array(list(string.ascii_lowercase))
+        lengths = self.rng.integers(3, 12, size=vocab_size)
+        words = set()
+        for length in lengths:
+            words.add(''.join(self.rng.choice(letters, size=length)))
+        self.words = sorted(words)
+
+        vectors = self.rng.standard_normal((len(self.words), dim)).astype(np.float32)
+        self.word2vec = dict(zip(self.words, vectors))
+        self.pkl_path = os.path.join(self.dir, 'w2v.pkl')
+        with open(self.pkl_path, 'wb') as fout:
+            pkl.dump(self.word2vec, fout)
+        self.store_path = os.path.join(self.dir, 'w2v_store')
+        store.write_store(self.store_path, self.words, vectors, dim)
+        self.store = store.load_store(self.store_path)
+
+        # Labeled texts: 5% of out-of-vocabulary tokens and some punctuation, with
+        # labels given by a random hyperplane so that the models can learn them
+        self.texts = []
+        for _ in range(num_texts):
+            tokens = list(self.rng.choice(self.words, size=self.rng.integers(3, 25)))
+            tokens += ['oovtoken', '.', ',', '!'][:self.rng.integers(0, 4)]
+            self.texts.append(' '.join(tokens))
+        direction = self.rng.standard_normal(dim)
+        self.labels = (utils.string2vec_batch(self.word2vec, self.texts) @ direction > 0).astype(int).tolist()
+        split = int(0.8 * num_texts)
+        self.train_texts, self.train_labels = self.texts[:split], self.labels[:split]
+        self.test_texts, self.test_labels = self.texts[split:], self.labels[split:]
+
+        self.style_texts = []
+        for _ in range(max(num_texts // 10, 1)):
+            sentences = [' '.join(self.rng.choice(STYLE_WORDS, size=self.rng.integers(5, 20))) + '.'
+                         for _ in range(self.rng.integers(1, 6))]
+            self.style_texts.append(' '.join(sentences))
+
+        first_names = ['John', 'Mary', 'Anna', 'Luke', 'Sara']
+        last_names = ['Smith', 'Rossi', 'Lee', 'Brown', "O'Neil"]
+        self.intake_texts = ['{0} {1} {2:02d}/{3:02d}/{4:02d}'.format(self.rng.choice(first_names),
+                                                                   self.rng.choice(last_names),
+                                                                   self.rng.integers(1, 13), self.rng.integers(1, 29),
+                                                                   self.rng.integers(0, 100))
+                             for _ in range(num_texts)]
+        self.menu_texts = ['redo the health check', 'quit', "i don't want to quit", 'do the stylistic analysis',
+                           'what?', 'b'] * max(num_texts // 6, 1)
+
+        self.conversation = ['hello', 'John Smith 01/02/99', ' '.join(self.words[:10]), self.style_texts[0],
+                             'b', ' '.join(self.words[10:15]), 'redo the stylistic analysis', self.style_texts[-1],
+                             'quit']
+
+    # Returns: This function does not return any values
+    def cleanup(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+# fx: A Fixture
+# Returns: A list of (name, function) pairs, one for each benchmark case
+def build_cases(fx):
+    import run
+
+    cases = [
+        ('load_w2v[pickle]', lambda: utils.load_w2v(fx.pkl_path)),
+        ('load_w2v[store]', lambda: utils.load_w2v(fx.store_path)),
+        ('preprocessing', lambda: [utils.preprocessing(text) for text in fx.texts]),
+        ('string2vec[dict]', lambda: [utils.string2vec(fx.word2vec, text) for text in fx.texts]),
+        ('string2vec[store]', lambda: [utils.string2vec(fx.store, text) for text in fx.texts]),
+        ('string2vec_batch[dict]', lambda: utils.string2vec_batch(fx.word2vec, fx.texts)),
+        ('string2vec_batch[store]', lambda: utils.string2vec_batch(fx.store, fx.texts)),
+        ('extract_user_info', lambda: [fsa.extract_user_info(text) for text in fx.intake_texts]),
+        ('intent_router', lambda: [fsa.ROUTER.route(text) for text in fx.menu_texts]),
+    ]
+
+    names, _ = ai.get_models()
+    for idx, name in enumerate(names):
+        trained = ai.train_model(ai.get_models()[1][idx], fx.store, fx.train_texts, fx.train_labels)
+        cases.append(('train_model[{0}]'.format(name),
+                      lambda idx=idx: ai.train_model(ai.get_models()[1][idx], fx.store, fx.train_texts,
+                                                     fx.train_labels)))
+        cases.append(('test_model[{0}]'.format(name),
+                      lambda trained=trained: ai.test_model(trained, fx.store, fx.test_texts, fx.test_labels)))
+
+    # Inputs of the cases that don't tokenize by themselves (computed by the
+    # first run, which isn't timed, since the NLTK models may be missing)
+    tagged = functools.lru_cache(None)(lambda: [style.get_pos_tags(text) for text in fx.style_texts])
+    analyses = functools.lru_cache(None)(lambda: [style.StyleAnalysis(text) for text in fx.style_texts])
+
+    cases += [
+        ('style.count_words', lambda: [style.count_words(text) for text in fx.style_texts]),
+        ('style.words_per_sentence', lambda: [style.words_per_sentence(text) for text in fx.style_texts]),
+        ('style.get_pos_tags', lambda: [style.get_pos_tags(text) for text in fx.style_texts]),
+        ('style.get_pos_categories', lambda: [style.get_pos_categories(tags) for tags in tagged()]),
+        ('style.count_negations', lambda: [style.count_negations(text) for text in fx.style_texts]),
+        ('style.summarize_analysis', lambda: [analysis.summarize() for analysis in analyses()]),
+        ('style.StyleAnalysis', lambda: [style.StyleAnalysis(text) for text in fx.style_texts]),
+        ('style.StyleAnalysis.batch', lambda: style.StyleAnalysis.batch(fx.style_texts)),
+        ('style.feature_matrix', lambda: style.feature_matrix(analyses())),
+        ('style.summarize_batch', lambda: style.summarize_batch(style.feature_matrix(analyses()))),
+    ]
+
+    model = ai.train_model(ai.get_models()[1][0], fx.store, fx.train_texts, fx.train_labels)
+
+    def conversation():
+        run.run_chatbot(model, fx.store, channel=ScriptedChannel(fx.conversation))
+    cases.append(('run_chatbot', conversation))
+
+    return cases
+
+
+# fn: The function to measure
+# repeat: The number of timed runs
+# Returns: A dictionary with the timings (in seconds) and the peak memory (in bytes) of the function
+#
+# A first warm-up run isn't measured. The timings come from runs without
+# tracing, while the peak memory is measured in a separate run with tracemalloc
+# (which also sees numpy allocations).
+def measure(fn, repeat):
+    fn()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'min_s': min(times), 'median_s': float(np.median(times)), 'peak_bytes': peak}
+
+
+# cases: A list of (name, function) pairs
+# repeat: The number of timed runs of each case
+# only: An optional substring: only the cases whose name contains it are run
+# Returns: A dictionary with the results of each case
+#
+# Cases that can't run in this environment (e.g. the NLTK models aren't
+# installed) are reported as skipped instead of failing the whole suite.
+def run_cases(cases, repeat, only=None):
+    results = {}
+    for name, fn in cases:
+        if only is not None and only not in name:
+            continue
+        try:
+            results[name] = measure(fn, repeat)
+            print('{0:<45} {1:>10.2f} ms {2:>12.1f} KiB'.format(name, results[name]['min_s'] * 1000,
+                                                              results[name]['peak_bytes'] / 1024))
+        except LookupError as err:
+            # NLTK errors are framed by lines of stars
+            lines = [line.strip() for line in str(err).splitlines() if line.strip('* ')]
+            results[name] = {'skipped': lines[0] if len(lines) > 0 else type(err).__name__}
+            print('{0:<45} skipped ({1})'.format(name, results[name]['skipped']))
+    return results
+
+
+# results: The results of run_cases
+# baseline: The results of a previous run
+# tolerance: The allowed relative growth of time and peak memory
+# Returns: A list of strings, one for each regression
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    regressions = []
+    for name, res in results.items():
+        base = baseline.get(name)
+        if base is None or 'skipped' in res or 'skipped' in base:
+            continue
+        for key, unit, scale in (('min_s', 'ms', 1000), ('peak_bytes', 'KiB', 1 / 1024)):
+            if res[key] > base[key] * (1 + tolerance):
+                regressions.append('{0}: {1} went from {2:.2f} {4} to {3:.2f} {4}'.format(
+                    name, key, base[key] * scale, res[key] * scale, unit))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths of CareBot on synthetic data.')
+    parser.add_argument('--vocab-size', type=int, default=50000)
+    parser.add_argument('--dim', type=int, default=300)
+    parser.add_argument('--num-texts', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', default=None, help='Only run the cases whose name contains this string')
+    parser.add_argument('--output', default='benchmark_results.json', help='Where to save the results')
+    parser.add_argument('--baseline', default=None, help='Results of a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    print('Generating synthetic data...')
+    fixture = Fixture(args.vocab_size, args.dim, args.num_texts, args.seed)
+    try:
+        results = run_cases(build_cases(fixture), args.repeat, args.only)
+    finally:
+        fixture.cleanup()
+
+    report = {
+        'meta': {'vocab_size': args.vocab_size, 'dim': args.dim, 'num_texts': args.num_texts,
+                 'repeat': args.repeat, 'seed': args.seed, 'python': platform.python_version(),
+                 'numpy': np.__version__, 'machine': platform.machine(), 'time': time.time()},
+        'results': results,
+    }
+    with open(args.output, 'w') as fout:
+        json.dump(report, fout, indent=2)
+    print('\nResults saved to {0}'.format(args.output))
+
+    if args.baseline is not None:
+        with open(args.baseline) as fin:
+            regressions = compare(results, json.load(fin)['results'], args.tolerance)
+        if len(regressions) > 0:
+            print('\nRegressions against {0}:'.format(args.baseline))
+            for regression in regressions:
+                print('- ' + regression)
+            sys.exit(1)
+        print('\nNo regressions against {0}'.format(args.baseline))
@@ -1,6 +1,88 @@
 import re
-import src.utils as utils
-import src.style_analysis as style
+import itertools
+
+import src.metrics as metrics
+
+# Names of the states of the FSA
+GET_INFO = 'get_info'
+HEALTH_CHECK = 'health_check'
+STYLISTIC_ANALYSIS = 'stylistic_analysis'
+CHECK_NEXT_STATE = 'check_next_state'
+QUIT = 'quit'
+
+# Number of times the user can fail to choose what to do next before the conversation ends
+MAX_MENU_ATTEMPTS = 5
+
+# Options of the menu shown by check_next_state. Each intent has the state it
+# leads to, the letter that selects it, its description, the pattern that
+# recognizes it in a sentence, and the pattern that recognizes it as negated
+# (terrible logic to recognize negative sentences, not cool, but it works well
+# in practice). Adding an option only requires adding a row here.
+#
+# Only the presence of a match matters, so the positive patterns don't include
+# the optional "(re)do/take" prefix they used to have: it never changed whether
+# they matched, and it made the regex engine backtrack a lot.
+INTENTS = [
+    (QUIT, 'a', 'Quit the conversation',
+     r"((n\'t|don\'t|not).+(continue|repeat))|(quit|terminate|exit|end|bye)",
+     r"(n\'t|don\'t|not).+(quit|terminate|exit|end|bye)"),
+    (HEALTH_CHECK, 'b', 'Redo the health check',
+     r"health([ -]?check| analysis)",
+     r"((n\'t|don\'t|not).+ (re)?(do|take) .*(health([ -]?check| analysis)))"),
+    (STYLISTIC_ANALYSIS, 'c', 'Redo the stylistic analysis',
+     r"stylistic (check|analysis)",
+     r"((n\'t|don\'t|not).+ (re)?(do|take) .*(stylistic (check|analysis)))"),
+]
+
+MENU = 'How can I help you now?\n' + ''.join('   {0}) {1}\n'.format(letter, text) for _, letter, text, _, _ in INTENTS)
+
+# Patterns used to extract the user's name and date of birth
+NAME_RE = re.compile(r"( |^)[A-Z][a-zA-Z.\-&']*( [A-Z][A-Za-z.\-&']*){1,3}( |$)")
+DOB_RE = re.compile(r"( |^)(0[1-9]|1[0-2])/(0[1-9]|[12][0-9]|3[01])/[0-9][0-9]( |$)")
+
+# Message printed when entering each state
+PROMPTS = {
+    GET_INFO: "What is your name and date of birth?\n" +
+              "Enter this information in the form: First Last MM/DD/YY\n",
+    HEALTH_CHECK: "How are you feeling today?\n",
+    STYLISTIC_ANALYSIS: "I'd also like to do an informal psychological analysis.\nWhat's on your mind today?\n",
+    CHECK_NEXT_STATE: MENU,
+    QUIT: '\nThanks for talking with me!\nSee you again!\n\n',
+}
+
+_session_ids = itertools.count(1)
+
+
+# The context of a single conversation.
+#
+# Every state of the FSA is a transition that takes the session and the user
+# input, updates the session, and returns the messages for the user. States
+# never read or print anything by themselves, so any number of conversations
+# can be carried on at the same time (see src/engine.py).
+class Session:
+    __slots__ = ('id', 'state', 'first_time', 'attempts', 'pending', 'name', 'dob',
+                 'health_label', 'correlates', 'features')
+
+    def __init__(self, session_id=None):
+        self.id = next(_session_ids) if session_id is None else session_id
+        self.state = GET_INFO
+        # True until the first complete analysis is over
+        self.first_time = True
+        # Number of failed attempts in the current state
+        self.attempts = 0
+        # Input waiting to be classified by the health model (see health_check_state)
+        self.pending = None
+        self.name = ''
+        self.dob = ''
+        self.health_label = None
+        self.correlates = []
+        # Raw counts of the last stylistic analysis (see StyleAnalysis.features)
+        self.features = None
+
+    # Returns: True if the conversation is over
+    def is_over(self):
+        return self.state == QUIT
+
 
 # user_input: A string of arbitrary length
 # Returns: Two strings (a name, and a date of birth formatted as MM/DD/YY)
@@ -14,11 +96,8 @@ def extract_user_info(user_input):
     name = ""
     dob = ""
 
-    name_re = re.compile(r"( |^)[A-Z][a-zA-Z.\-&']*( [A-Z][A-Za-z.\-&']*){1,3}( |$)")
-    dob_re = re.compile(r"( |^)(0[1-9]|1[0-2])/(0[1-9]|[12][0-9]|3[01])/[0-9][0-9]( |$)")
-
-    name = name_re.search(user_input)
-    dob = dob_re.search(user_input)
+    name = NAME_RE.search(user_input)
+    dob = DOB_RE.search(user_input)
     if (name != None):
         name = name.group()
         if (name[0] == ' '):  name = name[1:]
@@ -34,200 +113,222 @@ def extract_user_info(user_input):
 
     return name, dob
 
-# This function does not take any input
-# Returns: A string indicating the next state
+# session: The Session entering the new state
+# state: The name of the new state
+# Returns: A list containing the message printed when entering the state
+def _enter(session, state):
+    if session.state != state:
+        metrics.TRANSITIONS.inc(session.state, state)
+    session.state = state
+    session.attempts = 0
+    return [PROMPTS[state]]
+
+
+# session: A new Session
+# Returns: A list of messages for the user
 #
-# This function implements the chatbot's welcome states.  Feel free to customize
-# the welcome message!  In this state, the chatbot greets the user.
-def welcome_state():
+# This function implements the chatbot's welcome state.  Feel free to customize
+# the welcome message!  In this state, the chatbot greets the user, and then
+# moves on to ask for the user's name and date of birth.
+def welcome_state(session):
     # Display a welcome message to the user
-    # *** Replace the line below with your updated welcome message from Project Part 1 ***
     careBot = '   _____               ____        _   \n' \
-              + '  / ____|             |  _ \      | |  \n' \
+              + '  / ____|             |  _ \\      | |  \n' \
               + ' | |     __ _ _ __ ___| |_) | ___ | |_ \n' \
-              + ' | |    / _` | \'__/ _ \  _ < / _ \| __|\n' \
+              + ' | |    / _` | \'__/ _ \\  _ < / _ \\| __|\n' \
               + ' | |___| (_| | | |  __/ |_) | (_) | |_ \n' \
-              + '  \_____\__,_|_|  \___|____/ \___/ \__|\n' \
+              + '  \\_____\\__,_|_|  \\___|____/ \\___/ \\__|\n' \
 
-    print('\n' + careBot +
-          "\nWelcome to the CareBot!\n" +
-          "This chatbot is still a work-in-progress, and definetely it's not intended as a substitute for your doctor.\n" +
-          "So please, if you need medical assistance call a real doctor!\n")
+    welcome = ('\n' + careBot +
+               "\nWelcome to the CareBot!\n" +
+               "This chatbot is still a work-in-progress, and definetely it's not intended as a substitute for your doctor.\n" +
+               "So please, if you need medical assistance call a real doctor!\n\n")
 
-    return ""
+    metrics.SESSIONS.inc()
+    return [welcome] + _enter(session, GET_INFO)
 
 
-# This function does not take any input
-# Returns: A string indicating the next state
+# session: The current Session
+# user_input: A string of arbitrary length
+# Returns: A list of messages for the user
 #
 # This function implements a state that requests the user's name and date of
 # birth, and then processes the user's response to extract that information.
-def get_info_state():
-    # Request the user's name and date of birth, and accept a user response of
-    # arbitrary length
-    user_input = input("What is your name and date of birth?\n" +
-                       "Enter this information in the form: First Last MM/DD/YY\n")
-
+def get_info_state(session, user_input):
     # Extract the user's name and date of birth
-    name, dob = extract_user_info(user_input)
-    while name == '' or dob == '':
+    with metrics.STEP_SECONDS.time('user_info_regex'):
+        name, dob = extract_user_info(user_input)
+    if name == '' or dob == '':
+        out = []
         if name == '':
-            print("I'm sorry, the format of your name is wrong. The correct format is: FirstName LastName.\n" +
-                  'Please try again.\n')
+            out.append("I'm sorry, the format of your name is wrong. The correct format is: FirstName LastName.\n" +
+                       'Please try again.\n\n')
         if dob == '':
-            print("I'm sorry, the format of your date of birth is wrong. The correct format is: MM/DD/YY.\n" +
-                  'Please try again.\n')
+            out.append("I'm sorry, the format of your date of birth is wrong. The correct format is: MM/DD/YY.\n" +
+                       'Please try again.\n\n')
+        return out
 
-        user_input = input()
-        name, dob = extract_user_info(user_input)
+    session.name, session.dob = name, dob
+    out = ["Thanks {0}! I'll make a note that you were born on {1}\n\n".format(name.split()[0], dob)]
 
-    print("Thanks {0}! I'll make a note that you were born on {1}\n".format(name.split()[0], dob))
+    return out + _enter(session, HEALTH_CHECK)
 
-    return ''
 
-
-# model: The trained classification model used for predicting health status
-# word2vec: The pretrained Word2Vec model
-# first_time (bool): indicates whether the state is active for the first time.
-# Returns: A string indicating the next state
+# session: The current Session
+# user_input: A string of arbitrary length
+# Returns: A list of messages for the user
 #
-# This function implements a state that asks the user to describe their health,
-# and then processes their response to predict their current health status.
-def health_check_state(model, word2vec, first_time=False):
-    # Check the user's current health
-    user_input = input("How are you feeling today?\n")
-
-    while len(user_input) == 0:
-        user_input = input("I'm sorry, I didn't understand that.\n" +
-                           "Can you repeat?\n")
-
-    # Predict whether the user is healthy or unhealthy
-    w2v_test = utils.string2vec(word2vec, user_input)
-    label = model.predict(w2v_test.reshape(1, -1))
+# This function implements a state that asks the user to describe their health.
+# Predicting the health status requires the model, so the input is left in
+# session.pending: whoever drives the conversation classifies it and then calls
+# health_result_state with the predicted label.
+def health_check_state(session, user_input):
+    if len(user_input) == 0:
+        return ["I'm sorry, I didn't understand that.\n" +
+                "Can you repeat?\n"]
+
+    session.pending = user_input
+    return []
+
+
+# session: The current Session
+# label: The label predicted for session.pending
+# Returns: A list of messages for the user
+#
+# This function completes the health check, telling the user whether they
+# sound healthy or unhealthy.
+def health_result_state(session, label):
+    session.pending = None
+    session.health_label = label
+
     if label == 0:
-        print("Great! It sounds like you're healthy.\n")
+        out = ["Great! It sounds like you're healthy.\n\n"]
     elif label == 1:
-        print("Oh no! It sounds like you're unhealthy.\n")
+        out = ["Oh no! It sounds like you're unhealthy.\n\n"]
     else:
-        print("Hmm, that's weird. My classifier predicted a value of: {0}\n".format(label))
+        out = ["Hmm, that's weird. My classifier predicted a value of: {0}\n\n".format(label)]
 
-    out = 'stylistic_analysis' if first_time else "check_next_state"
-    return out
+    next_state = STYLISTIC_ANALYSIS if session.first_time else CHECK_NEXT_STATE
+    return out + _enter(session, next_state)
 
 
-# This function does not take any arguments
-# Returns: A string indicating the next state
+# session: The current Session
+# user_input: A string of arbitrary length
+# Returns: A list of messages for the user
 #
 # This function implements a state that asks the user what's on their mind, and
 # then analyzes their response to identify informative linguistic correlates to
 # psychological status.
-def stylistic_analysis_state():
-    user_input = input("I'd also like to do an informal psychological analysis.\nWhat's on your mind today?\n")
-
-    while len(user_input) < 20:
-        if len(user_input) == 0:
-            user_input = input("I'm sorry, I didn't understand that.\n" +
-                               "Can you repeat?\n")
-        if len(user_input) > 0:
-            user_input = input("I'm sorry, can you give me more details?\n" +
-                               "Please use longer/multiple sentences, otherwise I won't" +
-                               "be able to analyze your style!\n")
-
-    num_words = style.count_words(user_input)
-    wps = style.words_per_sentence(user_input)
-    pos_tags = style.get_pos_tags(user_input)
-    num_pronouns, num_prp, num_articles, num_past, num_future, num_prep = style.get_pos_categories(pos_tags)
-    num_negations = style.count_negations(user_input)
+def stylistic_analysis_state(session, user_input):
+    if len(user_input) == 0:
+        return ["I'm sorry, I didn't understand that.\n" +
+                "Can you repeat?\n"]
+    if len(user_input) < 20:
+        return ["I'm sorry, can you give me more details?\n" +
+                "Please use longer/multiple sentences, otherwise I won't " +
+                "be able to analyze your style!\n"]
+
+    # Imported here since NLTK takes a while to load (see src/warmup.py)
+    import src.style_analysis as style
 
     # Generate a stylistic analysis of the user's input
-    informative_correlates = style.summarize_analysis(num_words, wps, num_pronouns,
-                                                num_prp, num_articles, num_past,
-                                                num_future, num_prep, num_negations)
-    print("Thanks! Based on my stylistic analysis, I've identified the following psychological correlates in your response:")
+    analysis = style.StyleAnalysis(user_input)
+    with metrics.STEP_SECONDS.time('summarize_analysis'):
+        informative_correlates = analysis.summarize()
+    session.correlates = informative_correlates
+    session.features = analysis.features()
+
+    out = "Thanks! Based on my stylistic analysis, I've identified the following psychological correlates in your response:\n"
     for correlate in informative_correlates:
-        print("- {0}".format(correlate))
-    print()
+        out += "- {0}\n".format(correlate)
+    out += "\n"
+
+    session.first_time = False
+    return [out] + _enter(session, CHECK_NEXT_STATE)
+
+
+# Recognizes which menu option the user chose.
+#
+# All the patterns of the intents table are compiled once in a single pattern:
+# each (positive or negative) pattern becomes an optional lookahead with a named
+# group, so one match from the start of the input tells which patterns can be
+# found anywhere in it, exactly like calling search with each of them.
+class IntentRouter:
+
+    # intents: A list of intents, in the same format as INTENTS
+    def __init__(self, intents):
+        self.intents = intents
+        self.letters = {letter: state for state, letter, _, _, _ in intents}
+
+        parts = []
+        for idx, (_, _, _, positive, negative) in enumerate(intents):
+            parts.append(r"(?:(?=(?P<pos{0}>[\s\S]*?(?:{1})))|)".format(idx, positive))
+            if negative is not None:
+                parts.append(r"(?:(?=(?P<neg{0}>[\s\S]*?(?:{1})))|)".format(idx, negative))
+        self.pattern = re.compile(''.join(parts))
+
+    # in_user: A lowercase string of arbitrary length
+    # Returns: The name of the state chosen by the user, or '' if it's not clear
+    def route(self, in_user):
+        # If the user uses the letter associated to the questions, use simpler logic
+        if len(in_user) == 1:
+            return self.letters.get(in_user, '')
+
+        # The request must match exactly one intent, and not be negated
+        with metrics.STEP_SECONDS.time('intent_router'):
+            groups = self.pattern.match(in_user).groupdict()
+        matched = [idx for idx in range(len(self.intents)) if groups['pos{0}'.format(idx)] is not None]
+        if len(matched) != 1 or groups.get('neg{0}'.format(matched[0])) is not None:
+            return ''
+        return self.intents[matched[0]][0]
 
-    return "check_next_state"
 
+ROUTER = IntentRouter(INTENTS)
 
-# This function does not take any input
-# Returns: A string indicating the next state
+
+# session: The current Session
+# user_input: A string of arbitrary length
+# Returns: A list of messages for the user
 #
 # This function implements a state that checks to see what the user would like
 # to do next.
-def check_next_state():
-    next_state = ""
+def check_next_state(session, user_input):
+    in_user = user_input.lower()
 
-    in_user = input('How can I help you now?\n' +
-                    '   a) Quit the conversation\n' +
-                    '   b) Redo the health check\n' +
-                    '   c) Redo the stylistic analysis\n').lower()
+    next_state = ROUTER.route(in_user) if len(in_user) > 0 else ''
+    if next_state != '':
+        return _enter(session, next_state)
 
+    session.attempts += 1
+    if session.attempts >= MAX_MENU_ATTEMPTS:
+        out = ["\nI'm sorry, but today I'm quite slow.\n" +
+               "That's not your fault, it's just that sometimes it happens.\n" +
+               "I need to fix myself a little, then we can talk again!\n\n"]
+        return out + _enter(session, QUIT)
 
-    for _ in range(5):
-        # Force the user to input something
-        if len(in_user) == 0:
-            in_user = input("\nI'm sorry, but you need to say something for me to understand you.\n" +
-                            'How can I help you now?\n' +
-                            '   a) Quit the conversation\n' +
-                            '   b) Redo the health check\n' +
-                            '   c) Redo the stylistic analysis\n').lower()
+    # Force the user to input something
+    if len(in_user) == 0:
+        return ["\nI'm sorry, but you need to say something for me to understand you.\n" + MENU]
+    return ["\nI'm sorry, but I didn't understand that.\n" +
+            "Can you rephrase what have you just said?\n"]
 
-        # If the user uses the letter associated to the questions, use simpler logic
-        if len(in_user) == 1:
-            if in_user in ['a', 'b', 'c']:
-                if in_user == 'a':
-                    next_state = 'quit'
-                    break
-                if in_user == 'b':
-                    next_state = 'health_check'
-                    break
-                if in_user == 'c':
-                    next_state = 'stylistic_analysis'
-                    break
-            else:
-                in_user = input("\nI'm sorry, but I didn't understand that.\n" +
-                                "Can you rephrase what have you just said?\n").lower()
-
-        if len(in_user) > 1:
-            # Terrible logic to recognize negative sentences (not cool, but it works well in practice)
-            reg_a = re.compile(r"((n\'t|don\'t|not).+(continue|repeat))|(quit|terminate|exit|end|bye)")
-            reg_a_neg = re.compile(r"(n\'t|don\'t|not).+(quit|terminate|exit|end|bye)")
-            reg_b = re.compile(r"(((^|.* )(re)?(do|take) )?.*(health([ -]?check| analysis)))")
-            reg_b_neg = re.compile(r"((n\'t|don\'t|not).+ (re)?(do|take) .*(health([ -]?check| analysis)))")
-            reg_c = re.compile(r"(((^|.* )(re)?(do|take) )?.*(stylistic (check|analysis)))")
-            reg_c_neg = re.compile(r"((n\'t|don\'t|not).+ (re)?(do|take) .*(stylistic (check|analysis)))")
-
-            a, a_neg = reg_a.search(in_user), reg_a_neg.search(in_user)
-            b, b_neg = reg_b.search(in_user), reg_b_neg.search(in_user)
-            c, c_neg = reg_c.search(in_user), reg_c_neg.search(in_user)
-
-            is_a = a is not None and b is None and c is None
-            is_b = a is None and b is not None and c is None
-            is_c = a is None and b is None and c is not None
-
-            if is_a:
-                if a_neg is None:
-                    next_state = "quit"
-                    break
-            if is_b:
-                if b_neg is None:
-                    next_state = "health_check"
-                    break
-            if is_c:
-                if c_neg is None:
-                    next_state = "stylistic_analysis"
-                    break
-
-            in_user = input("\nI'm sorry, but I didn't understand that.\n" +
-                            "Can you rephrase what have you just said?\n").lower()
-
-
-    if next_state == '':
-        next_state = 'quit'
-        print("\nI'm sorry, but today I'm quite slow.\n" +
-              "That's not your fault, it's just that sometimes it happens.\n" +
-              "I need to fix myself a little, then we can talk again!\n")
-
-    return next_state
+
+# Transition function of each state waiting for user input
+TRANSITIONS = {
+    GET_INFO: get_info_state,
+    HEALTH_CHECK: health_check_state,
+    STYLISTIC_ANALYSIS: stylistic_analysis_state,
+    CHECK_NEXT_STATE: check_next_state,
+}
+
+
+# session: The current Session
+# user_input: A string of arbitrary length
+# Returns: A list of messages for the user
+#
+# This function feeds the user input to the transition of the current state.
+def transition(session, user_input):
+    if session.is_over():
+        return []
+    with metrics.STATE_SECONDS.time(session.state):
+        return TRANSITIONS[session.state](session, user_input)
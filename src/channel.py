@@ -0,0 +1,41 @@
+# The channels a conversation is carried on: run_chatbot reads the user inputs
+# from a channel and writes the messages of the bot to it, so the same
+# conversation can run on the console, or be driven by a script (see
+# src/replay.py and src/benchmark.py).
+
+
+# The console: user inputs are read from stdin, and messages printed on stdout.
+class ConsoleChannel:
+
+    # Returns: The next user input
+    # Raises: EOFError when stdin is closed
+    def read(self):
+        return input()
+
+    # text: A message for the user
+    # Returns: This function does not return any values
+    def write(self, text):
+        print(text, end='', flush=True)
+
+
+# A scripted conversation: user inputs come from a list, and the messages of
+# the bot are collected, one entry for each turn.
+class ScriptedChannel:
+
+    # inputs: A list of user inputs
+    def __init__(self, inputs):
+        self._inputs = iter(inputs)
+        self.outputs = []
+
+    # Returns: The next user input
+    # Raises: EOFError when the script is over
+    def read(self):
+        try:
+            return next(self._inputs)
+        except StopIteration:
+            raise EOFError('The script is over') from None
+
+    # text: A message for the user
+    # Returns: This function does not return any values
+    def write(self, text):
+        self.outputs.append(text)
@@ -0,0 +1,293 @@
+import os
+import json
+import argparse
+import zlib
+import hashlib
+import pickle as pkl
+import numpy as np
+
+# Files composing an embedding store directory
+VECTORS_FILE = "vectors.npy"
+WORDS_FILE = "words.bin"
+OFFSETS_FILE = "offsets.bin"
+TABLE_FILE = "table.bin"
+META_FILE = "meta.json"
+
+# Storage modes of the vectors: the original float32 matrix, or its quantized versions
+MODES = ("float32", "float16", "int8")
+
+# Files containing the vectors (and the per-row scales, for int8) for each mode
+MODE_FILES = {"float32": VECTORS_FILE, "float16": "vectors.float16.npy", "int8": "vectors.int8.npy"}
+SCALES_FILE = "scales.int8.npy"
+
+# Size (in rows) of the blocks used while hashing or quantizing the vectors
+_HASH_BLOCK = 65536
+
+
+# word_bytes: A UTF-8 encoded token
+# mask: The size of the hash table minus one (the size is a power of two)
+# Returns: The first slot of the hash table to probe for that token
+def _slot(word_bytes, mask):
+    return zlib.crc32(word_bytes) & mask
+
+
+# token: A string containing a single token
+# Returns: The token encoded as bytes, the same way it is stored on disk
+def _encode(token):
+    return token.encode("utf-8", "surrogatepass")
+
+
+# num_words: The number of words in the vocabulary
+# Returns: The number of slots of the hash table (a power of two, at most half full)
+def _table_size(num_words):
+    size = 1
+    while size < 2 * max(num_words, 1):
+        size *= 2
+    return size
+
+
+# path: The directory that will contain the store
+# words: A list of strings (the vocabulary)
+# vectors: A 2D array-like of shape (len(words), dim), or an iterable of rows
+# dim: The dimension of the vectors
+# Returns: The fingerprint of the written store
+#
+# This function writes an embedding store: the vectors as one contiguous
+# float32 matrix, the vocabulary as a blob of UTF-8 words with their offsets,
+# and an open-addressing hash table mapping each word to its row. Everything is
+# written in a format that can be memory-mapped, so that loading the store is
+# (almost) free and all the processes using it share the same page cache.
+def write_store(path, words, vectors, dim):
+    os.makedirs(path, exist_ok=True)
+    num_words = len(words)
+
+    # Write the matrix row by row, to avoid keeping a second copy in memory
+    matrix = np.lib.format.open_memmap(os.path.join(path, VECTORS_FILE), mode="w+",
+                                       dtype=np.float32, shape=(num_words, dim))
+    for row, vector in enumerate(vectors):
+        matrix[row] = vector
+    matrix.flush()
+
+    # Write the vocabulary and build the hash table
+    mask = _table_size(num_words) - 1
+    table = np.full(mask + 1, -1, dtype="<i8")
+    offsets = np.zeros(num_words + 1, dtype="<i8")
+    digest = hashlib.sha256()
+    with open(os.path.join(path, WORDS_FILE), "wb") as fout:
+        position = 0
+        for row, word in enumerate(words):
+            word_bytes = _encode(word)
+            fout.write(word_bytes)
+            digest.update(word_bytes + b"\0")
+            position += len(word_bytes)
+            offsets[row + 1] = position
+
+            slot = _slot(word_bytes, mask)
+            while table[slot] >= 0:
+                slot = (slot + 1) & mask
+            table[slot] = row
+    offsets.tofile(os.path.join(path, OFFSETS_FILE))
+    table.tofile(os.path.join(path, TABLE_FILE))
+
+    # The fingerprint identifies the content of the store, so that it can be
+    # used as a cheap cache key without hashing gigabytes at every start
+    for start in range(0, num_words, _HASH_BLOCK):
+        digest.update(np.ascontiguousarray(matrix[start:start + _HASH_BLOCK]).tobytes())
+    fingerprint = digest.hexdigest()
+
+    meta = {"size": num_words, "dim": dim, "dtype": "float32",
+            "table_size": mask + 1, "fingerprint": fingerprint}
+    with open(os.path.join(path, META_FILE), "w") as fout:
+        json.dump(meta, fout, indent=2)
+
+    return fingerprint
+
+
+# pkl_path: Path of the pickled dictionary of word2vec representations (w2v.pkl)
+# store_path: The directory where the store will be written
+# Returns: The fingerprint of the written store
+#
+# One-time conversion from the pickled dictionary to a memory-mapped store.
+def convert_w2v(pkl_path, store_path):
+    with open(pkl_path, "rb") as fin:
+        word2vec = pkl.load(fin)
+
+    words = list(word2vec.keys())
+    dim = len(word2vec[words[0]]) if words else 0
+    return write_store(store_path, words, (word2vec[w] for w in words), dim)
+
+
+# path: The directory containing the store
+# modes: The quantized modes to write ("float16" and/or "int8")
+# Returns: This function does not return any values
+#
+# This function writes the quantized versions of the vectors next to the
+# float32 matrix, so that the mode can be chosen when the store is loaded.
+# float16 simply halves the precision, while int8 stores each row as integers
+# in [-127, 127] together with a float32 scale per row (max(|row|) / 127).
+def quantize_store(path, modes):
+    matrix = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+
+    for mode in modes:
+        if mode not in MODES[1:]:
+            raise ValueError("Unknown quantized mode '{0}', expected one of: {1}".format(mode, ", ".join(MODES[1:])))
+
+        dtype = np.float16 if mode == "float16" else np.int8
+        quantized = np.lib.format.open_memmap(os.path.join(path, MODE_FILES[mode]), mode="w+",
+                                              dtype=dtype, shape=matrix.shape)
+        if mode == "int8":
+            scales = np.lib.format.open_memmap(os.path.join(path, SCALES_FILE), mode="w+",
+                                               dtype=np.float32, shape=(matrix.shape[0],))
+
+        for start in range(0, matrix.shape[0], _HASH_BLOCK):
+            block = np.asarray(matrix[start:start + _HASH_BLOCK], dtype=np.float32)
+            if mode == "float16":
+                quantized[start:start + len(block)] = block.astype(np.float16)
+            else:
+                block_scales = np.abs(block).max(axis=1) / 127
+                block_scales[block_scales == 0] = 1
+                quantized[start:start + len(block)] = np.rint(block / block_scales[:, None]).astype(np.int8)
+                scales[start:start + len(block)] = block_scales
+
+        quantized.flush()
+        if mode == "int8":
+            scales.flush()
+
+
+# path: A path
+# Returns: True if the path is an embedding store directory
+def is_store(path):
+    return os.path.isfile(os.path.join(path, META_FILE))
+
+
+# An embedding store opened with np.memmap.
+#
+# It exposes the same dictionary-like interface ("in" and "[]") of the pickled
+# word2vec representations, so it can be used by utils.w2v and utils.string2vec
+# without any change, plus some helpers to work with row indices directly.
+#
+# The vectors can be loaded in any of the MODES written for the store: in the
+# quantized modes self.vectors holds the quantized matrix, and gather (or "[]")
+# returns the dequantized float32 vectors.
+class EmbeddingStore:
+
+    # path: The directory containing the store
+    # mode: One of MODES
+    def __init__(self, path, mode="float32"):
+        with open(os.path.join(path, META_FILE)) as fin:
+            self.meta = json.load(fin)
+        if mode not in MODES:
+            raise ValueError("Unknown mode '{0}', expected one of: {1}".format(mode, ", ".join(MODES)))
+        if not os.path.isfile(os.path.join(path, MODE_FILES[mode])):
+            raise FileNotFoundError("The store {0} has no {1} vectors, create them with: "
+                                    "python -m src.embedding_store quantize {0} {1}".format(path, mode))
+
+        self.path = path
+        self.mode = mode
+        self.dim = self.meta["dim"]
+        # Models trained on quantized vectors are different models
+        self.fingerprint = self.meta["fingerprint"] + ("" if mode == "float32" else ":" + mode)
+        self.vectors = np.load(os.path.join(path, MODE_FILES[mode]), mmap_mode="r")
+        self.scales = np.load(os.path.join(path, SCALES_FILE), mmap_mode="r") if mode == "int8" else None
+        self._offsets = np.memmap(os.path.join(path, OFFSETS_FILE), dtype="<i8", mode="r")
+        self._table = np.memmap(os.path.join(path, TABLE_FILE), dtype="<i8", mode="r")
+        self._mask = self.meta["table_size"] - 1
+        if os.path.getsize(os.path.join(path, WORDS_FILE)) > 0:
+            self._words = np.memmap(os.path.join(path, WORDS_FILE), dtype=np.uint8, mode="r")
+        else:
+            self._words = np.zeros(0, dtype=np.uint8)
+
+        # Lookups read single elements, which is much faster through memoryviews
+        # of the mapped files than through numpy scalars
+        self._table_view = memoryview(self._table).cast("B").cast("q")
+        self._offsets_view = memoryview(self._offsets).cast("B").cast("q")
+        self._words_view = memoryview(self._words)
+
+    def __len__(self):
+        return self.meta["size"]
+
+    def __contains__(self, token):
+        return self.index(token) >= 0
+
+    def __getitem__(self, token):
+        row = self.index(token)
+        if row < 0:
+            raise KeyError(token)
+        return self.vectors[row] if self.mode == "float32" else self.gather([row])[0]
+
+    # token: A string containing a single token
+    # default: The value returned if the token is not in the vocabulary
+    # Returns: The vector of the token, or default
+    def get(self, token, default=None):
+        return self[token] if token in self else default
+
+    # rows: A list (or numpy array) of rows of the matrix
+    # Returns: A float32 numpy array of shape (len(rows), dim) containing the vectors of the rows
+    #
+    # Quantized rows are dequantized all at once, after reading them.
+    def gather(self, rows):
+        vectors = np.asarray(self.vectors[rows], dtype=np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[rows][:, None]
+        return vectors
+
+    # Returns: The memory (in bytes) taken by the vectors
+    def nbytes(self):
+        return self.vectors.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    # token: A string containing a single token
+    # Returns: The row of the token in the matrix, or -1 if it's not in the vocabulary
+    def index(self, token):
+        word_bytes = _encode(token)
+        table, offsets, words = self._table_view, self._offsets_view, self._words_view
+        slot = _slot(word_bytes, self._mask)
+        while True:
+            row = table[slot]
+            if row < 0:
+                return -1
+            if words[offsets[row]:offsets[row + 1]] == word_bytes:
+                return row
+            slot = (slot + 1) & self._mask
+
+    # tokens: A list of strings
+    # Returns: A numpy array of rows (-1 for tokens not in the vocabulary)
+    def lookup(self, tokens):
+        return np.fromiter((self.index(tkn) for tkn in tokens), dtype=np.int64, count=len(tokens))
+
+    # row: A row of the matrix
+    # Returns: The word associated to that row
+    def word(self, row):
+        start, end = self._offsets_view[row], self._offsets_view[row + 1]
+        return bytes(self._words_view[start:end]).decode("utf-8", "surrogatepass")
+
+    # Returns: An iterator over the vocabulary, in row order
+    def words(self):
+        for row in range(len(self)):
+            yield self.word(row)
+
+
+# path: The directory containing the store
+# mode: One of MODES
+# Returns: An EmbeddingStore
+def load_store(path, mode="float32"):
+    return EmbeddingStore(path, mode)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create and quantize memory-mapped embedding stores.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="Convert the pickled word2vec representations to a store")
+    convert.add_argument("pkl", help="Path of w2v.pkl")
+    convert.add_argument("store", help="Directory of the store")
+    quantize = commands.add_parser("quantize", help="Add quantized versions of the vectors to a store")
+    quantize.add_argument("store", help="Directory of the store")
+    quantize.add_argument("modes", nargs="+", choices=MODES[1:])
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        print("Converting {0} to {1}...".format(args.pkl, args.store))
+        print("Done! Fingerprint: {0}".format(convert_w2v(args.pkl, args.store)))
+    else:
+        print("Quantizing {0} ({1})...".format(args.store, ", ".join(args.modes)))
+        quantize_store(args.store, args.modes)
+        print("Done!")
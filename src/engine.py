@@ -0,0 +1,145 @@
+import src.utils as utils
+import src.bot_fsa as fsa
+import src.metrics as metrics
+from src.results_store import SessionRecord
+
+
+# The conversation engine.
+#
+# It holds the resources shared by all the conversations (the trained model and
+# the Word2Vec representations) and drives the FSA of each Session: the console
+# (run.py) and the server (src/server.py) are simply clients that move lines of
+# text between the user and the engine.
+class ConversationEngine:
+
+    # model: A trained classification model (None if it's provided by loader)
+    # word2vec: The pretrained Word2Vec model (None if it's provided by loader)
+    # scheduler: An optional InferenceScheduler, used to classify in batches the
+    #            health checks of concurrent conversations (see src/scheduler.py)
+    # loader: An optional function returning the model and the Word2Vec model,
+    #         called the first time they're needed (see src/warmup.py)
+    # cache: An optional SentenceCache, used to skip the inputs already
+    #        classified (see src/sentence_cache.py)
+    # model_key: The key of the model artifact, if known (see src/model_cache.py)
+    # profiler: An optional SlowTurnProfiler, profiling the slow turns (see src/metrics.py)
+    # logit_table: An optional LogitTable, used instead of the model and the
+    #              Word2Vec model (which can then be None, see src/logit_table.py)
+    # results: An optional ResultsLog, where the outcome of each conversation is
+    #          saved when it's closed (see src/results_store.py)
+    def __init__(self, model, word2vec, scheduler=None, loader=None, cache=None, model_key=None, profiler=None,
+                 logit_table=None, results=None):
+        # The model and its key are swapped together (see swap_model)
+        self._model = (model, model_key)
+        self.word2vec = word2vec
+        self.scheduler = scheduler
+        if scheduler is not None:
+            # The batches are classified by the live model (see swap_model)
+            scheduler.source = lambda: self._model
+        self.loader = loader
+        self.cache = cache
+        self.profiler = profiler
+        self.logit_table = logit_table
+        self.results = results
+        self.active_sessions = 0
+
+    @property
+    def model(self):
+        return self._model[0]
+
+    @property
+    def model_key(self):
+        return self._model[1]
+
+    # model: A trained classification model
+    # model_key: The key identifying the model (it must change with the weights, as it invalidates the cache)
+    # Returns: This function does not return any values
+    #
+    # Replaces the live model (e.g. with one updated by src/online_learning.py).
+    # The health checks already running finish with the old model, the next ones
+    # use the new one: a single reference is replaced (the scheduler reads it
+    # too), so a health check never sees the new weights with the old key or
+    # the other way around.
+    def swap_model(self, model, model_key=None):
+        self._model = (model, model_key)
+
+    # session_id: An optional identifier for the session
+    # Returns: A new Session, and the list of messages that open the conversation
+    def open_session(self, session_id=None):
+        session = fsa.Session(session_id)
+        self.active_sessions += 1
+        return session, fsa.welcome_state(session)
+
+    # session: A Session opened by this engine
+    # Returns: This function does not return any values
+    def close_session(self, session):
+        self.active_sessions -= 1
+        if self.results is not None:
+            # Only queued: the log is written in the background
+            self.results.append(SessionRecord.from_session(session))
+
+    # user_input: A string of arbitrary length
+    # Returns: The label predicted by the model
+    def classify(self, user_input):
+        if self.logit_table is not None:
+            with metrics.STEP_SECONDS.time('logit_table'):
+                return self.logit_table.predict_one(user_input)
+        if self.model is None:
+            model, self.word2vec = self.loader()
+            self.swap_model(model)
+        model, model_key = self._model
+        if self.cache is not None:
+            return self.cache.predict(model, self.word2vec, user_input, model_key)
+        w2v_test = utils.string2vec(self.word2vec, user_input)
+        with metrics.STEP_SECONDS.time('predict'):
+            return model.predict(w2v_test.reshape(1, -1))[0]
+
+    # user_input: A string of arbitrary length
+    # Returns: The label predicted by the model
+    async def classify_async(self, user_input):
+        if self.scheduler is None or self.logit_table is not None:
+            return self.classify(user_input)
+        if self.cache is None or self.cache.predictions is None:
+            return await self.scheduler.predict(user_input)
+
+        # Only the inputs that aren't cached go through the batches
+        model, model_key = self._model
+        key = self.cache.key(user_input)
+        generation = self.cache.prediction_generation(model, self.word2vec, model_key)
+        label = self.cache.predictions.get(key, generation)
+        if label is None:
+            # The model may be swapped while the input waits for its batch:
+            # the label is cached under the model that actually predicted it
+            label, (model, model_key) = await self.scheduler.predict_with_model(user_input)
+            self.cache.predictions.put(key, self.cache.prediction_generation(model, self.word2vec, model_key), label)
+        return label
+
+    # session: A Session opened by this engine
+    # user_input: A string of arbitrary length
+    # Returns: A list of messages for the user
+    def handle(self, session, user_input):
+        with self._turn(session.state):
+            replies = fsa.transition(session, user_input)
+            if session.pending is not None:
+                replies += fsa.health_result_state(session, self.classify(session.pending))
+        return replies
+
+    # session: A Session opened by this engine
+    # user_input: A string of arbitrary length
+    # Returns: A list of messages for the user
+    #
+    # Same as handle, but the health model can be awaited, so that other
+    # conversations can go on in the meantime.
+    async def handle_async(self, session, user_input):
+        with self._turn(session.state):
+            replies = fsa.transition(session, user_input)
+            if session.pending is not None:
+                replies += fsa.health_result_state(session, await self.classify_async(session.pending))
+        return replies
+
+    # state: The state of the conversation at the start of the turn
+    # Returns: A context manager timing the turn (and profiling it, if there's a profiler)
+    def _turn(self, state):
+        if self.profiler is None:
+            return metrics.TURN_SECONDS.time(state)
+        return self.profiler.turn(state)
+
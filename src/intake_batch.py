@@ -0,0 +1,94 @@
+import os
+import argparse
+import collections
+
+import src.bot_fsa as fsa
+import src.batch as batch
+
+# Columns of the output file
+FIELDS = ['id', 'name', 'dob', 'status']
+
+# Parse statuses of the intake lines
+OK = 'ok'
+MISSING_NAME = 'missing_name'
+MISSING_DOB = 'missing_dob'
+MISSING_BOTH = 'missing_name_and_dob'
+STATUSES = [OK, MISSING_NAME, MISSING_DOB, MISSING_BOTH]
+
+
+# fname: Path of a text file with one intake per line, or of a CSV or JSONL file (see batch.read_texts)
+# text_field, id_field, file_format: See batch.read_texts
+# Returns: An iterator over (id, text) pairs (the id of a line of a text file is its line number)
+def read_intakes(fname, text_field='text', id_field='id', file_format=None):
+    if file_format is None and os.path.splitext(fname)[1].lower() not in ('.csv', '.jsonl', '.json'):
+        file_format = 'txt'
+    if file_format != 'txt':
+        yield from batch.read_texts(fname, text_field, id_field, file_format)
+        return
+
+    with open(fname, encoding='utf-8') as fin:
+        for num, line in enumerate(fin, 1):
+            yield num, line.rstrip('\r\n')
+
+
+# name: The name extracted from an intake ('' if missing)
+# dob: The date of birth extracted from an intake ('' if missing)
+# Returns: The parse status of the intake
+def parse_status(name, dob):
+    if name == '':
+        return MISSING_BOTH if dob == '' else MISSING_NAME
+    return MISSING_DOB if dob == '' else OK
+
+
+# chunk: A list of (id, text) pairs
+# Returns: A list of output rows, one for each intake
+#
+# The names and dates of birth are extracted exactly like the bot does (see
+# bot_fsa.extract_user_info), with the patterns compiled once per process.
+def extract_chunk(chunk):
+    rows = []
+    for intake_id, text in chunk:
+        name, dob = fsa.extract_user_info(text)
+        rows.append([intake_id, name, dob, parse_status(name, dob)])
+    return rows
+
+
+# in_fname: Path of the input file (see read_intakes)
+# out_fname: Path of the output CSV file
+# workers: The number of worker processes (1 to run everything in this process)
+# chunk_size: The number of intakes processed by a worker at a time
+# text_field, id_field, file_format: See read_intakes
+# Returns: A Counter with the number of intakes of each parse status
+#
+# This function extracts the name and date of birth of every intake of a
+# file, streaming it in chunks through a process pool.
+def extract_intakes(in_fname, out_fname, workers=None, chunk_size=10000, text_field='text', id_field='id',
+                    file_format=None):
+    chunks = batch.chunked(read_intakes(in_fname, text_field, id_field, file_format), chunk_size)
+
+    statuses = collections.Counter()
+    batch.write_chunks(chunks, out_fname, FIELDS, extract_chunk, workers, 'intakes', 'extracted',
+                       lambda rows: statuses.update(row[3] for row in rows))
+    return statuses
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract names and dates of birth from intake forms in bulk.')
+    parser.add_argument('input', help='Text file with one intake per line (or a CSV or JSONL file)')
+    parser.add_argument('output', help='CSV file where the results are written')
+    parser.add_argument('--text-field', default='text', help='Column (or key) of the intakes in CSV and JSONL files')
+    parser.add_argument('--id-field', default='id', help='Column (or key) of the ids in CSV and JSONL files')
+    parser.add_argument('--format', choices=['txt', 'csv', 'jsonl'], default=None,
+                        help='Format of the input (guessed from the extension by default)')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: all cores)')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='Number of intakes sent to a worker at a time')
+    args = parser.parse_args()
+
+    statuses = extract_intakes(args.input, args.output, args.workers, args.chunk_size, args.text_field,
+                               args.id_field, args.format)
+
+    total = sum(statuses.values())
+    print('Parsed:   {0} ({1:.2%})'.format(statuses[OK], statuses[OK] / max(total, 1)))
+    print('Rejected: {0}'.format(total - statuses[OK]))
+    for status in STATUSES[1:]:
+        print('   {0:<22} {1}'.format(status, statuses[status]))
@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+
+import src.utils as utils
+import src.model_cache as cache
+import src.embedding_store as store
+
+# Default location of the logit table of the health model
+LOGIT_TABLE = os.path.join("data", "logit_table")
+# File (in the table directory) with the intercept and the classes of the model
+LOGIT_META_FILE = "logit.json"
+
+TEST_FILE = os.path.join("data", "test.csv")
+
+
+# model: A trained binary linear model (with coef_ and intercept_, e.g. LogisticRegression)
+# word2vec: The Word2Vec representations the model was trained on
+# path: The directory where the table is written
+# model_key: The key of the model artifact, if known (see src/model_cache.py)
+# block_size: The number of vectors multiplied at a time
+# Returns: The fingerprint of the written table
+#
+# The health model scores the mean of the word vectors of a sentence, so its
+# score is the mean of the scores of the single words (w . v) plus the
+# intercept: this function computes the score of every word of the vocabulary
+# once, and writes them as an embedding store with a single dimension, so the
+# table is looked up exactly like the embeddings.
+def export_logit_table(model, word2vec, path, model_key=None, block_size=65536):
+    coef = getattr(model, 'coef_', None)
+    if coef is None or coef.shape[0] != 1:
+        raise ValueError('The logit table needs a binary linear model, not {0}'.format(type(model).__name__))
+    weights = np.asarray(coef[0], dtype=np.float64)
+
+    if hasattr(word2vec, 'gather'):
+        words = list(word2vec.words())
+        scores = np.empty(len(word2vec), dtype=np.float64)
+        for start in range(0, len(word2vec), block_size):
+            rows = np.arange(start, min(start + block_size, len(word2vec)))
+            scores[start:start + len(rows)] = word2vec.gather(rows) @ weights
+    else:
+        words = list(word2vec.keys())
+        scores = np.fromiter((np.dot(np.asarray(word2vec[word], dtype=np.float64), weights) for word in words),
+                             dtype=np.float64, count=len(words))
+
+    fingerprint = store.write_store(path, words, scores.reshape(-1, 1), 1)
+    meta = {'intercept': float(model.intercept_[0]), 'classes': [int(label) for label in model.classes_],
+            'model_key': model_key, 'embedding_fingerprint': getattr(word2vec, 'fingerprint', None)}
+    with open(os.path.join(path, LOGIT_META_FILE), 'w') as fout:
+        json.dump(meta, fout, indent=2)
+    return fingerprint
+
+
+# The health model reduced to one score per word.
+#
+# Classifying a sentence only needs the scores of its tokens (one scalar
+# lookup each) and their mean: neither the 300-dimensional vectors nor the
+# model are needed at request time. As in string2vec, tokens that aren't in the
+# vocabulary count as zero vectors, so they count in the mean with a score of 0.
+class LogitTable:
+
+    # path: The directory containing the table
+    # model_key: The key of the model the table must have been exported from, if known
+    # embedding_fingerprint: The fingerprint of the embeddings it must have been exported from, if known
+    # Raises: ValueError if the table was exported from another model or other embeddings
+    def __init__(self, path, model_key=None, embedding_fingerprint=None):
+        with open(os.path.join(path, LOGIT_META_FILE)) as fin:
+            self.meta = json.load(fin)
+        for field, expected in (('model_key', model_key), ('embedding_fingerprint', embedding_fingerprint)):
+            if expected is not None and self.meta.get(field) != expected:
+                raise ValueError('The logit table {0} is out of date ({1} {2}, expected {3}), export it again '
+                                 'with: python -m src.logit_table {0}'.format(path, field, self.meta.get(field),
+                                                                              expected))
+        self.store = store.load_store(path)
+        self.scores = self.store.vectors[:, 0]
+        # Single elements are much faster to read through a memoryview than through numpy scalars
+        self._scores_view = memoryview(self.store.vectors).cast('B').cast('f')
+        self.intercept = self.meta['intercept']
+        self.classes = self.meta['classes']
+        self.fingerprint = self.store.fingerprint
+
+    def __len__(self):
+        return len(self.store)
+
+    # user_input: A string of arbitrary length
+    # Returns: The score of the health model for the input (the logit of the positive class)
+    def score(self, user_input):
+        tokens = utils.get_tokens(utils.preprocessing(user_input))
+        if len(tokens) == 0:
+            return self.intercept
+        total = 0.0
+        for tkn in tokens:
+            row = self.store.index(tkn)
+            if row >= 0:
+                total += self._scores_view[row]
+        return total / len(tokens) + self.intercept
+
+    # documents: A list of strings of arbitrary length
+    # Returns: A numpy array with the score of each document
+    def decision_function(self, documents):
+        return np.fromiter((self.score(doc) for doc in documents), dtype=np.float64, count=len(documents))
+
+    # user_input: A string of arbitrary length
+    # Returns: The label predicted by the health model
+    def predict_one(self, user_input):
+        return self.classes[1] if self.score(user_input) > 0 else self.classes[0]
+
+    # documents: A list of strings of arbitrary length
+    # Returns: A numpy array with the label predicted for each document
+    def predict(self, documents):
+        return np.where(self.decision_function(documents) > 0, self.classes[1], self.classes[0])
+
+
+# table: A LogitTable
+# model: The model the table was exported from
+# word2vec: The Word2Vec representations the model was trained on
+# test_path: A labeled dataset (see utils.iter_batches)
+# Returns: A dictionary with the agreement of the predictions, the largest difference of the scores, and the
+#          average time per document of the two predictors
+def check_parity(table, model, word2vec, test_path=TEST_FILE):
+    test_data, _ = utils.load_as_list(test_path)
+
+    start = time.perf_counter()
+    expected = [model.predict(utils.string2vec_batch(word2vec, [doc]))[0] for doc in test_data]
+    model_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    predicted = [table.predict_one(doc) for doc in test_data]
+    table_time = time.perf_counter() - start
+
+    score_diff = np.abs(table.decision_function(test_data) -
+                        model.decision_function(utils.string2vec_batch(word2vec, test_data)))
+    agree = sum(1 for label, expected_label in zip(predicted, expected) if label == expected_label)
+    count = max(len(test_data), 1)
+    return {'documents': len(test_data), 'agreement': agree / count, 'mismatches': len(test_data) - agree,
+            'max_score_diff': float(score_diff.max()) if len(score_diff) > 0 else 0.0,
+            'model_ms_per_doc': model_time / count * 1000, 'table_ms_per_doc': table_time / count * 1000}
+
+
+# model: A trained binary linear model
+# word2vec: The Word2Vec representations the model was trained on
+# path: The directory of the table (an existing table is replaced)
+# model_key: The key of the model artifact, if known
+# test_path: A labeled dataset (see check_parity)
+# Returns: The parity report of the table (see check_parity)
+# Raises: ValueError if the table disagrees with the model, leaving path untouched
+#
+# The table is exported next to path, and renamed into place only once it
+# predicts the same labels as the model, so a server never loads a table that
+# is partially written or wrong.
+def publish_logit_table(model, word2vec, path, model_key=None, test_path=TEST_FILE):
+    path = os.path.normpath(path)
+    tmp_path = '{0}.tmp-{1}'.format(path, os.getpid())
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    try:
+        export_logit_table(model, word2vec, tmp_path, model_key)
+        table = LogitTable(tmp_path, model_key, getattr(word2vec, 'fingerprint', None))
+        report = check_parity(table, model, word2vec, test_path)
+        if report['mismatches'] > 0:
+            raise ValueError('The table disagrees with the model on {0} of {1} documents'.format(
+                report['mismatches'], report['documents']))
+
+        # A directory can't replace another one: the old table is moved aside first
+        old_path = '{0}.old-{1}'.format(path, os.getpid())
+        if os.path.exists(path):
+            os.replace(path, old_path)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(old_path):
+                os.replace(old_path, path)
+            raise
+        shutil.rmtree(old_path, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the health model as a table of per-word scores.')
+    parser.add_argument('output', nargs='?', default=LOGIT_TABLE, help='Directory of the logit table')
+    parser.add_argument('--embeddings', default=utils.default_embedding_path())
+    parser.add_argument('--embedding-mode', default='float32', choices=store.MODES)
+    parser.add_argument('--dataset', default=os.path.join('data', 'dataset.csv'))
+    parser.add_argument('--test', default=TEST_FILE, help='Dataset used to check the parity with the model')
+    args = parser.parse_args()
+
+    word2vec = utils.load_w2v(args.embeddings, args.embedding_mode)
+    model, model_key = cache.load_or_train(LogisticRegression(), word2vec, args.dataset, args.embeddings)
+
+    start = time.perf_counter()
+    try:
+        report = publish_logit_table(model, word2vec, args.output, model_key, args.test)
+    except ValueError as err:
+        raise SystemExit('{0}, {1} was not written'.format(err, args.output))
+    table = LogitTable(args.output, model_key)
+    print('Exported and checked {0} word scores to {1} in {2:.2f}s'.format(len(table), args.output,
+                                                                          time.perf_counter() - start))
+    print('Parity on {0}: {1:.2%} of {2} predictions agree (max score difference: {3:.2e})'.format(
+        args.test, report['agreement'], report['documents'], report['max_score_diff']))
+    print('Time per document: {0:.3f} ms with the model, {1:.3f} ms with the table'.format(
+        report['model_ms_per_doc'], report['table_ms_per_doc']))
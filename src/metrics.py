@@ -0,0 +1,321 @@
+import os
+import sys
+import time
+import bisect
+import functools
+import tempfile
+import threading
+import collections
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds (in seconds) of the buckets of the latency histograms
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+# All the metrics, in the order they're exposed
+_registry = []
+
+
+# labels: The names of the labels of a metric
+# values: The values of those labels
+# extra: An optional additional label (name, value)
+# Returns: The labels formatted for the Prometheus text format
+def _format_labels(labels, values, extra=None):
+    pairs = list(zip(labels, values))
+    if extra is not None:
+        pairs.append(extra)
+    if len(pairs) == 0:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join('{0}="{1}"'.format(name, value) for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+# A monotonic counter, with one value for each combination of its labels.
+class Counter:
+
+    # name: The name of the metric
+    # doc: Its description
+    # labels: The names of its labels
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._values = collections.defaultdict(int)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    # values: The values of the labels
+    # amount: The increment
+    # Returns: This function does not return any values
+    def inc(self, *values, amount=1):
+        with self._lock:
+            self._values[values] += amount
+
+    # values: The values of the labels
+    # Returns: The current value of the counter
+    def value(self, *values):
+        return self._values.get(values, 0)
+
+    # Returns: The lines of the metric in the Prometheus text format
+    def render(self):
+        lines = ['# HELP {0} {1}'.format(self.name, self.doc), '# TYPE {0} counter'.format(self.name)]
+        with self._lock:
+            for values, count in sorted(self._values.items()):
+                lines.append('{0}{1} {2}'.format(self.name, _format_labels(self.labels, values), count))
+        return lines
+
+
+# Times a block of code into a histogram (see Histogram.time).
+class _Timer:
+    __slots__ = ('histogram', 'values', 'start')
+
+    def __init__(self, histogram, values):
+        self.histogram = histogram
+        self.values = values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.values)
+
+
+# A histogram of observed values (latencies, by default), with one series for
+# each combination of its labels. Observing a value only costs a binary search
+# among the buckets and a few increments.
+class Histogram:
+
+    # name: The name of the metric
+    # doc: Its description
+    # labels: The names of its labels
+    # buckets: The sorted upper bounds of the buckets (+Inf is added automatically)
+    def __init__(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Label values -> [count of each bucket (not cumulative) and of +Inf, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    # value: The observed value
+    # values: The values of the labels
+    # Returns: This function does not return any values
+    def observe(self, value, *values):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][idx] += 1
+            series[1] += value
+
+    # values: The values of the labels
+    # Returns: A context manager that observes the seconds spent in its block
+    def time(self, *values):
+        return _Timer(self, values)
+
+    # values: The values of the labels
+    # Returns: The number of observations, and their sum
+    def count(self, *values):
+        series = self._series.get(values)
+        if series is None:
+            return 0, 0.0
+        return sum(series[0]), series[1]
+
+    # Returns: The lines of the metric in the Prometheus text format
+    def render(self):
+        lines = ['# HELP {0} {1}'.format(self.name, self.doc), '# TYPE {0} histogram'.format(self.name)]
+        with self._lock:
+            series = sorted((values, list(counts), total) for values, (counts, total) in self._series.items())
+        for values, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('{0}_bucket{1} {2}'.format(self.name, _format_labels(self.labels, values, ('le', le)),
+                                                        cumulative))
+            lines.append('{0}_sum{1} {2}'.format(self.name, _format_labels(self.labels, values), total))
+            lines.append('{0}_count{1} {2}'.format(self.name, _format_labels(self.labels, values), cumulative))
+        return lines
+
+
+# The metrics of the bot
+TURN_SECONDS = Histogram('carebot_turn_seconds', 'Time to answer a user input, by state of the conversation',
+                         ['state'])
+STATE_SECONDS = Histogram('carebot_state_seconds', 'Time spent in the transition of each state of the FSA',
+                          ['state'])
+STEP_SECONDS = Histogram('carebot_step_seconds', 'Time spent in the internal steps of a turn', ['step'])
+TRANSITIONS = Counter('carebot_transitions_total', 'Transitions between the states of the FSA', ['source', 'target'])
+SESSIONS = Counter('carebot_sessions_total', 'Conversations started')
+SLOW_TURNS = Counter('carebot_slow_turns_total', 'Turns slower than the profiling threshold', ['state'])
+
+
+# histogram: A Histogram
+# values: The values of its labels
+# Returns: A decorator that observes the seconds spent in each call of the function
+def timed(histogram, *values):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Timer(histogram, values):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Returns: All the metrics in the Prometheus text format
+def render():
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    return '\n'.join(lines) + '\n'
+
+
+# path: The file to write (e.g. in the directory of the textfile collector of node_exporter)
+# Returns: This function does not return any values
+#
+# The file is replaced atomically, so a scraper never reads it half written.
+def write_textfile(path):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as fout:
+            fout.write(render())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# port: The port of the endpoint
+# host: The address to listen on
+# Returns: The HTTP server, serving /metrics in a background thread
+def start_http_server(port, host='127.0.0.1'):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='carebot-metrics', daemon=True).start()
+    return server
+
+
+# frame: A stack frame
+# Returns: The stack, from the outermost call, in the folded format of flamegraph.pl
+def _fold(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{0}:{1}'.format(os.path.basename(code.co_filename), code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+# A profiled turn (see SlowTurnProfiler.turn).
+class _Turn:
+    __slots__ = ('profiler', 'state', 'thread_id', 'stacks', 'start')
+
+    def __init__(self, profiler, state):
+        self.profiler = profiler
+        self.state = state
+        self.thread_id = threading.get_ident()
+        self.stacks = collections.Counter()
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.profiler._begin(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler._end(self, time.perf_counter() - self.start)
+
+
+# A sampling profiler for slow turns.
+#
+# While a turn is running, a background thread samples the stack of the thread
+# running it every interval_ms milliseconds. When a turn takes longer than
+# threshold_ms, its samples are written in the folded format (one stack per
+# line, followed by its number of samples), ready for flamegraph.pl or
+# speedscope; the samples of fast turns are simply dropped. In the server many
+# turns run in the same thread, so the profile of a slow turn also contains
+# the work done by the other conversations in the meantime. The sampler needs
+# the GIL, so while a turn runs Python code the samples are taken at most every
+# sys.getswitchinterval() seconds (5 ms by default).
+class SlowTurnProfiler:
+
+    # threshold_ms: The minimum duration of the profiled turns
+    # output_dir: The directory where the profiles are written
+    # interval_ms: The sampling interval
+    def __init__(self, threshold_ms=250.0, output_dir='profiles', interval_ms=1.0):
+        self.threshold = threshold_ms / 1000
+        self.output_dir = output_dir
+        self.interval = interval_ms / 1000
+        self.profiles = 0
+        self._active = set()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._sample, name='carebot-profiler', daemon=True)
+        self._thread.start()
+
+    # state: The state of the conversation at the start of the turn
+    # Returns: A context manager profiling its block (and observing its duration in TURN_SECONDS)
+    def turn(self, state):
+        return _Turn(self, state)
+
+    def _begin(self, turn):
+        with self._lock:
+            self._active.add(turn)
+
+    def _end(self, turn, duration):
+        with self._lock:
+            self._active.discard(turn)
+        TURN_SECONDS.observe(duration, turn.state)
+        if duration >= self.threshold:
+            SLOW_TURNS.inc(turn.state)
+            self.dump(turn, duration)
+
+    # Returns: This function does not return any values
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            if len(self._active) == 0:
+                continue
+            frames = sys._current_frames()
+            with self._lock:
+                # The turns of the event loop share a thread: its stack is folded once per tick
+                folded = {}
+                for turn in self._active:
+                    if turn.thread_id not in folded:
+                        frame = frames.get(turn.thread_id)
+                        folded[turn.thread_id] = _fold(frame) if frame is not None else None
+                    if folded[turn.thread_id] is not None:
+                        turn.stacks[folded[turn.thread_id]] += 1
+
+    # turn: A profiled turn
+    # duration: Its duration in seconds
+    # Returns: The path of the profile, or None if no samples were taken
+    def dump(self, turn, duration):
+        if len(turn.stacks) == 0:
+            return None
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.profiles += 1
+        path = os.path.join(self.output_dir, 'turn-{0}-{1}-{2}-{3:.0f}ms.folded'.format(
+            time.strftime('%Y%m%d-%H%M%S'), self.profiles, turn.state, duration * 1000))
+        with open(path, 'w') as fout:
+            for stack, count in turn.stacks.most_common():
+                fout.write('{0} {1}\n'.format(stack, count))
+        return path
@@ -0,0 +1,117 @@
+import os
+import glob
+import contextlib
+import json
+import hashlib
+import tempfile
+import pickle as pkl
+import sklearn
+
+import src.embedding_store as store
+import src.train_and_test as ai
+
+# Directory containing the trained model artifacts
+MODEL_CACHE_DIR = os.path.join("data", "models")
+
+# Bump this when the way models are trained changes, to invalidate all the artifacts
+ARTIFACT_VERSION = 1
+
+
+# embedding_path: Path of w2v.pkl, or of an embedding store directory
+# word2vec: The Word2Vec representations loaded from that path, if available
+# Returns: A string identifying the content of the embeddings
+#
+# Embedding stores carry the hash of their content (computed once, when they're
+# written, and including the mode they're loaded in), while for the pickle file
+# the size and modification time are used, to avoid reading several GB at every start.
+def embedding_fingerprint(embedding_path, word2vec=None):
+    if hasattr(word2vec, 'fingerprint'):
+        return word2vec.fingerprint
+    if store.is_store(embedding_path):
+        with open(os.path.join(embedding_path, store.META_FILE)) as fin:
+            return json.load(fin)["fingerprint"]
+
+    stat = os.stat(embedding_path)
+    return "{0}:{1}:{2}".format(os.path.abspath(embedding_path), stat.st_size, stat.st_mtime_ns)
+
+
+# model: An instantiated machine learning model
+# Returns: A string identifying the model class and its hyperparameters
+def model_fingerprint(model):
+    params = sorted((key, repr(value)) for key, value in model.get_params().items())
+    return "{0}.{1}:{2}".format(type(model).__module__, type(model).__name__, params)
+
+
+# model: An instantiated machine learning model
+# dataset_path: Path of the training dataset
+# embedding_path: Path of w2v.pkl, or of an embedding store directory
+# word2vec: The Word2Vec representations loaded from that path, if available
+# Returns: A string, the key of the model artifact
+#
+# The key changes whenever the dataset contents, the embeddings, the model
+# hyperparameters, or the version of scikit-learn change (its pickles aren't
+# guaranteed to load, or to predict the same, in another version).
+def artifact_key(model, dataset_path, embedding_path, word2vec=None):
+    digest = hashlib.sha256()
+    digest.update(str(ARTIFACT_VERSION).encode())
+    digest.update(sklearn.__version__.encode())
+    with open(dataset_path, "rb") as fin:
+        for block in iter(lambda: fin.read(1 << 20), b""):
+            digest.update(block)
+    digest.update(embedding_fingerprint(embedding_path, word2vec).encode())
+    digest.update(model_fingerprint(model).encode())
+    return digest.hexdigest()
+
+
+# model: The model to save
+# path: The path of the artifact
+# Returns: This function does not return any values
+#
+# The artifact is written to a temporary file and then renamed, so a process
+# starting at the same time never reads a partially written model.
+def _save_artifact(model, path):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fout:
+            pkl.dump(model, fout)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+# model: An instantiated (untrained) machine learning model
+# word2vec: The pretrained Word2Vec model
+# dataset_path: Path of the training dataset
+# embedding_path: Path of the embeddings used to load word2vec
+# cache_dir: Directory containing the model artifacts
+# Returns: The trained model, and the key of its artifact
+#
+# This function loads the trained model from the artifact cache if the dataset,
+# the embeddings, and the hyperparameters didn't change since it was trained.
+# Otherwise the model is trained, saved, and the stale artifacts of the same
+# model class are removed.
+def load_or_train(model, word2vec, dataset_path, embedding_path, cache_dir=MODEL_CACHE_DIR):
+    key = artifact_key(model, dataset_path, embedding_path, word2vec)
+    prefix = type(model).__name__
+    path = os.path.join(cache_dir, "{0}-{1}.pkl".format(prefix, key))
+
+    if os.path.isfile(path):
+        try:
+            with open(path, "rb") as fin:
+                return pkl.load(fin), key
+        except (OSError, EOFError, pkl.UnpicklingError):
+            # A corrupted artifact is simply rebuilt
+            pass
+
+    model = ai.train_model_stream(model, word2vec, dataset_path)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    _save_artifact(model, path)
+    for stale in glob.glob(os.path.join(cache_dir, "{0}-*.pkl".format(prefix))):
+        if stale != path:
+            # Another process (e.g. during a rolling deploy) may have removed it already
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(stale)
+
+    return model, key
@@ -0,0 +1,236 @@
+import os
+import csv
+import copy
+import json
+import time
+import asyncio
+import logging
+import argparse
+import pickle as pkl
+from sklearn.linear_model import SGDClassifier
+
+import src.utils as utils
+import src.model_cache as cache
+
+log = logging.getLogger(__name__)
+
+# Checkpoint of the model updated online
+ONLINE_CHECKPOINT = os.path.join(cache.MODEL_CACHE_DIR, "online.pkl")
+
+
+# Returns: An instantiated (untrained) model that can be updated with partial_fit
+def online_model():
+    return SGDClassifier(loss='log_loss', random_state=0)
+
+
+# state: The state of an online model (see OnlineLearner)
+# Returns: The key of that version of the model
+def online_key(state):
+    return '{0}+online{1}'.format(state['base_key'], state['version'])
+
+
+# line: A line of a labeled file: "text,label" (CSV) or {"text": ..., "label": ...} (JSONL)
+# jsonl: Whether the line is JSONL
+# Returns: The text and its label, or None for a CSV header
+# Raises: ValueError if the line is malformed or the label isn't 0 or 1
+def parse_labeled_line(line, jsonl=False):
+    if jsonl:
+        record = json.loads(line)
+        text, label = record['text'], record['label']
+    else:
+        row = next(csv.reader([line]))
+        if len(row) != 2:
+            raise ValueError('expected 2 columns, got {0}'.format(len(row)))
+        text, label = row
+        # The header, whatever its case (text,label or Lexicon,Label)
+        if label.strip().lower() == 'label':
+            return None
+
+    return text, utils.parse_label(label)
+
+
+# checkpoint_path: Path of the checkpoint
+# Returns: The content of the checkpoint (a dictionary), or None if there isn't a valid one
+def load_checkpoint(checkpoint_path):
+    try:
+        with open(checkpoint_path, 'rb') as fin:
+            return pkl.load(fin)
+    except (OSError, EOFError, pkl.UnpicklingError):
+        return None
+
+
+# word2vec: The pretrained Word2Vec model
+# dataset_path: Path of the training dataset
+# embedding_path: Path of the embeddings used to load word2vec
+# checkpoint_path: Path of the checkpoint of the online model
+# Returns: The model, and the state it was restored from (see OnlineLearner)
+#
+# The online model starts from the last checkpoint if it was built on top of
+# the same dataset and embeddings, otherwise from the model trained on the
+# whole dataset (which is cached like the other models).
+def bootstrap(word2vec, dataset_path, embedding_path, checkpoint_path=ONLINE_CHECKPOINT):
+    model, base_key = cache.load_or_train(online_model(), word2vec, dataset_path, embedding_path)
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint is not None and checkpoint['base_key'] == base_key:
+        return checkpoint['model'], checkpoint
+    return model, {'base_key': base_key, 'version': 0, 'examples': 0, 'source': None, 'offset': 0}
+
+
+# Updates the live model of a ConversationEngine with newly labeled utterances.
+#
+# Every chunk of utterances updates a copy of the current model with
+# partial_fit, which is then swapped into the engine: the cost of an update
+# only depends on the size of the chunk, and the conversations never see a
+# model halfway through an update. The weights are checkpointed periodically,
+# together with the position reached in the followed file, so a restart neither
+# loses the updates nor applies them twice.
+class OnlineLearner:
+
+    # engine: The ConversationEngine whose model is updated
+    # state: The checkpoint the model was restored from (see bootstrap)
+    # checkpoint_path: Path of the checkpoint
+    # chunk_size: The maximum number of utterances of an update
+    # checkpoint_interval: The minimum number of seconds between two checkpoints
+    def __init__(self, engine, state, checkpoint_path=ONLINE_CHECKPOINT, chunk_size=32, checkpoint_interval=60.0):
+        self.engine = engine
+        self.base_key = state['base_key']
+        self.version = state['version']
+        self.examples = state['examples']
+        self.source = state['source']
+        self.offset = state['offset']
+        self.checkpoint_path = checkpoint_path
+        self.chunk_size = chunk_size
+        self.checkpoint_interval = checkpoint_interval
+        self.rejected = 0
+        self.checkpoints = 0
+        self._last_checkpoint = time.monotonic()
+        self._dirty = False
+
+    # Returns: The key of the current version of the model
+    def model_key(self):
+        return online_key({'base_key': self.base_key, 'version': self.version})
+
+    # texts: A list of utterances
+    # labels: A list of integers (all 0 or 1)
+    # Returns: This function does not return any values
+    def learn(self, texts, labels):
+        model = copy.deepcopy(self.engine.model)
+        model.partial_fit(utils.string2vec_batch(self.engine.word2vec, texts), labels, classes=utils.LABELS)
+        self.version += 1
+        self.examples += len(texts)
+        self._dirty = True
+        self.engine.swap_model(model, self.model_key())
+
+    # Returns: This function does not return any values
+    def checkpoint(self):
+        state = {'model': self.engine.model, 'base_key': self.base_key, 'version': self.version,
+                 'examples': self.examples, 'source': self.source, 'offset': self.offset}
+        os.makedirs(os.path.dirname(self.checkpoint_path) or '.', exist_ok=True)
+        cache._save_artifact(state, self.checkpoint_path)
+        self.checkpoints += 1
+        self._last_checkpoint = time.monotonic()
+        self._dirty = False
+        log.info('Checkpoint %d saved (%d examples learned)', self.version, self.examples)
+
+    # Returns: This function does not return any values
+    def maybe_checkpoint(self):
+        if self._dirty and time.monotonic() - self._last_checkpoint >= self.checkpoint_interval:
+            self.checkpoint()
+
+    # fin: A labeled file opened in binary mode
+    # jsonl: Whether the file is JSONL
+    # complete: Whether the file is complete (otherwise it's still being written)
+    # Returns: The parsed utterances and labels, and whether the end of the file was reached
+    #
+    # Reads at most chunk_size utterances; a last line without a newline is
+    # left for the next call, unless the file is complete.
+    def read_chunk(self, fin, jsonl, complete=False):
+        texts, labels = [], []
+        fin.seek(self.offset)
+        while len(texts) < self.chunk_size:
+            line = fin.readline()
+            if len(line) == 0 or (not line.endswith(b'\n') and not complete):
+                return texts, labels, True
+            self.offset += len(line)
+            line = line.decode('utf-8').strip()
+            if not line:
+                continue
+            try:
+                example = parse_labeled_line(line, jsonl)
+            except (ValueError, KeyError) as err:
+                self.rejected += 1
+                log.warning('Rejected labeled line %r: %s', line, err)
+                continue
+            if example is not None:
+                texts.append(example[0])
+                labels.append(example[1])
+        return texts, labels, False
+
+    # path: A labeled file (CSV or JSONL) that is appended to while the bot runs
+    # poll_interval: Seconds between two checks for new lines
+    # Returns: This function does not return any values
+    #
+    # Follows the file (like tail -f) and learns from every new line, until it's
+    # cancelled. The updates run in a worker thread, so the conversations go on
+    # in the meantime.
+    async def follow(self, path, poll_interval=1.0):
+        source = os.path.abspath(path)
+        if source != self.source:
+            self.source, self.offset = source, 0
+        jsonl = os.path.splitext(path)[1].lower() in ('.jsonl', '.json')
+
+        try:
+            while True:
+                texts, labels, eof = [], [], True
+                if os.path.isfile(path):
+                    if os.path.getsize(path) < self.offset:
+                        log.warning('%s was truncated, following it from the start', path)
+                        self.offset = 0
+                    with open(path, 'rb') as fin:
+                        texts, labels, eof = self.read_chunk(fin, jsonl)
+                if len(texts) > 0:
+                    await asyncio.to_thread(self.learn, texts, labels)
+                self.maybe_checkpoint()
+                if eof:
+                    await asyncio.sleep(poll_interval)
+        finally:
+            if self._dirty:
+                self.checkpoint()
+
+    # Returns: A dictionary with the counters of the learner
+    def stats(self):
+        return {'version': self.version, 'examples': self.examples, 'rejected': self.rejected,
+                'checkpoints': self.checkpoints, 'offset': self.offset}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Update the online health model with newly labeled utterances.')
+    parser.add_argument('labeled', help='CSV (text,label) or JSONL ({"text": ..., "label": ...}) file')
+    parser.add_argument('--embeddings', default=utils.default_embedding_path())
+    parser.add_argument('--dataset', default=os.path.join('data', 'dataset.csv'))
+    parser.add_argument('--checkpoint', default=ONLINE_CHECKPOINT)
+    parser.add_argument('--chunk-size', type=int, default=256)
+    args = parser.parse_args()
+
+    from src.engine import ConversationEngine
+
+    word2vec = utils.load_w2v(args.embeddings)
+    model, state = bootstrap(word2vec, args.dataset, args.embeddings, args.checkpoint)
+    learner = OnlineLearner(ConversationEngine(model, word2vec), state, args.checkpoint, args.chunk_size)
+
+    # Only the lines added since the last update are learned
+    source = os.path.abspath(args.labeled)
+    if source != learner.source:
+        learner.source, learner.offset = source, 0
+    jsonl = os.path.splitext(args.labeled)[1].lower() in ('.jsonl', '.json')
+    start = time.perf_counter()
+    with open(args.labeled, 'rb') as fin:
+        eof = False
+        while not eof:
+            texts, labels, eof = learner.read_chunk(fin, jsonl, complete=True)
+            if len(texts) > 0:
+                learner.learn(texts, labels)
+    learner.checkpoint()
+
+    print('Learned {0} examples in {1:.2f}s ({2} rejected), model version {3}'.format(
+        learner.examples - state['examples'], time.perf_counter() - start, learner.rejected, learner.version))
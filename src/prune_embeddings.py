@@ -0,0 +1,167 @@
+import os
+import csv
+import json
+import argparse
+import collections
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+
+import src.utils as utils
+import src.embedding_store as store
+import src.train_and_test as ai
+
+DATASET_FILE = os.path.join("data", "dataset.csv")
+TEST_FILE = os.path.join("data", "test.csv")
+
+
+# fname: Path of a log of user inputs: a CSV or JSONL file (with the texts in
+#        text_field), or a plain text file with one input per line
+# text_field: The column (or key) containing the texts
+# Returns: An iterator over the texts
+def read_log(fname, text_field='text'):
+    ext = os.path.splitext(fname)[1].lower()
+    with open(fname, newline='', encoding='utf-8') as fin:
+        if ext == '.csv':
+            for row in csv.DictReader(fin):
+                yield row[text_field]
+        elif ext in ('.jsonl', '.json'):
+            for line in fin:
+                if line.strip():
+                    yield json.loads(line)[text_field]
+        else:
+            for line in fin:
+                yield line.rstrip('\n')
+
+
+# texts: An iterable of strings
+# profile: An optional Counter to update
+# Returns: A Counter with the frequency of each token
+#
+# Tokens are extracted exactly like string2vec does, so the profile counts the
+# lookups the bot would do on those texts.
+def build_profile(texts, profile=None):
+    profile = collections.Counter() if profile is None else profile
+    for text in texts:
+        profile.update(utils.get_tokens(utils.preprocessing(text)))
+    return profile
+
+
+# word2vec: The full embedding store
+# profile: A Counter with the frequency of each token
+# coverage: The fraction of the observed token occurrences (among the ones the full table knows) to keep
+# required: A set of tokens kept anyway (e.g. the words of the training lexicon)
+# Returns: A sorted numpy array with the rows to keep
+def select_rows(word2vec, profile, coverage, required=()):
+    known = []
+    for tkn, count in profile.items():
+        row = word2vec.index(tkn)
+        if row >= 0:
+            known.append((count, row))
+    known.sort(reverse=True)
+
+    rows = set()
+    target = coverage * sum(count for count, _ in known)
+    covered = 0
+    for count, row in known:
+        if covered >= target:
+            break
+        rows.add(row)
+        covered += count
+
+    for tkn in required:
+        row = word2vec.index(tkn)
+        if row >= 0:
+            rows.add(row)
+
+    # Keeping the original order keeps the most frequent words first
+    return np.array(sorted(rows), dtype=np.int64)
+
+
+# word2vec: An embedding (dictionary or store)
+# profile: A Counter with the frequency of each token
+# Returns: The fraction of the token occurrences that are out of vocabulary
+def oov_rate(word2vec, profile):
+    total = sum(profile.values())
+    oov = sum(count for tkn, count in profile.items() if tkn not in word2vec)
+    return oov / total if total > 0 else 0.0
+
+
+# word2vec: An embedding (dictionary or store)
+# dataset_path, test_path: Paths of the training and test datasets
+# Returns: Precision, recall, F1, and accuracy of the health model on the test data
+def evaluate(word2vec, dataset_path=DATASET_FILE, test_path=TEST_FILE):
+    model = ai.train_model_stream(LogisticRegression(), word2vec, dataset_path)
+    return ai.test_model_stream(model, word2vec, test_path)
+
+
+# full_path: Path of the full embedding store
+# out_path: Directory where the pruned store is written
+# logs: A list of paths of logs of user inputs (see read_log)
+# coverage: See select_rows
+# dataset_path, test_path: Paths of the training and test datasets (always profiled, and the words of the
+#                          training lexicon are always kept)
+# text_field: See read_log
+# Returns: A dictionary with the report of the pruning
+#
+# This function builds a trimmed embedding store containing only the words
+# actually seen by the bot, and measures what it costs: the OOV rate on the
+# profiled texts, and the metrics of the health model trained and tested with
+# the full and the pruned tables.
+def prune(full_path, out_path, logs=(), coverage=0.999, dataset_path=DATASET_FILE, test_path=TEST_FILE,
+          text_field='text'):
+    full = store.load_store(full_path)
+
+    lexicon, _ = utils.load_as_list(dataset_path)
+    test_data, _ = utils.load_as_list(test_path)
+    required = build_profile(lexicon)
+    profile = build_profile(test_data, collections.Counter(required))
+    for fname in logs:
+        build_profile(read_log(fname, text_field), profile)
+
+    rows = select_rows(full, profile, coverage, required)
+    store.write_store(out_path, [full.word(row) for row in rows], full.gather(rows), full.dim)
+    pruned = store.load_store(out_path)
+
+    report = {
+        'full_words': len(full),
+        'pruned_words': len(pruned),
+        'full_mb': full.nbytes() / 2 ** 20,
+        'pruned_mb': pruned.nbytes() / 2 ** 20,
+        'profiled_tokens': sum(profile.values()),
+        'distinct_tokens': len(profile),
+        'full_oov_rate': oov_rate(full, profile),
+        'pruned_oov_rate': oov_rate(pruned, profile),
+    }
+
+    names = ['precision', 'recall', 'f1', 'accuracy']
+    full_metrics, pruned_metrics = evaluate(full, dataset_path, test_path), evaluate(pruned, dataset_path, test_path)
+    for name, full_value, pruned_value in zip(names, full_metrics, pruned_metrics):
+        report['full_' + name] = full_value
+        report['pruned_' + name] = pruned_value
+        report[name + '_drop'] = full_value - pruned_value
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build an embedding store containing only the words seen by the bot.')
+    parser.add_argument('full', help='The full embedding store')
+    parser.add_argument('output', help='Directory of the pruned embedding store')
+    parser.add_argument('--logs', nargs='*', default=[], help='Logs of user inputs (CSV, JSONL or plain text)')
+    parser.add_argument('--text-field', default='text', help='Column (or key) of the texts in CSV and JSONL logs')
+    parser.add_argument('--coverage', type=float, default=0.999,
+                        help='Fraction of the observed tokens (known by the full table) to cover')
+    parser.add_argument('--dataset', default=DATASET_FILE)
+    parser.add_argument('--test', default=TEST_FILE)
+    args = parser.parse_args()
+
+    report = prune(args.full, args.output, args.logs, args.coverage, args.dataset, args.test, args.text_field)
+
+    print('Words:      {0} -> {1}'.format(report['full_words'], report['pruned_words']))
+    print('Size:       {0:.1f} MB -> {1:.1f} MB'.format(report['full_mb'], report['pruned_mb']))
+    print('OOV rate:   {0:.3%} -> {1:.3%} (on {2} profiled tokens)'.format(report['full_oov_rate'],
+                                                                            report['pruned_oov_rate'],
+                                                                            report['profiled_tokens']))
+    for name in ['precision', 'recall', 'f1', 'accuracy']:
+        print('{0:<11} {1:.3f} -> {2:.3f} (drop: {3:.3f})'.format(name.capitalize() + ':', report['full_' + name],
+                                                                  report['pruned_' + name], report[name + '_drop']))
@@ -0,0 +1,77 @@
+import os
+import time
+import argparse
+
+import src.utils as utils
+import src.embedding_store as store
+import src.train_and_test as ai
+
+DATASET_FILE = os.path.join("data", "dataset.csv")
+TEST_FILE = os.path.join("data", "test.csv")
+
+
+# word2vec: An embedding store
+# documents: A list of strings
+# repeat: The number of timed runs
+# Returns: The number of documents embedded per second (best of the runs)
+def embedding_throughput(word2vec, documents, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        utils.string2vec_batch(word2vec, documents)
+        best = min(best, time.perf_counter() - start)
+    return len(documents) / best
+
+
+# store_path: Path of the embedding store
+# modes: The modes to compare (the ones that weren't written for the store are skipped)
+# dataset_path, test_path: Paths of the training and test datasets
+# corpus: An optional list of documents used to measure the throughput (the datasets by default)
+# Returns: A list of dictionaries, one for each mode
+#
+# This function compares the storage modes of an embedding store: memory taken
+# by the vectors, embedding throughput, and precision, recall, F1 and accuracy
+# of the three models of analyze_models.
+def compare_modes(store_path, modes=store.MODES, dataset_path=DATASET_FILE, test_path=TEST_FILE, corpus=None):
+    lexicon, labels = utils.load_as_list(dataset_path)
+    test_data, test_labels = utils.load_as_list(test_path)
+    corpus = corpus if corpus is not None else (lexicon + test_data) * 20
+
+    report = []
+    for mode in modes:
+        try:
+            word2vec = store.load_store(store_path, mode)
+        except FileNotFoundError as err:
+            print('Skipping {0}: {1}'.format(mode, err))
+            continue
+
+        row = {'mode': mode, 'memory_mb': word2vec.nbytes() / 2 ** 20,
+               'docs_per_s': embedding_throughput(word2vec, corpus)}
+        names, models = ai.get_models()
+        for name, model in zip(names, models):
+            model = ai.train_model(model, word2vec, lexicon, labels)
+            row[name] = ai.test_model(model, word2vec, test_data, test_labels)
+        report.append(row)
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the storage modes of an embedding store.')
+    parser.add_argument('store', help='Directory of the embedding store')
+    parser.add_argument('--modes', nargs='+', default=list(store.MODES), choices=store.MODES)
+    parser.add_argument('--dataset', default=DATASET_FILE)
+    parser.add_argument('--test', default=TEST_FILE)
+    args = parser.parse_args()
+
+    report = compare_modes(args.store, args.modes, args.dataset, args.test)
+
+    print('\nMode\t Memory (MB)\t Docs/s')
+    for row in report:
+        print('{0}\t {1:>11.1f}\t {2:>6.0f}'.format(row['mode'], row['memory_mb'], row['docs_per_s']))
+
+    names, _ = ai.get_models()
+    print('\nMode\t Model\t\t\t\t Precision\t Recall\t F1\t Accuracy')
+    for row in report:
+        for name in names:
+            print('{0}\t {1:<24}\t {2:.3f}\t\t {3:.3f}\t {4:.3f}\t {5:.3f}'.format(row['mode'], name, *row[name]))
@@ -0,0 +1,220 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import collections
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+
+import src.utils as utils
+import src.model_cache as cache
+from src.engine import ConversationEngine
+from src.scheduler import InferenceScheduler
+from src.sentence_cache import SentenceCache
+from src.results_store import ResultsLog
+
+
+# fname: A JSONL file of scripted conversations: one object per line, with
+#        the "inputs" of the user, an optional "id", and optionally the
+#        "expected" transcript (the opening messages, then the replies to each input)
+# Returns: A list of dictionaries, one for each conversation
+def load_scripts(fname):
+    scripts = []
+    with open(fname, encoding='utf-8') as fin:
+        for num, line in enumerate(fin, 1):
+            if not line.strip():
+                continue
+            script = json.loads(line)
+            if not isinstance(script.get('inputs'), list):
+                raise ValueError('{0}, line {1}: a conversation needs a list of "inputs"'.format(fname, num))
+            script.setdefault('id', 'line-{0}'.format(num))
+            scripts.append(script)
+    return scripts
+
+
+# expected: The expected transcript (a list of strings)
+# outputs: The transcript of the replay
+# Returns: None if they're the same, otherwise a dictionary describing the first different turn
+def compare_transcript(expected, outputs):
+    for turn, (expected_text, text) in enumerate(zip(expected, outputs)):
+        if expected_text != text:
+            return {'turn': turn, 'expected': expected_text, 'actual': text}
+    if len(expected) != len(outputs):
+        turn = min(len(expected), len(outputs))
+        return {'turn': turn, 'expected': expected[turn] if turn < len(expected) else None,
+                'actual': outputs[turn] if turn < len(outputs) else None}
+    return None
+
+
+# engine: The ConversationEngine
+# script: A scripted conversation (see load_scripts)
+# think: Seconds the simulated user waits before each input
+# Returns: A dictionary with the transcript of the conversation and the record of each turn
+async def replay_conversation(engine, script, think=0.0):
+    session, replies = engine.open_session(script['id'])
+    outputs = [''.join(replies)]
+    turns = []
+    try:
+        for user_input in script['inputs']:
+            if session.is_over():
+                break
+            if think > 0:
+                await asyncio.sleep(think)
+            state = session.state
+            start = time.perf_counter()
+            replies = await engine.handle_async(session, user_input)
+            turns.append((state, session.state, time.perf_counter() - start))
+            outputs.append(''.join(replies))
+    finally:
+        engine.close_session(session)
+
+    result = {'id': script['id'], 'outputs': outputs, 'turns': turns, 'mismatch': None}
+    if 'expected' in script:
+        result['mismatch'] = compare_transcript(script['expected'], outputs)
+    return result
+
+
+# engine: The ConversationEngine
+# scripts: A list of scripted conversations
+# concurrency: The maximum number of conversations running at the same time
+# rate: The number of conversations started per second (0 to start them as soon as possible)
+# think: Seconds the simulated users wait before each input
+# Returns: The results of the conversations (see replay_conversation), and the seconds they took
+#
+# This function replays the conversations against the engine, like the
+# clients of the server would do, but without the sockets in between.
+async def replay(engine, scripts, concurrency=50, rate=0.0, think=0.0):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(script):
+        try:
+            return await replay_conversation(engine, script, think)
+        finally:
+            semaphore.release()
+
+    if engine.scheduler is not None:
+        engine.scheduler.start()
+    start = time.perf_counter()
+    tasks = []
+    try:
+        for idx, script in enumerate(scripts):
+            if rate > 0:
+                delay = start + idx / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await semaphore.acquire()
+            tasks.append(asyncio.get_running_loop().create_task(run(script)))
+        results = await asyncio.gather(*tasks)
+    finally:
+        if engine.scheduler is not None:
+            await engine.scheduler.stop()
+    return results, time.perf_counter() - start
+
+
+# latencies: A list of latencies in seconds
+# Returns: A dictionary with their percentiles in milliseconds
+def latency_summary(latencies):
+    if len(latencies) == 0:
+        return {}
+    p50, p90, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 90, 99])
+    return {'p50': p50, 'p90': p90, 'p99': p99, 'max': max(latencies) * 1000}
+
+
+# results: The results of replay
+# elapsed: The seconds the replay took
+# Returns: A dictionary with the report of the replay
+def summarize(results, elapsed):
+    latencies = []
+    by_state = collections.defaultdict(list)
+    transitions = collections.Counter()
+    for result in results:
+        for state, next_state, latency in result['turns']:
+            latencies.append(latency)
+            by_state[state].append(latency)
+            transitions['{0} -> {1}'.format(state, next_state)] += 1
+
+    mismatches = [{'id': result['id'], **result['mismatch']} for result in results if result['mismatch'] is not None]
+    return {
+        'conversations': len(results),
+        'turns': len(latencies),
+        'elapsed_s': elapsed,
+        'conversations_per_s': len(results) / elapsed if elapsed > 0 else 0.0,
+        'turns_per_s': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'latency_ms': latency_summary(latencies),
+        'latency_ms_by_state': {state: latency_summary(values) for state, values in sorted(by_state.items())},
+        'transitions': dict(sorted(transitions.items())),
+        'mismatches': mismatches,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay scripted conversations against the conversation engine.')
+    parser.add_argument('scripts', help='JSONL file of scripted conversations')
+    parser.add_argument('--concurrency', type=int, default=50, help='Maximum number of simultaneous conversations')
+    parser.add_argument('--rate', type=float, default=0.0,
+                        help='Conversations started per second (0 to start them as soon as possible)')
+    parser.add_argument('--think-ms', type=float, default=0.0, help='Time the users wait before each input')
+    parser.add_argument('--repeat', type=int, default=1, help='Number of times each conversation is replayed')
+    parser.add_argument('--embeddings', default=utils.default_embedding_path())
+    parser.add_argument('--embedding-mode', default='float32', choices=['float32', 'float16', 'int8'])
+    parser.add_argument('--dataset', default=os.path.join('data', 'dataset.csv'))
+    parser.add_argument('--max-batch-size', type=int, default=64,
+                        help='Maximum number of health checks classified together (1 disables batching)')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    parser.add_argument('--cache-size', type=int, default=0,
+                        help='Number of inputs whose embedding and prediction are cached (0 disables the cache)')
+    parser.add_argument('--results-dir', default=None,
+                        help='Save the outcome of each conversation in this directory (see src/results_store.py)')
+    parser.add_argument('--record', default=None,
+                        help='Write the transcripts of the replay here, as expected transcripts for later replays')
+    parser.add_argument('--output', default=None, help='Write the report here (JSON)')
+    args = parser.parse_args()
+
+    scripts = load_scripts(args.scripts) * args.repeat
+
+    word2vec = utils.load_w2v(args.embeddings, args.embedding_mode)
+    model, model_key = cache.load_or_train(LogisticRegression(), word2vec, args.dataset, args.embeddings)
+    scheduler = None
+    if args.max_batch_size > 1:
+        scheduler = InferenceScheduler(model, word2vec, args.max_batch_size, args.max_wait_ms)
+    sentence_cache = SentenceCache(args.cache_size) if args.cache_size > 0 else None
+    results_log = ResultsLog(args.results_dir) if args.results_dir is not None else None
+    engine = ConversationEngine(model, word2vec, scheduler, cache=sentence_cache, model_key=model_key,
+                                results=results_log)
+
+    results, elapsed = asyncio.run(replay(engine, scripts, args.concurrency, args.rate, args.think_ms / 1000))
+    if results_log is not None:
+        results_log.close()
+    report = summarize(results, elapsed)
+
+    print('Conversations: {0} in {1:.2f}s ({2:.1f}/s)'.format(report['conversations'], elapsed,
+                                                              report['conversations_per_s']))
+    print('Turns:         {0} ({1:.1f}/s)'.format(report['turns'], report['turns_per_s']))
+    print('\nState\t\t\t p50 (ms)\t p90 (ms)\t p99 (ms)\t max (ms)')
+    for state, latency in [('all', report['latency_ms'])] + list(report['latency_ms_by_state'].items()):
+        if len(latency) > 0:
+            print('{0:<20}\t {1:>8.2f}\t {2:>8.2f}\t {3:>8.2f}\t {4:>8.2f}'.format(
+                state, latency['p50'], latency['p90'], latency['p99'], latency['max']))
+    print('\nTransitions:')
+    for transition, count in report['transitions'].items():
+        print('   {0:<45} {1}'.format(transition, count))
+
+    if args.record is not None:
+        with open(args.record, 'w', encoding='utf-8') as fout:
+            for script, result in zip(scripts, results):
+                fout.write(json.dumps({'id': script['id'], 'inputs': script['inputs'],
+                                       'expected': result['outputs']}) + '\n')
+    if args.output is not None:
+        with open(args.output, 'w') as fout:
+            json.dump(report, fout, indent=2)
+
+    compared = sum(1 for script in scripts if 'expected' in script)
+    if compared > 0:
+        print('\nTranscripts: {0} compared, {1} different'.format(compared, len(report['mismatches'])))
+        for mismatch in report['mismatches'][:10]:
+            print('   {0}, turn {1}: expected {2!r}, got {3!r}'.format(mismatch['id'], mismatch['turn'],
+                                                                      mismatch['expected'], mismatch['actual']))
+    if len(report['mismatches']) > 0:
+        sys.exit(1)
@@ -0,0 +1,267 @@
+import os
+import json
+import time
+import logging
+import contextlib
+import argparse
+import threading
+import collections
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# Default directory of the results log
+RESULTS_DIR = os.path.join("data", "results")
+# Prefix and extension of the segments of the log
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".jsonl"
+# Number of stylistic features of a StyleAnalysis (see StyleAnalysis.features)
+NUM_FEATURES = 9
+# Number of correlates returned by summarize_analysis
+NUM_CORRELATES = 3
+
+
+# The outcome of a conversation.
+#
+# The fields are slots, and a record is written as a JSON array in the order of
+# the slots (no field names), so the records stay small in memory and on disk.
+class SessionRecord:
+    __slots__ = ('session_id', 'finished_at', 'state', 'name', 'dob', 'health_label', 'correlates', 'features')
+
+    # session_id: The identifier of the session
+    # finished_at: The time the conversation ended (seconds since the epoch)
+    # state: The state the conversation ended in
+    # name: The name of the user ('' if unknown)
+    # dob: The date of birth of the user, formatted as MM/DD/YY ('' if unknown)
+    # health_label: The label of the last health check (None if there wasn't any)
+    # correlates: The psychological correlates of the last stylistic analysis
+    # features: The raw counts of the last stylistic analysis (None if there wasn't any)
+    def __init__(self, session_id, finished_at, state, name='', dob='', health_label=None, correlates=(),
+                 features=None):
+        self.session_id = session_id
+        self.finished_at = finished_at
+        self.state = state
+        self.name = name
+        self.dob = dob
+        self.health_label = health_label
+        self.correlates = correlates
+        self.features = features
+
+    # session: A Session (see src/bot_fsa.py)
+    # Returns: The record of the session, as it is now
+    @classmethod
+    def from_session(cls, session):
+        label = None if session.health_label is None else int(session.health_label)
+        features = None if session.features is None else [float(value) for value in session.features]
+        return cls(str(session.id), time.time(), session.state, session.name, session.dob, label,
+                   list(session.correlates), features)
+
+    # row: A record as returned by to_row
+    # Returns: The record
+    # Raises: ValueError if the row doesn't have the fields of a record
+    @classmethod
+    def from_row(cls, row):
+        if not isinstance(row, list) or len(row) != len(cls.__slots__):
+            raise ValueError('expected a list of {0} fields'.format(len(cls.__slots__)))
+        return cls(*row)
+
+    # Returns: The values of the fields, in the order of the slots
+    def to_row(self):
+        return [getattr(self, field) for field in self.__slots__]
+
+
+# directory: The directory of a results log
+# Returns: The paths of its segments, oldest first
+def list_segments(directory=RESULTS_DIR):
+    if not os.path.isdir(directory):
+        return []
+    names = sorted(name for name in os.listdir(directory)
+                   if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+    return [os.path.join(directory, name) for name in names]
+
+
+# directory: The directory of a results log
+# Returns: An iterator over its SessionRecords, in the order they were written
+#
+# Lines that aren't valid records (e.g. a record that was being written when
+# the process died) are skipped and logged.
+def read_records(directory=RESULTS_DIR):
+    for path in list_segments(directory):
+        with open(path, encoding='utf-8', errors='replace') as fin:
+            for num, line in enumerate(fin, 1):
+                if not line.endswith('\n'):
+                    log.warning('%s, line %d: skipping a partial record', path, num)
+                    continue
+                try:
+                    record = SessionRecord.from_row(json.loads(line))
+                except ValueError as err:
+                    log.warning('%s, line %d: skipping a malformed record (%s)', path, num, err)
+                    continue
+                yield record
+
+
+# An append-only log of SessionRecords.
+#
+# append only puts the record in an in-memory queue: a background thread writes
+# the queued records in batches, as soon as batch_size of them are waiting or
+# every flush_interval seconds, so the conversations never wait for the disk.
+# The log is split in segments of about segment_bytes bytes. A segment is
+# created exclusively, so it's only written by one process (several processes
+# can share the directory), and a new one is started after a failed write: a
+# record half written by a crash is always at the end of a segment, and it's
+# skipped by read_records anyway. If the disk can't keep up and
+# max_pending records are waiting, the new records are dropped (and counted)
+# instead of slowing down the conversations.
+class ResultsLog:
+
+    # directory: The directory of the log
+    # batch_size: The number of waiting records that triggers a write
+    # flush_interval: The maximum number of seconds a record waits before being written
+    # segment_bytes: The size after which a new segment is started
+    # max_pending: The maximum number of records waiting to be written
+    # fsync: Whether every batch is synced to the disk (and not only handed to the OS)
+    def __init__(self, directory=RESULTS_DIR, batch_size=256, flush_interval=1.0, segment_bytes=64 * 1024 * 1024,
+                 max_pending=100000, fsync=False):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.segment_bytes = segment_bytes
+        self.max_pending = max_pending
+        self.fsync = fsync
+        self.appended = 0
+        self.written = 0
+        self.dropped = 0
+        self.lost = 0
+        self.batches = 0
+        self.segments = 0
+        self._pending = collections.deque()
+        self._wakeup = threading.Event()
+        self._closed = False
+
+        segments = list_segments(directory)
+        last = os.path.basename(segments[-1]) if len(segments) > 0 else None
+        self._next_segment = int(last[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) + 1 if last is not None else 1
+        # Opened with the first write, so that no empty segments are left behind
+        self._segment = None
+
+        self._thread = threading.Thread(target=self._run, name='carebot-results', daemon=True)
+        self._thread.start()
+
+    # record: A SessionRecord
+    # Returns: True if the record was queued, False if it was dropped
+    def append(self, record):
+        if self._closed:
+            raise ValueError('The results log is closed')
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return False
+        self._pending.append(record)
+        self.appended += 1
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    # Returns: The segment being written
+    def _current_segment(self):
+        if self._segment is not None and self._segment.tell() >= self.segment_bytes:
+            self._segment.close()
+            self._segment = None
+        while self._segment is None:
+            path = os.path.join(self.directory, '{0}{1:06d}{2}'.format(SEGMENT_PREFIX, self._next_segment,
+                                                                       SEGMENT_SUFFIX))
+            self._next_segment += 1
+            try:
+                self._segment = open(path, 'xb')
+            except FileExistsError:
+                # Created by another process in the meantime
+                continue
+            self.segments += 1
+        return self._segment
+
+    # records: A list of SessionRecords
+    # Returns: This function does not return any values
+    def _write_batch(self, records):
+        data = ''.join(json.dumps(record.to_row(), separators=(',', ':')) + '\n' for record in records)
+        try:
+            segment = self._current_segment()
+            segment.write(data.encode('utf-8'))
+            segment.flush()
+            if self.fsync:
+                os.fsync(segment.fileno())
+        except OSError:
+            self.lost += len(records)
+            log.exception('Writing %d results failed', len(records))
+            # The next records go to a new segment, after the partial one
+            if self._segment is not None:
+                with contextlib.suppress(OSError):
+                    self._segment.close()
+                self._segment = None
+            return
+        self.written += len(records)
+        self.batches += 1
+
+    # Returns: This function does not return any values
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            closed = self._closed
+            # The records queued in the meantime are written in the next round
+            for _ in range(0, len(self._pending), self.batch_size):
+                self._write_batch([self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))])
+            if closed:
+                break
+        if self._segment is not None:
+            self._segment.close()
+
+    # Returns: This function does not return any values
+    #
+    # Writes the records still waiting, and stops the background thread.
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+
+    # Returns: A dictionary with the counters of the log
+    def stats(self):
+        return {'appended': self.appended, 'written': self.written, 'pending': len(self._pending),
+                'dropped': self.dropped, 'lost': self.lost, 'batches': self.batches, 'segments': self.segments}
+
+
+# directory: The directory of a results log
+# path: The .npz file to write
+# Returns: The number of exported records
+#
+# Writes the records as columns (one numpy array per field), ready for numpy
+# or pandas: the missing health labels are -1, the missing features are NaN,
+# and the missing correlates are empty strings.
+def export_columns(directory, path):
+    records = list(read_records(directory))
+    correlates = [(list(record.correlates) + [''] * NUM_CORRELATES)[:NUM_CORRELATES] for record in records]
+    features = [record.features if record.features is not None else [np.nan] * NUM_FEATURES for record in records]
+    np.savez_compressed(
+        path,
+        session_id=np.array([record.session_id for record in records], dtype=str),
+        finished_at=np.array([record.finished_at for record in records], dtype=np.float64),
+        state=np.array([record.state for record in records], dtype=str),
+        name=np.array([record.name for record in records], dtype=str),
+        dob=np.array([record.dob for record in records], dtype=str),
+        health_label=np.array([-1 if record.health_label is None else record.health_label for record in records],
+                              dtype=np.int8),
+        correlates=np.array(correlates, dtype=str).reshape(-1, NUM_CORRELATES),
+        features=np.array(features, dtype=np.float64).reshape(-1, NUM_FEATURES))
+    return len(records)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the results of the conversations as columns.')
+    parser.add_argument('output', help='The .npz file to write')
+    parser.add_argument('--results-dir', default=RESULTS_DIR)
+    args = parser.parse_args()
+
+    count = export_columns(args.results_dir, args.output)
+    print('Exported {0} records from {1} segments to {2}'.format(count, len(list_segments(args.results_dir)),
+                                                                 args.output))
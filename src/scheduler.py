@@ -0,0 +1,146 @@
+import time
+import asyncio
+import collections
+import numpy as np
+
+import src.utils as utils
+import src.metrics as metrics
+
+
+# A micro-batching scheduler for the health model.
+#
+# Predicting one row at a time is dominated by the per-call overhead of
+# sklearn, so the health checks of all the conversations are collected in a
+# queue and classified together: a batch is sent to the model as soon as it
+# reaches max_batch_size inputs, or max_wait_ms milliseconds after its first
+# input arrived, whichever comes first.
+#
+# The model is read once per batch, from source if it's set (e.g. the live
+# model of a ConversationEngine), so that a batch is classified by one model
+# and each input knows which one it was.
+class InferenceScheduler:
+
+    # model: A trained classification model
+    # word2vec: The pretrained Word2Vec model
+    # max_batch_size: The maximum number of inputs classified together
+    # max_wait_ms: The maximum time an input waits for the batch to fill up
+    # latency_window: The number of recent latencies used for the percentiles
+    # source: An optional function returning the model and its key, used instead of model
+    def __init__(self, model, word2vec, max_batch_size=64, max_wait_ms=5.0, latency_window=10000, source=None):
+        self.model = model
+        self.source = source
+        self.word2vec = word2vec
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        self._pending = collections.deque()
+        self._has_work = None
+        self._full = None
+        self._task = None
+
+        # Metrics
+        self.requests = 0
+        self.batches = 0
+        self.errors = 0
+        self.batch_sizes = collections.Counter()
+        self.latencies = collections.deque(maxlen=latency_window)
+
+    # Returns: This function does not return any values
+    #
+    # Starts the batching loop on the running event loop.
+    def start(self):
+        self._has_work = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    # Returns: This function does not return any values
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # user_input: A string of arbitrary length
+    # Returns: The label predicted by the model
+    async def predict(self, user_input):
+        label, _ = await self.predict_with_model(user_input)
+        return label
+
+    # user_input: A string of arbitrary length
+    # Returns: The label predicted by the model, and the (model, model_key) that predicted it
+    async def predict_with_model(self, user_input):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((user_input, future, time.perf_counter()))
+        self._has_work.set()
+        if len(self._pending) >= self.max_batch_size:
+            self._full.set()
+        return await future
+
+    # texts: A list of strings
+    # Returns: The labels predicted for the texts, and the (model, model_key) that predicted them
+    def _predict_batch(self, texts):
+        snapshot = self.source() if self.source is not None else (self.model, None)
+        doc_embeddings = utils.string2vec_batch(self.word2vec, texts)
+        with metrics.STEP_SECONDS.time('predict_batch'):
+            return snapshot[0].predict(doc_embeddings), snapshot
+
+    # Returns: This function does not return any values
+    #
+    # The batching loop: it waits for the first input, gives the batch some
+    # time to fill up, and then classifies it (in a worker thread, so that the
+    # conversations can go on and queue the next batch in the meantime).
+    async def _run(self):
+        while True:
+            await self._has_work.wait()
+
+            remaining = self.max_wait - (time.perf_counter() - self._pending[0][2])
+            if len(self._pending) < self.max_batch_size and remaining > 0:
+                try:
+                    await asyncio.wait_for(self._full.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = [self._pending.popleft() for _ in range(min(self.max_batch_size, len(self._pending)))]
+            if len(self._pending) == 0:
+                self._has_work.clear()
+            if len(self._pending) < self.max_batch_size:
+                self._full.clear()
+
+            self.batches += 1
+            self.requests += len(batch)
+            self.batch_sizes[len(batch)] += 1
+            try:
+                labels, snapshot = await asyncio.to_thread(self._predict_batch, [text for text, _, _ in batch])
+            except Exception as err:
+                self.errors += 1
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(err)
+                continue
+
+            now = time.perf_counter()
+            for (_, future, enqueued), label in zip(batch, labels):
+                self.latencies.append(now - enqueued)
+                if not future.done():
+                    future.set_result((label, snapshot))
+
+    # Returns: A dictionary with the current metrics of the scheduler
+    #
+    # Latencies (in milliseconds) go from the moment an input is queued to the
+    # moment its label is ready, and are computed on the most recent requests.
+    def stats(self):
+        stats = {
+            'queue_depth': len(self._pending),
+            'requests': self.requests,
+            'batches': self.batches,
+            'errors': self.errors,
+            'mean_batch_size': self.requests / self.batches if self.batches > 0 else 0.0,
+            'batch_sizes': dict(sorted(self.batch_sizes.items())),
+        }
+        if len(self.latencies) > 0:
+            p50, p90, p99 = np.percentile(np.asarray(self.latencies) * 1000, [50, 90, 99])
+            stats['latency_ms'] = {'p50': p50, 'p90': p90, 'p99': p99, 'max': max(self.latencies) * 1000}
+        return stats
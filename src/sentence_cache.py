@@ -0,0 +1,144 @@
+import threading
+import collections
+
+import src.utils as utils
+
+
+# A bounded, thread-safe LRU cache with hit, miss and eviction counters.
+#
+# Every entry belongs to a generation (e.g. the model that computed it): when
+# the generation changes, the whole cache is invalidated.
+class LRUCache:
+
+    # maxsize: The maximum number of entries
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    # key: The key of the entry
+    # generation: The current generation
+    # Returns: The cached value, or None if it isn't cached
+    def get(self, key, generation):
+        with self._lock:
+            self._check_generation(generation)
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    # key: The key of the entry
+    # generation: The generation the value was computed for
+    # value: The value to cache (not None)
+    # Returns: This function does not return any values
+    #
+    # Only get moves the cache to a new generation: a value computed for
+    # another generation (e.g. by a lookup that started before the model was
+    # swapped) is simply dropped.
+    def put(self, key, generation, value):
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    # generation: The current generation
+    # Returns: This function does not return any values
+    def _check_generation(self, generation):
+        if generation != self.generation:
+            if len(self._data) > 0:
+                self.invalidations += 1
+            self._data.clear()
+            self.generation = generation
+
+    # Returns: A dictionary with the counters of the cache
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups > 0 else 0.0, 'evictions': self.evictions,
+                    'invalidations': self.invalidations}
+
+
+# A cache of sentence embeddings and health predictions.
+#
+# Users keep typing the same short answers ("good", "fine", ...), so the
+# embedding (and the predicted label) of each normalized input is cached: the
+# key is the output of utils.preprocessing, which is everything string2vec
+# depends on. Embeddings are invalidated when the Word2Vec representations
+# change, and predictions also when the model changes.
+class SentenceCache:
+
+    # maxsize: The maximum number of entries of each cache
+    # predictions: Whether the predictions are cached too
+    def __init__(self, maxsize=10000, predictions=True):
+        self.embeddings = LRUCache(maxsize)
+        self.predictions = LRUCache(maxsize) if predictions else None
+
+    # user_input: A string of arbitrary length
+    # Returns: The key of the input in the cache
+    def key(self, user_input):
+        return utils.preprocessing(user_input)
+
+    # word2vec: The pretrained Word2Vec model
+    # Returns: The generation of the embeddings
+    def embedding_generation(self, word2vec):
+        return getattr(word2vec, 'fingerprint', id(word2vec))
+
+    # model: A trained classification model
+    # word2vec: The pretrained Word2Vec model
+    # model_key: The key of the model artifact, if known (see src/model_cache.py)
+    # Returns: The generation of the predictions
+    def prediction_generation(self, model, word2vec, model_key=None):
+        return (model_key if model_key is not None else id(model), self.embedding_generation(word2vec))
+
+    # word2vec: The pretrained Word2Vec model
+    # user_input: A string of arbitrary length
+    # Returns: The averaged Word2Vec embedding of the input (read-only)
+    def embed(self, word2vec, user_input):
+        key = self.key(user_input)
+        generation = self.embedding_generation(word2vec)
+        embedding = self.embeddings.get(key, generation)
+        if embedding is None:
+            embedding = utils.string2vec(word2vec, user_input)
+            embedding.flags.writeable = False
+            self.embeddings.put(key, generation, embedding)
+        return embedding
+
+    # model: A trained classification model
+    # word2vec: The pretrained Word2Vec model
+    # user_input: A string of arbitrary length
+    # model_key: The key of the model artifact, if known
+    # Returns: The label predicted by the model
+    def predict(self, model, word2vec, user_input, model_key=None):
+        if self.predictions is None:
+            return model.predict(self.embed(word2vec, user_input).reshape(1, -1))[0]
+
+        key = self.key(user_input)
+        generation = self.prediction_generation(model, word2vec, model_key)
+        label = self.predictions.get(key, generation)
+        if label is None:
+            label = model.predict(self.embed(word2vec, user_input).reshape(1, -1))[0]
+            self.predictions.put(key, generation, label)
+        return label
+
+    # Returns: A dictionary with the counters of the caches
+    def stats(self):
+        stats = {'embeddings': self.embeddings.stats()}
+        if self.predictions is not None:
+            stats['predictions'] = self.predictions.stats()
+        return stats
@@ -0,0 +1,224 @@
+import os
+import json
+import asyncio
+import logging
+import argparse
+from sklearn.linear_model import LogisticRegression
+
+import src.utils as utils
+import src.metrics as metrics
+import src.model_cache as cache
+import src.embedding_store as store
+import src.online_learning as online
+from src.engine import ConversationEngine
+from src.scheduler import InferenceScheduler
+from src.sentence_cache import SentenceCache
+from src.logit_table import LogitTable
+from src.similarity import OOVFallbackEmbeddings
+from src.results_store import ResultsLog
+
+log = logging.getLogger(__name__)
+
+# Reply sent when a turn fails: the state doesn't change, so the user can simply try again
+ERROR_REPLY = "I'm sorry, something went wrong on my side.\nCan you repeat?\n"
+
+
+# engine: The ConversationEngine shared by all the clients
+# reader, writer: The asyncio streams of the client connection
+# Returns: This function does not return any values
+#
+# This function carries on a whole conversation with one client: every line
+# received is a user input, and the replies are written back as they are.
+async def serve_client(engine, reader, writer):
+    session, replies = engine.open_session()
+    try:
+        while True:
+            writer.write(''.join(replies).encode('utf-8'))
+            await writer.drain()
+            if session.is_over():
+                break
+
+            try:
+                line = await reader.readline()
+            except (asyncio.LimitOverrunError, ValueError):
+                # The line is longer than the limit of the stream
+                break
+            if not line:
+                break
+            user_input = line.decode('utf-8', 'replace').rstrip('\r\n')
+            try:
+                replies = await engine.handle_async(session, user_input)
+            except Exception:
+                log.exception('Session %s: the turn failed in state %s', session.id, session.state)
+                session.pending = None
+                replies = [ERROR_REPLY]
+    except ConnectionError:
+        pass
+    finally:
+        engine.close_session(session)
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+# engine: The ConversationEngine shared by all the clients
+# host, port: The TCP address to listen on (ignored if unix_path is given)
+# unix_path: Path of a Unix socket to listen on
+# stats_interval: Seconds between two prints of the scheduler and cache metrics (0 to disable)
+# learner: An optional OnlineLearner updating the model (see src/online_learning.py)
+# learn_from: The labeled file followed by the learner
+# metrics_file: An optional file where the metrics are written in the Prometheus text format
+# metrics_interval: Seconds between two writes of the metrics file
+# Returns: This function does not return any values
+#
+# This function runs the line-based chat server until it's cancelled. All the
+# conversations run concurrently in this process, against the same model and
+# Word2Vec representations.
+async def serve(engine, host='127.0.0.1', port=8765, unix_path=None, stats_interval=0, learner=None,
+                learn_from=None, metrics_file=None, metrics_interval=10.0):
+    async def handler(reader, writer):
+        await serve_client(engine, reader, writer)
+
+    async def print_stats():
+        while True:
+            await asyncio.sleep(stats_interval)
+            stats = {'active_sessions': engine.active_sessions}
+            if engine.scheduler is not None:
+                stats['scheduler'] = engine.scheduler.stats()
+            if engine.cache is not None:
+                stats['cache'] = engine.cache.stats()
+            if learner is not None:
+                stats['learner'] = learner.stats()
+            if engine.results is not None:
+                stats['results'] = engine.results.stats()
+            print(json.dumps(stats), flush=True)
+
+    async def write_metrics():
+        while True:
+            await asyncio.sleep(metrics_interval)
+            metrics.write_textfile(metrics_file)
+
+    if engine.scheduler is not None:
+        engine.scheduler.start()
+    if stats_interval > 0:
+        asyncio.get_running_loop().create_task(print_stats())
+    if metrics_file is not None:
+        asyncio.get_running_loop().create_task(write_metrics())
+    if learner is not None:
+        learning = asyncio.get_running_loop().create_task(learner.follow(learn_from))
+
+    if unix_path is not None:
+        server = await asyncio.start_unix_server(handler, path=unix_path)
+        print('CareBot listening on {0}'.format(unix_path))
+    else:
+        server = await asyncio.start_server(handler, host=host, port=port)
+        print('CareBot listening on {0}:{1}'.format(host, port))
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if learner is not None:
+            # Cancelling the learner saves its last updates
+            learning.cancel()
+            try:
+                await learning
+            except asyncio.CancelledError:
+                pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve many CareBot conversations from a single process.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', default=None, help='Path of a Unix socket to use instead of TCP')
+    parser.add_argument('--embeddings', default=utils.default_embedding_path())
+    parser.add_argument('--embedding-mode', default='float32', choices=['float32', 'float16', 'int8'],
+                        help='Storage mode of the embeddings (quantized modes need an embedding store)')
+    parser.add_argument('--dataset', default=os.path.join('data', 'dataset.csv'))
+    parser.add_argument('--max-batch-size', type=int, default=64,
+                        help='Maximum number of health checks classified together (1 disables batching)')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0,
+                        help='Maximum time a health check waits for its batch to fill up')
+    parser.add_argument('--cache-size', type=int, default=10000,
+                        help='Number of inputs whose embedding and prediction are cached (0 disables the cache)')
+    parser.add_argument('--stats-interval', type=float, default=0,
+                        help='Seconds between two prints of the batching and cache metrics (0 to disable)')
+    parser.add_argument('--oov-fallback', action='store_true',
+                        help='Replace the words missing from the embeddings with their closest known spelling')
+    parser.add_argument('--logit-table', default=None,
+                        help='Classify with a table of per-word scores (see src/logit_table.py) instead of the '
+                             'model, without loading the embeddings')
+    parser.add_argument('--learn-from', default=None,
+                        help='Labeled file (CSV or JSONL) to follow, updating the model online with its new lines')
+    parser.add_argument('--learn-chunk-size', type=int, default=32,
+                        help='Maximum number of labeled utterances of an online update')
+    parser.add_argument('--checkpoint', default=online.ONLINE_CHECKPOINT, help='Checkpoint of the online model')
+    parser.add_argument('--checkpoint-interval', type=float, default=60.0,
+                        help='Minimum seconds between two checkpoints of the online model')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='Port of an HTTP endpoint exposing the metrics in the Prometheus text format')
+    parser.add_argument('--metrics-file', default=None, help='File where the metrics are written periodically')
+    parser.add_argument('--metrics-interval', type=float, default=10.0,
+                        help='Seconds between two writes of the metrics file')
+    parser.add_argument('--profile-slow-ms', type=float, default=None,
+                        help='Write a flame graph profile of the turns slower than this (disabled by default)')
+    parser.add_argument('--profile-dir', default='profiles', help='Directory of the profiles of the slow turns')
+    parser.add_argument('--results-dir', default=None,
+                        help='Save the outcome of each conversation in this directory (see src/results_store.py)')
+    parser.add_argument('--results-flush-ms', type=float, default=1000.0,
+                        help='Maximum time the outcome of a conversation waits before being written')
+    args = parser.parse_args()
+    if args.logit_table is not None and args.learn_from is not None:
+        parser.error('--learn-from updates the model, it cannot be used with --logit-table')
+
+    word2vec = None
+    model, model_key, logit_table = None, None, None
+    learner = None
+    if args.logit_table is not None:
+        # Only the fingerprint of the embeddings is read (a store is memory-mapped), to check the table
+        embeddings = store.load_store(args.embeddings, args.embedding_mode) if store.is_store(args.embeddings) else None
+        model_key = cache.artifact_key(LogisticRegression(), args.dataset, args.embeddings, embeddings)
+        try:
+            logit_table = LogitTable(args.logit_table, model_key)
+        except ValueError as err:
+            parser.error(str(err))
+    else:
+        word2vec = utils.load_w2v(args.embeddings, args.embedding_mode)
+        if args.oov_fallback:
+            word2vec = OOVFallbackEmbeddings(word2vec)
+
+    if args.learn_from is not None:
+        model, state = online.bootstrap(word2vec, args.dataset, args.embeddings, args.checkpoint)
+        model_key = online.online_key(state)
+    elif logit_table is None:
+        model, model_key = cache.load_or_train(LogisticRegression(), word2vec, args.dataset, args.embeddings)
+
+    scheduler = None
+    if args.max_batch_size > 1 and logit_table is None:
+        scheduler = InferenceScheduler(model, word2vec, args.max_batch_size, args.max_wait_ms)
+    sentence_cache = SentenceCache(args.cache_size) if args.cache_size > 0 and logit_table is None else None
+    profiler = None
+    if args.profile_slow_ms is not None:
+        profiler = metrics.SlowTurnProfiler(args.profile_slow_ms, args.profile_dir)
+    results = None
+    if args.results_dir is not None:
+        results = ResultsLog(args.results_dir, flush_interval=args.results_flush_ms / 1000)
+    engine = ConversationEngine(model, word2vec, scheduler, cache=sentence_cache, model_key=model_key,
+                                profiler=profiler, logit_table=logit_table, results=results)
+    if args.learn_from is not None:
+        learner = online.OnlineLearner(engine, state, args.checkpoint, args.learn_chunk_size, args.checkpoint_interval)
+
+    if args.metrics_port is not None:
+        metrics.start_http_server(args.metrics_port, args.host)
+
+    try:
+        asyncio.run(serve(engine, args.host, args.port, args.unix, args.stats_interval, learner, args.learn_from,
+                          args.metrics_file, args.metrics_interval))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if results is not None:
+            results.close()
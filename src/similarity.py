@@ -0,0 +1,258 @@
+import os
+import string
+import argparse
+import numpy as np
+
+import src.utils as utils
+import src.embedding_store as store
+from src.sentence_cache import LRUCache
+
+DATASET_FILE = os.path.join("data", "dataset.csv")
+
+
+# An exact cosine similarity index over a set of vectors.
+#
+# The norms of the vectors are computed once; queries are normalized and
+# multiplied with the vectors one block at a time, keeping only the top k of
+# each block (argpartition), so the memory used by a search is bounded by the
+# block size and its time grows linearly with the vocabulary.
+class SimilarityIndex:
+
+    # vectors: An EmbeddingStore, or a numpy array of shape (N, dim)
+    # block_size: The number of vectors multiplied at a time
+    def __init__(self, vectors, block_size=65536):
+        if hasattr(vectors, 'gather'):
+            self._gather = vectors.gather
+            self.dim = vectors.dim
+        else:
+            matrix = np.asarray(vectors, dtype=np.float32)
+            self._gather = matrix.__getitem__
+            self.dim = matrix.shape[1]
+        self.size = len(vectors)
+        self.block_size = block_size
+
+        self.norms = np.empty(self.size, dtype=np.float32)
+        for start, end in self._blocks():
+            self.norms[start:end] = np.linalg.norm(self._gather(np.arange(start, end)), axis=1)
+        # Zero vectors (e.g. documents without known words) are never similar to anything
+        self.norms[self.norms == 0] = np.inf
+
+    def __len__(self):
+        return self.size
+
+    # Returns: An iterator over the (start, end) rows of each block
+    def _blocks(self):
+        for start in range(0, self.size, self.block_size):
+            yield start, min(start + self.block_size, self.size)
+
+    # queries: A numpy array of shape (dim,) or (Q, dim)
+    # Returns: The queries normalized, as a float32 array of shape (Q, dim)
+    def _normalize(self, queries):
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        return queries / np.where(norms > 0, norms, 1)
+
+    # rows: A numpy array of rows
+    # query: A vector of shape (dim,)
+    # Returns: The cosine similarity of each row with the query
+    def similarity(self, rows, query):
+        rows = np.asarray(rows, dtype=np.int64)
+        return (self._gather(rows) @ self._normalize(query)[0]) / self.norms[rows]
+
+    # queries: A numpy array of shape (dim,) or (Q, dim)
+    # k: The number of neighbors of each query
+    # Returns: Two numpy arrays of shape (Q, k): the rows of the nearest vectors, and their cosine similarity
+    #          (sorted by decreasing similarity)
+    def search(self, queries, k=10):
+        queries = self._normalize(queries)
+        k = min(k, self.size)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        best_sims = np.zeros((len(queries), 0), dtype=np.float32)
+
+        for start, end in self._blocks():
+            sims = (queries @ self._gather(np.arange(start, end)).T) / self.norms[start:end]
+            top = min(k, end - start)
+            part = np.argpartition(-sims, top - 1, axis=1)[:, :top]
+            best_rows = np.concatenate([best_rows, part + start], axis=1)
+            best_sims = np.concatenate([best_sims, np.take_along_axis(sims, part, axis=1)], axis=1)
+            if best_rows.shape[1] > k:
+                part = np.argpartition(-best_sims, k - 1, axis=1)[:, :k]
+                best_rows = np.take_along_axis(best_rows, part, axis=1)
+                best_sims = np.take_along_axis(best_sims, part, axis=1)
+
+        order = np.argsort(-best_sims, axis=1, kind='stable')
+        return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_sims, order, axis=1)
+
+
+# Finds an in-vocabulary replacement for tokens missing from an embedding store.
+#
+# The candidates are tried in order: other capitalizations of the token (the
+# preprocessing lowercases everything, while the vocabulary is case sensitive),
+# then the spellings at edit distance 1 (typos, most inflections), then the
+# longest known prefix or suffix. Among the capitalizations and the edits, the
+# candidate closest to the context (if one is given) wins, otherwise the most
+# frequent one (the rows of word2vec stores are sorted by frequency); among the
+# subwords, the longest one wins. Only hash lookups are needed, at
+# most 54 * len(token) + 25 of them, and the results are cached.
+class OOVResolver:
+
+    # word2vec: An EmbeddingStore
+    # index: An optional SimilarityIndex over the same store, used to rank the candidates by context
+    # max_length: Tokens longer than this only get the capitalization and subword candidates
+    # min_subword: The minimum length of the prefixes and suffixes tried
+    # cache_size: The number of resolved tokens kept in memory
+    def __init__(self, word2vec, index=None, max_length=20, min_subword=4, cache_size=100000):
+        if not hasattr(word2vec, 'index'):
+            raise TypeError('The OOV fallback needs an embedding store, convert the embeddings first '
+                            '(python -m src.embedding_store convert)')
+        self.word2vec = word2vec
+        self.index = index
+        self.max_length = max_length
+        self.min_subword = min_subword
+        self.cache = LRUCache(cache_size)
+
+    # token: A token that isn't in the vocabulary
+    # Returns: An iterator over the groups of candidate spellings, in order of preference, each with whether its
+    #          candidates are already sorted by preference (otherwise they're ranked by context or frequency)
+    def candidates(self, token):
+        yield [token.lower(), token.capitalize(), token.upper(), token.title()], False
+
+        if len(token) <= self.max_length:
+            splits = [(token[:idx], token[idx:]) for idx in range(len(token) + 1)]
+            edits = [left + right[1:] for left, right in splits if right]
+            edits += [left + right[1] + right[0] + right[2:] for left, right in splits if len(right) > 1]
+            edits += [left + char + right[1:] for left, right in splits if right for char in string.ascii_lowercase]
+            edits += [left + char + right for left, right in splits for char in string.ascii_lowercase]
+            yield edits, False
+
+        # The longest prefixes first, then the longest suffixes
+        yield [token[:end] for end in range(len(token) - 1, self.min_subword - 1, -1)] + \
+              [token[start:] for start in range(1, len(token) - self.min_subword + 1)], True
+
+    # token: A token that isn't in the vocabulary
+    # context: An optional vector (e.g. the embedding of the rest of the sentence)
+    # Returns: The row of the replacement, or -1 if there isn't any
+    def resolve(self, token, context=None):
+        if context is None:
+            row = self.cache.get(token, self.word2vec.fingerprint)
+            if row is not None:
+                return row
+
+        row = -1
+        for group, ordered in self.candidates(token):
+            rows = [self.word2vec.index(candidate) for candidate in group if candidate != token]
+            rows = [found for found in rows if found >= 0] if ordered else sorted(set(rows) - {-1})
+            if len(rows) == 0:
+                continue
+            row = rows[0]
+            if not ordered and context is not None and self.index is not None and len(rows) > 1:
+                row = rows[int(np.argmax(self.index.similarity(rows, context)))]
+            break
+
+        if context is None:
+            self.cache.put(token, self.word2vec.fingerprint, row)
+        return row
+
+
+# An embedding store whose missing tokens are replaced by OOVResolver.
+#
+# It can be used anywhere an EmbeddingStore is (string2vec, string2vec_batch,
+# the model cache, the server); its fingerprint is different from the one of
+# the store, since models trained with the fallback are different models.
+class OOVFallbackEmbeddings:
+
+    # word2vec: An EmbeddingStore
+    # resolver: An OOVResolver over the same store (a new one by default)
+    def __init__(self, word2vec, resolver=None):
+        self.store = word2vec
+        self.resolver = OOVResolver(word2vec) if resolver is None else resolver
+        self.dim = word2vec.dim
+        self.fingerprint = word2vec.fingerprint + ':oov'
+        self.gather = word2vec.gather
+        self.word = word2vec.word
+        self.words = word2vec.words
+        self.nbytes = word2vec.nbytes
+
+    def __len__(self):
+        return len(self.store)
+
+    def __contains__(self, token):
+        return self.index(token) >= 0
+
+    def __getitem__(self, token):
+        row = self.index(token)
+        if row < 0:
+            raise KeyError(token)
+        return self.gather(np.array([row]))[0]
+
+    # token: A string containing a single token
+    # Returns: The row of the token (or of its replacement), or -1 if there isn't any
+    def index(self, token):
+        row = self.store.index(token)
+        return row if row >= 0 else self.resolver.resolve(token)
+
+    # tokens: A list of strings
+    # Returns: A numpy array with the row of each token (see index)
+    def lookup(self, tokens):
+        return np.fromiter((self.index(tkn) for tkn in tokens), dtype=np.int64, count=len(tokens))
+
+
+# Explains the predictions of the health model with the closest words of its
+# training lexicon.
+class LexiconExplainer:
+
+    # word2vec: The Word2Vec representations the model was trained on
+    # dataset_path: The training dataset
+    def __init__(self, word2vec, dataset_path=DATASET_FILE):
+        self.word2vec = word2vec
+        # The lexicon has repeated entries, which would only fill the top k with copies
+        entries = dict.fromkeys(zip(*utils.load_as_list(dataset_path)))
+        self.lexicon = [entry for entry, _ in entries]
+        self.labels = [label for _, label in entries]
+        self.index = SimilarityIndex(utils.string2vec_batch(word2vec, self.lexicon))
+
+    # texts: A list of strings of arbitrary length
+    # k: The number of lexicon entries for each text
+    # Returns: For each text, a list of (lexicon entry, label, cosine similarity) tuples, the closest first
+    def explain(self, texts, k=5):
+        rows, sims = self.index.search(utils.string2vec_batch(self.word2vec, texts), k)
+        return [[(self.lexicon[row], self.labels[row], float(sim)) for row, sim in zip(text_rows, text_sims)]
+                for text_rows, text_sims in zip(rows, sims)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Nearest neighbors in the embeddings.')
+    parser.add_argument('command', choices=['neighbors', 'resolve', 'explain'],
+                        help='neighbors: closest words of the vocabulary; resolve: replacement of out of vocabulary '
+                             'tokens; explain: closest entries of the training lexicon')
+    parser.add_argument('texts', nargs='+')
+    parser.add_argument('-k', type=int, default=5)
+    parser.add_argument('--embeddings', default=utils.default_embedding_path())
+    parser.add_argument('--embedding-mode', default='float32', choices=store.MODES)
+    parser.add_argument('--dataset', default=DATASET_FILE)
+    args = parser.parse_args()
+
+    word2vec = utils.load_w2v(args.embeddings, args.embedding_mode)
+
+    if args.command == 'explain':
+        explainer = LexiconExplainer(word2vec, args.dataset)
+        for text, entries in zip(args.texts, explainer.explain(args.texts, args.k)):
+            print(text)
+            for entry, label, sim in entries:
+                print('   {0:<30} {1}  {2:.3f}'.format(entry, 'unhealthy' if label == 1 else 'healthy', sim))
+    elif args.command == 'neighbors':
+        index = SimilarityIndex(word2vec)
+        rows, sims = index.search(utils.string2vec_batch(word2vec, args.texts), args.k)
+        for text, text_rows, text_sims in zip(args.texts, rows, sims):
+            print('{0}: {1}'.format(text, ', '.join('{0} ({1:.3f})'.format(word2vec.word(row), sim)
+                                                   for row, sim in zip(text_rows, text_sims))))
+    else:
+        resolver = OOVResolver(word2vec, SimilarityIndex(word2vec))
+        for text in args.texts:
+            # The known words of the text are the context of the missing ones
+            context = utils.string2vec_batch(word2vec, [text])[0]
+            for tkn in utils.get_tokens(utils.preprocessing(text)):
+                if tkn in word2vec:
+                    continue
+                row = resolver.resolve(tkn, context if context.any() else None)
+                print('{0} -> {1}'.format(tkn, word2vec.word(row) if row >= 0 else '(no replacement)'))
@@ -1,5 +1,48 @@
 import string
 import nltk
+import numpy as np
+
+import src.metrics as metrics
+
+# Tags of each POS group counted by get_pos_categories and StyleAnalysis
+PRONOUN_TAGS = ['PRP', 'PRP$', 'WP', 'WP$']
+PRP_TAGS = ['PRP']
+ARTICLE_TAGS = ['DT']
+PAST_TAGS = ['VBD', 'VBN']
+FUTURE_TAGS = ['MD']
+PREPOSITION_TAGS = ['IN']
+
+# Terms counted as negations
+NEGATIONS = ["no", "not", "never", "n't"]
+
+# The nine features, in the order of StyleAnalysis.features and of the columns of feature_matrix
+FEATURES = ['num_words', 'wps', 'num_pronouns', 'num_prp', 'num_articles', 'num_past', 'num_future', 'num_prep',
+            'num_negations']
+NUM_FEATURES = len(FEATURES)
+# The psychological correlate of each feature
+CORRELATES = ["Talkativeness, verbal fluency", "Verbal fluency, cognitive complexity", "Informal, personal",
+              "Personal, social", "Use of concrete nouns, interest in objects/things", "Focused on the past",
+              "Future and goal-oriented", "Education, concern with precision", "Inhibition"]
+# Above these thresholds, talkativeness and verbal fluency are always among the correlates
+NUM_WORDS_THRESHOLD = 100
+WPS_THRESHOLD = 20
+
+# Tag -> columns (see FEATURES) the tag is counted in
+TAG_COLUMNS = {}
+for _column, _tags in [(2, PRONOUN_TAGS), (3, PRP_TAGS), (4, ARTICLE_TAGS), (5, PAST_TAGS), (6, FUTURE_TAGS),
+                       (7, PREPOSITION_TAGS)]:
+    for _tag in _tags:
+        TAG_COLUMNS[_tag] = TAG_COLUMNS.get(_tag, ()) + (_column,)
+# The same as a table: row i counts the tag TAG_ROWS[i] (row 0 is for the tags that aren't counted)
+TAG_ROWS = {tag: row for row, tag in enumerate(sorted(TAG_COLUMNS), 1)}
+TAG_TABLE = np.zeros((len(TAG_ROWS) + 1, NUM_FEATURES), dtype=np.int64)
+for _tag, _row in TAG_ROWS.items():
+    TAG_TABLE[_row, list(TAG_COLUMNS[_tag])] = 1
+
+# Dtype of the rows returned by summarize_batch
+SUMMARY_DTYPE = np.dtype([('num_words_flag', np.bool_), ('wps_flag', np.bool_), ('top_features', np.int8, (3,)),
+                          ('correlates', np.int8, (3,))])
+
 
 # user_input: A string of arbitrary length
 # Returns: An integer value
@@ -40,7 +83,8 @@ def get_pos_tags(user_input):
     tagged_input = []
 
     tkns = nltk.word_tokenize(user_input)
-    tagged_input = nltk.pos_tag(tkns)
+    with metrics.STEP_SECONDS.time('pos_tag'):
+        tagged_input = nltk.pos_tag(tkns)
 
     return tagged_input
 
@@ -53,29 +97,13 @@ def get_pos_tags(user_input):
 # This function counts the number of tokens corresponding to each of six POS tag
 # groups, and returns those values.
 def get_pos_categories(tagged_input):
-    num_pronouns = 0
-    num_prp = 0
-    num_articles = 0
-    num_past = 0
-    num_future = 0
-    num_prep = 0
-
-    # Write your code here:
-    num_pron_tags = ['PRP', 'PRP$', 'WP', 'WP$']
-    num_prp_tags = ['PRP']
-    num_art_tags = ['DT']
-    num_past_tags = ['VBD', 'VBN']
-    num_fut_tags = ['MD']
-    num_prep_tags = ['IN']
+    counts = [0] * NUM_FEATURES
+
     for (tkn, tag) in tagged_input:
-        if tag in num_pron_tags: num_pronouns += 1
-        if tag in num_prp_tags: num_prp += 1
-        if tag in num_art_tags: num_articles += 1
-        if tag in num_past_tags: num_past += 1
-        if tag in num_fut_tags: num_future += 1
-        if tag in num_prep_tags: num_prep += 1
+        for column in TAG_COLUMNS.get(tag, ()):
+            counts[column] += 1
 
-    return num_pronouns, num_prp, num_articles, num_past, num_future, num_prep
+    return tuple(counts[2:8])
 
 
 # user_input: A string of arbitrary length
@@ -85,13 +113,86 @@ def get_pos_categories(tagged_input):
 def count_negations(user_input):
     num_negations = 0
 
-    neg = ["no", "not", "never", "n't"]
     tkns = nltk.word_tokenize(user_input)
     for tkn in tkns:
-        if tkn.lower() in neg: num_negations += 1
+        if tkn.lower() in NEGATIONS: num_negations += 1
     return num_negations
 
 
+# The stylistic analysis of a string of arbitrary length.
+#
+# The functions above tokenize (and tag) the same input again and again, while
+# here the input is split in sentences and tokens only once, tagged only once,
+# and all the features are computed in a single pass over the shared tokens.
+# The correlates of the result are given by summarize.
+class StyleAnalysis:
+
+    # user_input: A string of arbitrary length
+    def __init__(self, user_input):
+        self._tokenize(user_input)
+        with metrics.STEP_SECONDS.time('pos_tag'):
+            self.pos_tags = nltk.pos_tag(self.tokens)
+        self._count()
+
+    # texts: A list of strings of arbitrary length
+    # count: Whether the features of each analysis are computed (feature_matrix
+    #        computes them for all the analyses at once, and doesn't need them)
+    # Returns: A list of StyleAnalysis, one for each text
+    #
+    # Analyzes many texts at once: the tokens of all the texts are tagged with
+    # a single call to the POS tagger (each text is still tagged as a whole, so
+    # the results are the same as analyzing the texts one by one).
+    @classmethod
+    def batch(cls, texts, count=True):
+        analyses = []
+        for text in texts:
+            analysis = cls.__new__(cls)
+            analysis._tokenize(text)
+            analyses.append(analysis)
+
+        with metrics.STEP_SECONDS.time('pos_tag_sents'):
+            tagged = nltk.pos_tag_sents([a.tokens for a in analyses])
+        for analysis, pos_tags in zip(analyses, tagged):
+            analysis.pos_tags = pos_tags
+            if count:
+                analysis._count()
+        return analyses
+
+    # user_input: A string of arbitrary length
+    # Returns: This function does not return any values
+    def _tokenize(self, user_input):
+        # word_tokenize splits the text in sentences and then tokenizes each of
+        # them, so tokenizing the sentences gives exactly the same tokens
+        self.sentences = nltk.tokenize.sent_tokenize(user_input)
+        self.sentence_tokens = [nltk.tokenize.word_tokenize(sentence, preserve_line=True)
+                                for sentence in self.sentences]
+        self.tokens = [tkn for tokens in self.sentence_tokens for tkn in tokens]
+
+    # Returns: This function does not return any values
+    #
+    # Computes all the features in one pass over the tokens and their tags.
+    def _count(self):
+        counts = [0] * NUM_FEATURES
+        for tkn, (_, tag) in zip(self.tokens, self.pos_tags):
+            if tkn not in string.punctuation: counts[0] += 1
+            if tkn.lower() in NEGATIONS: counts[8] += 1
+            for column in TAG_COLUMNS.get(tag, ()):
+                counts[column] += 1
+
+        (self.num_words, _, self.num_pronouns, self.num_prp, self.num_articles, self.num_past, self.num_future,
+         self.num_prep, self.num_negations) = counts
+        self.wps = self.num_words / len(self.sentences) if len(self.sentences) > 0 else 0.0
+
+    # Returns: The nine features, in the same order as the arguments of summarize_analysis
+    def features(self):
+        return (self.num_words, self.wps, self.num_pronouns, self.num_prp, self.num_articles,
+                self.num_past, self.num_future, self.num_prep, self.num_negations)
+
+    # Returns: A list of three strings (see summarize_analysis)
+    def summarize(self):
+        return summarize_analysis(*self.features())
+
+
 # num_words: An integer value
 # wps: A floating point value
 # num_pronouns: An integer value
@@ -109,35 +210,67 @@ def count_negations(user_input):
 def summarize_analysis(num_words, wps, num_pronouns, num_prp, num_articles, num_past, num_future, num_prep, num_negations):
     informative_correlates = []
 
-    # Creating a reference dictionary with keys = linguistic features, and values = psychological correlates.
-    psychological_correlates = {}
-    psychological_correlates["num_words"] = "Talkativeness, verbal fluency"
-    psychological_correlates["wps"] = "Verbal fluency, cognitive complexity"
-    psychological_correlates["num_pronouns"] = "Informal, personal"
-    psychological_correlates["num_prp"] = "Personal, social"
-    psychological_correlates["num_articles"] = "Use of concrete nouns, interest in objects/things"
-    psychological_correlates["num_past"] = "Focused on the past"
-    psychological_correlates["num_future"] = "Future and goal-oriented"
-    psychological_correlates["num_prep"] = "Education, concern with precision"
-    psychological_correlates["num_negations"] = "Inhibition"
-
-    # Set thresholds
-    num_words_threshold = 100
-    wps_threshold = 20
-
-    features = [(num_pronouns, 'num_pronouns'), (num_prp, 'num_prp'), (num_articles, 'num_articles'),
-                (num_past, 'num_past'), (num_future, 'num_future'), (num_prep, 'num_prep'),
-                (num_negations, 'num_negations')]
-
-    if num_words > num_words_threshold: informative_correlates.append(psychological_correlates['num_words'])
-    if wps > wps_threshold: informative_correlates.append(psychological_correlates['wps'])
-
-    for _ in range(3):
-        best = (-1, 'Nope')
-        for elem in features:
-            if elem[0] > best[0]: best = elem
-        informative_correlates.append(psychological_correlates[best[1]])
-        features.remove(best)
+    features = (num_words, wps, num_pronouns, num_prp, num_articles, num_past, num_future, num_prep, num_negations)
+
+    if features[0] > NUM_WORDS_THRESHOLD: informative_correlates.append(CORRELATES[0])
+    if features[1] > WPS_THRESHOLD: informative_correlates.append(CORRELATES[1])
+
+    # The largest counts, the first feature winning the ties (sorted is stable)
+    top_features = sorted(range(2, NUM_FEATURES), key=lambda column: -features[column])[:3]
+    informative_correlates += [CORRELATES[column] for column in top_features]
 
     informative_correlates = informative_correlates[:3]
-    return informative_correlates
\ No newline at end of file
+    return informative_correlates
+
+
+# analyses: A list of StyleAnalysis (see StyleAnalysis.batch(texts, count=False))
+# Returns: A numpy array of shape (N, 9), with the features of each analysis (see FEATURES)
+#
+# The tags of all the analyses are mapped to rows of TAG_TABLE and counted per
+# analysis with a single bincount, instead of checking every tag of every
+# analysis against every group.
+def feature_matrix(analyses):
+    matrix = np.zeros((len(analyses), NUM_FEATURES), dtype=np.float64)
+    if len(analyses) == 0:
+        return matrix
+
+    lengths = np.array([len(analysis.tokens) for analysis in analyses], dtype=np.int64)
+    owners = np.repeat(np.arange(len(analyses)), lengths)
+    tokens = [tkn for analysis in analyses for tkn in analysis.tokens]
+    rows = np.fromiter((TAG_ROWS.get(tag, 0) for analysis in analyses for _, tag in analysis.pos_tags),
+                       dtype=np.int64, count=len(tokens))
+    is_word = np.fromiter((tkn not in string.punctuation for tkn in tokens), dtype=np.bool_, count=len(tokens))
+    is_negation = np.fromiter((tkn.lower() in NEGATIONS for tkn in tokens), dtype=np.bool_, count=len(tokens))
+
+    token_idx, columns = np.nonzero(TAG_TABLE[rows])
+    matrix += np.bincount(owners[token_idx] * NUM_FEATURES + columns,
+                          minlength=len(analyses) * NUM_FEATURES).reshape(-1, NUM_FEATURES)
+    matrix[:, 0] = np.bincount(owners[is_word], minlength=len(analyses))
+    matrix[:, 8] = np.bincount(owners[is_negation], minlength=len(analyses))
+
+    num_sentences = np.array([len(analysis.sentences) for analysis in analyses], dtype=np.float64)
+    matrix[:, 1] = np.divide(matrix[:, 0], num_sentences, out=np.zeros(len(analyses)), where=num_sentences > 0)
+    return matrix
+
+
+# features: A numpy array of shape (N, 9) (see feature_matrix)
+# Returns: A structured numpy array of N rows (see SUMMARY_DTYPE): whether the
+#          thresholds of num_words and wps are exceeded, the columns of the three
+#          largest counts, and the correlates chosen by summarize_analysis (as
+#          indices of CORRELATES: np.array(CORRELATES)[summary['correlates']] gives the strings)
+#
+# The same as summarize_analysis, for all the rows at once.
+def summarize_batch(features):
+    features = np.asarray(features, dtype=np.float64).reshape(-1, NUM_FEATURES)
+    summary = np.zeros(len(features), dtype=SUMMARY_DTYPE)
+    summary['num_words_flag'] = features[:, 0] > NUM_WORDS_THRESHOLD
+    summary['wps_flag'] = features[:, 1] > WPS_THRESHOLD
+    # A stable sort keeps the first feature first among equal counts, like summarize_analysis
+    summary['top_features'] = np.argsort(-features[:, 2:], axis=1, kind='stable')[:, :3] + 2
+
+    # The flagged features come first, then the top features, and the first three are kept
+    candidates = np.column_stack([np.where(summary['num_words_flag'], 0, -1), np.where(summary['wps_flag'], 1, -1),
+                                  summary['top_features']])
+    order = np.argsort(candidates < 0, axis=1, kind='stable')[:, :3]
+    summary['correlates'] = np.take_along_axis(candidates, order, axis=1)
+    return summary
@@ -0,0 +1,58 @@
+import argparse
+
+import src.style_analysis as style
+import src.batch as batch
+
+# Columns of the output file
+FIELDS = ['id', 'num_words', 'wps', 'num_pronouns', 'num_prp', 'num_articles', 'num_past',
+          'num_future', 'num_prep', 'num_negations', 'correlates']
+
+
+# chunk: A list of (id, text) pairs
+# Returns: A list of output rows, one for each text
+#
+# This function analyzes a chunk of texts, tagging all their tokens with a
+# single call to the POS tagger, and computing the features and correlates of
+# the whole chunk at once.
+def analyze_chunk(chunk):
+    analyses = style.StyleAnalysis.batch([text for _, text in chunk], count=False)
+    features = style.feature_matrix(analyses)
+    summary = style.summarize_batch(features)
+
+    rows = []
+    for (text_id, _), row, correlates in zip(chunk, features, summary['correlates']):
+        counts = [int(value) for value in row]
+        rows.append([text_id, counts[0], float(row[1]), *counts[2:],
+                     '; '.join(style.CORRELATES[column] for column in correlates)])
+    return rows
+
+
+# in_fname: Path of the input CSV or JSONL file
+# out_fname: Path of the output CSV file
+# workers: The number of worker processes (1 to run everything in this process)
+# chunk_size: The number of texts analyzed by a worker at a time
+# text_field, id_field, file_format: See batch.read_texts
+# Returns: The number of texts analyzed
+#
+# This function runs the stylistic analysis over a whole corpus, writing the
+# raw feature counts and the psychological correlates of each text.
+def analyze_corpus(in_fname, out_fname, workers=None, chunk_size=500, text_field='text', id_field='id',
+                   file_format=None):
+    chunks = batch.chunked(batch.read_texts(in_fname, text_field, id_field, file_format), chunk_size)
+    return batch.write_chunks(chunks, out_fname, FIELDS, analyze_chunk, workers, 'texts', 'analyzed')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the stylistic analysis over a corpus of texts.')
+    parser.add_argument('input', help='CSV or JSONL file containing the texts')
+    parser.add_argument('output', help='CSV file where the results are written')
+    parser.add_argument('--text-field', default='text')
+    parser.add_argument('--id-field', default='id')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default=None,
+                        help='Format of the input (guessed from the extension by default)')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: all cores)')
+    parser.add_argument('--chunk-size', type=int, default=500, help='Number of texts tagged together')
+    args = parser.parse_args()
+
+    analyze_corpus(args.input, args.output, args.workers, args.chunk_size, args.text_field, args.id_field,
+                   args.format)
@@ -1,13 +1,34 @@
 import os
+import csv
+import json
+import time
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 import src.utils as utils
+from sklearn.base import clone
 from sklearn.linear_model import LogisticRegression
 from sklearn.svm import LinearSVC
 from sklearn.neural_network import MLPClassifier
+from sklearn.model_selection import ParameterGrid, StratifiedKFold
 from sklearn.metrics import precision_score, recall_score, f1_score, accuracy_score
 
 
 # Setting the name of the file containing the pre-trained word2vec representations
-EMBEDDING_FILE = os.path.join("data", "w2v.pkl")
+EMBEDDING_FILE = utils.default_embedding_path()
+# Setting the names of the files containing the training and test data
+DATASET_FILE = os.path.join("data", "dataset.csv")
+TEST_FILE = os.path.join("data", "test.csv")
+
+# Names of the metrics, in the order returned by test_model
+METRICS = ['precision', 'recall', 'f1', 'accuracy']
+
+# Hyperparameters compared for each model by analyze_models --grid
+PARAM_GRIDS = {
+    'Logistic Regression': {'C': [0.1, 1.0, 10.0]},
+    'Support Vector Machine': {'C': [0.1, 1.0, 10.0]},
+    'Multi-Layer Perceptron': {'hidden_layer_sizes': [(50,), (100,)], 'alpha': [0.0001, 0.01]},
+}
 
 # model: An instantiated machine learning model
 # word2vec: A pretrained Word2Vec model
@@ -18,10 +39,8 @@ EMBEDDING_FILE = os.path.join("data", "w2v.pkl")
 # This function trains an input machine learning model using averaged Word2Vec
 # embeddings for the training documents.
 def train_model(model, word2vec, training_documents, training_labels):
-    # Generate a list of embeddings
-    doc_embeddings = []
-    for doc in training_documents:
-        doc_embeddings.append(utils.string2vec(word2vec, doc))
+    # Generate the matrix of embeddings
+    doc_embeddings = utils.string2vec_batch(word2vec, training_documents)
 
     # Train the model
     model.fit(doc_embeddings, training_labels)
@@ -39,58 +58,190 @@ def train_model(model, word2vec, training_documents, training_labels):
 # that document.  It compares the predicted and actual test labels and returns
 # precision, recall, f1, and accuracy scores.
 def test_model(model, word2vec, test_documents, test_labels):
-    # Generate a list of embeddings
-    doc_embeddings = []
-    for doc in test_documents:
-        doc_embeddings.append(utils.string2vec(word2vec, doc))
+    # Generate the matrix of embeddings
+    doc_embeddings = utils.string2vec_batch(word2vec, test_documents)
 
     # Obtain a prediction for all test data
     predicted_labels = model.predict(doc_embeddings)
 
-    # Calculate all the metrics
-    precision = precision_score(test_labels, predicted_labels)
-    recall = recall_score(test_labels, predicted_labels)
-    f1 = f1_score(test_labels, predicted_labels)
-    accuracy = accuracy_score(test_labels, predicted_labels)
+    return compute_metrics(test_labels, predicted_labels)
 
-    return (precision, recall, f1, accuracy)
+# labels: A list of integers (all 0 or 1)
+# predicted_labels: A list of integers (all 0 or 1)
+# Returns: Precision, recall, F1, and accuracy values of the predictions
+def compute_metrics(labels, predicted_labels):
+    precision = precision_score(labels, predicted_labels, zero_division=0)
+    recall = recall_score(labels, predicted_labels, zero_division=0)
+    f1 = f1_score(labels, predicted_labels, zero_division=0)
+    accuracy = accuracy_score(labels, predicted_labels)
 
-def analyze_models():
-    # Load the dataset
-    lexicon, labels = utils.load_as_list("dataset.csv")
-    test_data, test_labels = utils.load_as_list("test.csv")
+    return (precision, recall, f1, accuracy)
 
-    # Load the Word2Vec representations
-    word2vec = utils.load_w2v(EMBEDDING_FILE)
+# model: An instantiated machine learning model
+# word2vec: A pretrained Word2Vec model
+# fname: The training dataset (see utils.iter_batches)
+# batch_size: The maximum number of documents read and embedded at a time
+# incremental: Whether to train the model batch by batch with partial_fit
+# Returns: A trained version of the input model
+#
+# Streaming version of train_model. With incremental, only one batch is in
+# memory at a time; otherwise the model is fitted on the embeddings of the
+# whole dataset (the same model train_model would train), but the documents
+# are never all in memory.
+def train_model_stream(model, word2vec, fname, batch_size=1024, incremental=False):
+    if not incremental:
+        doc_embeddings, labels = utils.embed_file(word2vec, fname, batch_size)
+        return model.fit(doc_embeddings, labels)
+
+    for doc_embeddings, labels in utils.iter_embedded_batches(word2vec, fname, batch_size):
+        model.partial_fit(doc_embeddings, labels, classes=utils.LABELS)
+    return model
 
-    # Instantiate the models
+# model: A trained machine learning model
+# word2vec: A pretrained Word2Vec model
+# fname: The test dataset (see utils.iter_batches)
+# batch_size: The maximum number of documents read and embedded at a time
+# Returns: Precision, recall, F1, and accuracy values for the test data
+#
+# Streaming version of test_model: the documents are embedded and predicted
+# batch by batch, and only the labels are kept to compute the metrics.
+def test_model_stream(model, word2vec, fname, batch_size=1024):
+    labels, predicted_labels = [], []
+    for doc_embeddings, batch_labels in utils.iter_embedded_batches(word2vec, fname, batch_size):
+        labels.append(batch_labels)
+        predicted_labels.append(model.predict(doc_embeddings))
+
+    if len(labels) == 0:
+        return compute_metrics([], [])
+    return compute_metrics(np.concatenate(labels), np.concatenate(predicted_labels))
+
+# Returns: Two lists: the names of the models compared by analyze_models, and the instantiated models
+def get_models():
     names = ['Logistic Regression', 'Support Vector Machine', 'Multi-Layer Perceptron']
     models = [LogisticRegression(), LinearSVC(), MLPClassifier(max_iter=5000)]
-    
-    # Training models
-    print('\nStarted Training!\n')
-    for idx in range(len(models)):
-        print(f'Training {names[idx]}...')
-        models[idx] = train_model(models[idx], word2vec, lexicon, labels)
-    print('\n--------------------------------------------------------\n')
-
-    # Test models
-    print('Started Testing!\n')
-    results = []
-    for name, model in zip(names, models):
-        print(f'Training {name}...')
-        results.append(test_model(model, word2vec, test_data, test_labels))
-    print('\n--------------------------------------------------------\n')
+    return names, models
+
+# grid: Whether to expand the hyperparameter grid of each model (see PARAM_GRIDS)
+# Returns: A list of (name, model, params) tuples, one for each candidate to compare
+def get_candidates(grid=False):
+    candidates = []
+    for name, model in zip(*get_models()):
+        if not grid:
+            candidates.append((name, model, {}))
+            continue
+        for params in ParameterGrid(PARAM_GRIDS[name]):
+            candidates.append((name, clone(model).set_params(**params), params))
+    return candidates
+
+# Data shared by the worker processes of analyze_models (set once per process by _init_worker)
+_shared = {}
+
+# Returns: This function does not return any values
+def _init_worker(train_embeddings, train_labels, test_embeddings, test_labels):
+    _shared['train'] = (train_embeddings, train_labels)
+    _shared['test'] = (test_embeddings, test_labels)
+
+# candidate: A (name, model, params) tuple
+# folds: The number of folds of the cross-validation (0 or 1 to skip it)
+# seed: The seed used to shuffle the folds
+# Returns: A dictionary with the metrics and the timings of the candidate
+#
+# This function cross-validates the candidate on the training embeddings, then
+# trains it on all of them and tests it on the test embeddings.
+def evaluate_candidate(candidate, folds=5, seed=0):
+    name, model, params = candidate
+    train_embeddings, train_labels = _shared['train']
+    test_embeddings, test_labels = _shared['test']
+    result = {'model': name, 'params': json.dumps(params, sort_keys=True)}
+
+    if folds > 1:
+        cv_metrics = []
+        splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed)
+        for train_idx, val_idx in splitter.split(train_embeddings, train_labels):
+            fold_model = clone(model).fit(train_embeddings[train_idx], train_labels[train_idx])
+            cv_metrics.append(compute_metrics(train_labels[val_idx], fold_model.predict(train_embeddings[val_idx])))
+        cv_metrics = np.array(cv_metrics)
+        for idx, metric in enumerate(METRICS):
+            result['cv_' + metric + '_mean'] = cv_metrics[:, idx].mean()
+            result['cv_' + metric + '_std'] = cv_metrics[:, idx].std()
+
+    start = time.perf_counter()
+    model = clone(model).fit(train_embeddings, train_labels)
+    result['fit_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    predicted_labels = model.predict(test_embeddings)
+    result['predict_s'] = time.perf_counter() - start
+
+    for metric, value in zip(METRICS, compute_metrics(test_labels, predicted_labels)):
+        result[metric] = value
+    return result
+
+# results: A list of dictionaries (see evaluate_candidate)
+# fname: The output file (JSON if its extension is .json, CSV otherwise)
+# Returns: This function does not return any values
+def write_results(results, fname):
+    if fname.endswith('.json'):
+        with open(fname, 'w') as fout:
+            json.dump(results, fout, indent=2)
+        return
+
+    fields = []
+    for res in results:
+        fields += [key for key in res if key not in fields]
+    with open(fname, 'w', newline='') as fout:
+        writer = csv.DictWriter(fout, fields)
+        writer.writeheader()
+        writer.writerows(results)
+
+# word2vec: A pretrained Word2Vec model (loaded from EMBEDDING_FILE if None)
+# folds: The number of folds of the cross-validation (0 or 1 to skip it)
+# grid: Whether to compare the whole hyperparameter grid of each model
+# workers: The number of worker processes (1 to run everything in this process)
+# output: An optional file where the results table is written
+# Returns: A list of dictionaries, with the metrics and timings of each candidate
+#
+# This function compares the candidate models: the training and test documents
+# are embedded only once, and the candidates are then trained and tested in
+# parallel on the shared embeddings.
+def analyze_models(word2vec=None, folds=5, grid=False, workers=None, output=None):
+    # Load the Word2Vec representations
+    if word2vec is None:
+        word2vec = utils.load_w2v(EMBEDDING_FILE)
+
+    # Embed the documents once for all the candidates
+    data = utils.embed_file(word2vec, DATASET_FILE) + utils.embed_file(word2vec, TEST_FILE)
+
+    candidates = get_candidates(grid)
+    workers = min(workers or os.cpu_count() or 1, len(candidates))
+    print('\nComparing {0} candidates ({1} workers, {2} folds)...\n'.format(len(candidates), workers, folds))
+
+    if workers > 1:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=data) as executor:
+            results = list(executor.map(evaluate_candidate, candidates, [folds] * len(candidates)))
+    else:
+        _init_worker(*data)
+        results = [evaluate_candidate(candidate, folds) for candidate in candidates]
 
     # Printing the results (Terrible to write, but looks good as output)
-    print('\t\t\t\tPrecision\tRecall\t     Accuracy\t     F1')
-    for name, res in zip(names, results):
-        print(f'{name}\t\t   '+
-              f'{res[0]:.2f}\t\t '+
-              f'{res[1]:.2f}\t       '+
-              f'{res[2]:.2f}\t    '+
-              f'{res[3]:.2f}')
+    print('Model\t\t\t\tParams\t\t\t\tPrecision  Recall  F1\tAccuracy  Fit (ms)  Predict (ms)')
+    for res in results:
+        print(f'{res["model"]:<24}\t{res["params"]:<24}\t'
+              f'{res["precision"]:.2f}\t   {res["recall"]:.2f}\t   {res["f1"]:.2f}\t{res["accuracy"]:.2f}\t  '
+              f'{res["fit_s"] * 1000:8.1f}  {res["predict_s"] * 1000:8.2f}')
 
-if __name__ == '__main__':
-    analyze_models()
+    if output is not None:
+        write_results(results, output)
+        print('\nResults saved to {0}'.format(output))
 
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the models for the health check.')
+    parser.add_argument('--folds', type=int, default=5, help='Folds of the cross-validation (0 to skip it)')
+    parser.add_argument('--grid', action='store_true', help='Compare the whole hyperparameter grid of each model')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: all cores)')
+    parser.add_argument('--output', default='model_comparison.csv', help='Results table (CSV, or JSON if .json)')
+    args = parser.parse_args()
+
+    analyze_models(folds=args.folds, grid=args.grid, workers=args.workers, output=args.output)
@@ -1,21 +1,55 @@
+import os
+import csv
+import json
 import pickle as pkl
 import numpy as np
 import string
 
-# filepath: path of w2v.pkl
-# Returns: A dictionary containing words as keys and pre-trained word2vec representations as numpy arrays of shape (300,)
-def load_w2v(filepath):
+import src.metrics as metrics
+import src.embedding_store as store
+
+# Default locations of the pre-trained word2vec representations: the memory-mapped
+# store (see src/embedding_store.py) is preferred over the pickled dictionary
+EMBEDDING_PKL = os.path.join("data", "w2v.pkl")
+EMBEDDING_STORE = os.path.join("data", "w2v_store")
+
+# Returns: The path of the word2vec representations to use by default
+def default_embedding_path():
+    if store.is_store(EMBEDDING_STORE):
+        return EMBEDDING_STORE
+    return EMBEDDING_PKL
+
+# filepath: path of w2v.pkl, or of an embedding store directory
+# mode: The storage mode of the vectors, for embedding stores (see embedding_store.MODES)
+# Returns: A dictionary (or a dictionary-like EmbeddingStore) containing words as keys and pre-trained word2vec
+#          representations as numpy arrays of shape (300,)
+def load_w2v(filepath, mode='float32'):
+    if store.is_store(filepath):
+        return store.load_store(filepath, mode)
+    if mode != 'float32':
+        raise ValueError("The '{0}' mode needs an embedding store, convert {1} first "
+                         "(python -m src.embedding_store convert)".format(mode, filepath))
     with open(filepath, 'rb') as fin:
         return pkl.load(fin)
 
+# word2vec: The pretrained Word2Vec representations (dictionary or EmbeddingStore)
+# Returns: The dimension of the embeddings
+def embedding_dim(word2vec):
+    if hasattr(word2vec, 'dim'):
+        return word2vec.dim
+    for vector in word2vec.values():
+        return len(vector)
+    return 300
+
 # word2vec: The pretrained Word2Vec representations as dictionary
 # token: A string containing a single token
-# Returns: The Word2Vec embedding for that token, as a numpy array of size (300,)
+# Returns: The Word2Vec embedding for that token, as a numpy array of size (300,) (or of the dimension of the
+#          embeddings)
 def w2v(word2vec, token):
-    word_vector = np.zeros(300,)
-
     if token in word2vec:
         word_vector = word2vec[token]
+    else:
+        word_vector = np.zeros(embedding_dim(word2vec),)
 
     return word_vector
 
@@ -26,22 +60,165 @@ def get_tokens(inp_str):
 
 # word2vec: The pretrained Word2Vec model
 # user_input: A string of arbitrary length
-# Returns: A 300-dimensional averaged Word2Vec embedding for that string
+# Returns: A 300-dimensional (or of the dimension of the embeddings) averaged Word2Vec embedding for that string
 #
 # This function preprocesses the input string, tokenizes it using get_tokens, extracts a word embedding for
 # each token in the string, and averages across those embeddings to produce a
-# single, averaged embedding for the entire input.
+# single, averaged embedding for the entire input. The rows of all the tokens
+# are looked up at once, and read (and dequantized) with a single gather. As in
+# string2vec_batch, an input without any token gets a zero embedding.
+@metrics.timed(metrics.STEP_SECONDS, 'string2vec')
 def string2vec(word2vec, user_input):
-    embedding = np.zeros(300,)
+    embedding = np.zeros(embedding_dim(word2vec),)
 
     tokens = get_tokens(preprocessing(user_input))
-    for tkn in tokens:
-        embedding += w2v(word2vec, tkn)
-    embedding = embedding / len(tokens)
+    ids, gather = token_rows(word2vec, tokens)
+    ids = ids[ids >= 0]
+    if len(ids) > 0:
+        embedding += gather(ids).sum(axis=0, dtype=np.float64)
+    embedding = embedding / max(len(tokens), 1)
     return embedding
 
-import pandas as pd
+# word2vec: The pretrained Word2Vec representations (dictionary or EmbeddingStore)
+# tokens: A list of strings
+# Returns: A numpy array with the row of each token (-1 if not in the vocabulary), and a function returning the
+#          float32 vectors of a numpy array of rows
+#
+# An EmbeddingStore already has a matrix and row indices (and dequantizes the rows it returns), while for a dictionary
+# a small matrix containing only the (unique) tokens in the list is built.
+def token_rows(word2vec, tokens):
+    if hasattr(word2vec, 'lookup'):
+        return word2vec.lookup(tokens), word2vec.gather
+
+    rows = {}
+    vectors = []
+    ids = np.empty(len(tokens), dtype=np.int64)
+    for idx, tkn in enumerate(tokens):
+        row = rows.get(tkn)
+        if row is None:
+            row = -1
+            if tkn in word2vec:
+                row = len(vectors)
+                vectors.append(word2vec[tkn])
+            rows[tkn] = row
+        ids[idx] = row
+
+    if len(vectors) == 0:
+        matrix = np.zeros((0, embedding_dim(word2vec)), dtype=np.float32)
+    else:
+        matrix = np.asarray(vectors, dtype=np.float32)
+    return ids, matrix.__getitem__
+
+# word2vec: The pretrained Word2Vec model
+# documents: A list of strings of arbitrary length
+# Returns: A numpy array of shape (len(documents), 300) containing the averaged Word2Vec embedding of each document
+#
+# Batch version of string2vec: all the tokens of all the documents are mapped to rows in one pass, the vectors are
+# gathered once per unique row, and then summed per document with a segmented reduction. As in string2vec, tokens
+# that aren't in the vocabulary count as zero vectors. Documents without any token get a zero embedding.
+@metrics.timed(metrics.STEP_SECONDS, 'string2vec_batch')
+def string2vec_batch(word2vec, documents):
+    dim = embedding_dim(word2vec)
+    embeddings = np.zeros((len(documents), dim), dtype=np.float32)
+    if len(documents) == 0:
+        return embeddings
+
+    tokens = []
+    lengths = np.empty(len(documents), dtype=np.int64)
+    for idx, doc in enumerate(documents):
+        doc_tokens = get_tokens(preprocessing(doc))
+        tokens.extend(doc_tokens)
+        lengths[idx] = len(doc_tokens)
+
+    ids, gather = token_rows(word2vec, tokens)
+    found = ids >= 0
+    if not found.any():
+        return embeddings
 
+    # Read (and dequantize) every needed row only once, sorted to be friendly with memory-mapped matrices
+    unique_ids, inverse = np.unique(ids[found], return_inverse=True)
+    rows = gather(unique_ids)[inverse]
+
+    # Sum the rows of each document (rows are already grouped by document)
+    segments = np.repeat(np.arange(len(documents)), lengths)[found]
+    counts = np.bincount(segments, minlength=len(documents))
+    non_empty = counts > 0
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[non_empty]
+    embeddings[non_empty] = np.add.reduceat(rows, starts, axis=0, dtype=np.float64)
+
+    embeddings /= np.maximum(lengths, 1)[:, None]
+    return embeddings
+
+
+# The labels of the datasets
+LABELS = (0, 1)
+
+# value: A label read from a dataset (an integer, or a string containing one)
+# Returns: The label as an integer
+# Raises: ValueError if the value isn't one of LABELS
+def parse_label(value):
+    try:
+        label = int(str(value).strip())
+    except ValueError:
+        raise ValueError('invalid label {0!r}'.format(value)) from None
+    if label not in LABELS:
+        raise ValueError('invalid label {0!r}'.format(value))
+    return label
+
+# fname: A CSV file (with a header), or a JSONL file (one object per line)
+# batch_size: The maximum number of documents of a batch
+# text_field: The column (or key) of the documents
+# label_field: The column (or key) of the labels
+# Returns: An iterator over batches: pairs of lists, the documents and their (integer) labels
+# Raises: ValueError (naming the file and the line) if a record has no document or an invalid label
+#
+# This function reads the dataset as a stream, so only one batch is in memory at a time.
+def iter_batches(fname, batch_size=1024, text_field='Lexicon', label_field='Label'):
+    jsonl = os.path.splitext(fname)[1].lower() in ('.jsonl', '.json')
+    texts, labels = [], []
+    with open(fname, newline='', encoding='utf-8') as fin:
+        if jsonl:
+            records = (json.loads(line) for line in fin if line.strip())
+        else:
+            records = csv.DictReader(fin)
+        for num, record in enumerate(records, 1):
+            try:
+                text = record[text_field]
+                if text is None:
+                    raise KeyError(text_field)
+                labels.append(parse_label(record[label_field]))
+            except (KeyError, ValueError) as err:
+                raise ValueError('{0}, record {1}: {2}'.format(fname, num, err)) from None
+            texts.append(text)
+
+            if len(texts) == batch_size:
+                yield texts, labels
+                texts, labels = [], []
+    if len(texts) > 0:
+        yield texts, labels
+
+# word2vec: The pretrained Word2Vec model
+# fname: A dataset (see iter_batches)
+# batch_size: The maximum number of documents embedded at a time
+# Returns: An iterator over batches: pairs of numpy arrays, the embeddings and the labels
+def iter_embedded_batches(word2vec, fname, batch_size=1024):
+    for texts, labels in iter_batches(fname, batch_size):
+        yield string2vec_batch(word2vec, texts), np.asarray(labels, dtype=np.int64)
+
+# word2vec: The pretrained Word2Vec model
+# fname: A dataset (see iter_batches)
+# batch_size: The maximum number of documents embedded at a time
+# Returns: Two numpy arrays: the embeddings of all the documents, and their labels
+#
+# The documents are never all in memory, only their embeddings.
+def embed_file(word2vec, fname, batch_size=1024):
+    embeddings, labels = [], []
+    for batch_embeddings, batch_labels in iter_embedded_batches(word2vec, fname, batch_size):
+        embeddings.append(batch_embeddings)
+        labels.append(batch_labels)
+    if len(embeddings) == 0:
+        return np.zeros((0, embedding_dim(word2vec)), dtype=np.float32), np.zeros(0, dtype=np.int64)
+    return np.concatenate(embeddings), np.concatenate(labels)
 
 # fname: A string indicating a filename
 # Returns: Two lists: one a list of strings, and the other a list of integers
@@ -49,9 +226,10 @@ import pandas as pd
 # This helper function reads in the specified, specially-formatted CSV file
 # and returns a list of documents (lexicon) and a list of binary values (label).
 def load_as_list(fname):
-    df = pd.read_csv(fname)
-    lexicon = df['Lexicon'].values.tolist()
-    label = df['Label'].values.tolist()
+    lexicon, label = [], []
+    for texts, labels in iter_batches(fname):
+        lexicon += texts
+        label += labels
     return lexicon, label
 
 # user_input: A string of arbitrary length
@@ -0,0 +1,81 @@
+import time
+import logging
+import threading
+
+import src.utils as utils
+
+log = logging.getLogger(__name__)
+
+
+# Loads everything the chatbot needs in a background thread.
+#
+# The heavy imports (sklearn, nltk), the Word2Vec representations, the model
+# (trained, or loaded from the artifact cache), and the POS tagger are all
+# loaded while the user reads the welcome message and types their name, so the
+# first prompt is shown right away. Only the first health check waits for the
+# warm-up, and only if it isn't over yet.
+class Warmup:
+
+    # embedding_path: Path of the Word2Vec representations
+    # dataset_path: Path of the training dataset
+    # embedding_mode: The storage mode of the vectors (see src/embedding_store.py)
+    def __init__(self, embedding_path, dataset_path, embedding_mode='float32'):
+        self.embedding_path = embedding_path
+        self.dataset_path = dataset_path
+        self.embedding_mode = embedding_mode
+        self.model = None
+        self.model_key = None
+        self.word2vec = None
+        self.error = None
+        self.duration = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='carebot-warmup', daemon=True)
+
+    # Returns: This object, so that it can be created and started in one line
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    # Returns: This function does not return any values
+    def _run(self):
+        try:
+            from sklearn.linear_model import LogisticRegression
+            import src.model_cache as cache
+
+            self.word2vec = utils.load_w2v(self.embedding_path, self.embedding_mode)
+            log.info('Embeddings loaded after %.3fs', time.perf_counter() - self._started)
+            self.model, self.model_key = cache.load_or_train(LogisticRegression(), self.word2vec,
+                                                             self.dataset_path, self.embedding_path)
+            log.info('Model ready after %.3fs', time.perf_counter() - self._started)
+
+            # NLTK loads its models lazily: analyzing a sentence loads both the
+            # sentence tokenizer and the POS tagger
+            import src.style_analysis as style
+            try:
+                style.StyleAnalysis('Warming up the tagger. It only takes a moment.')
+            except LookupError:
+                log.warning('NLTK models not found, the stylistic analysis will fail')
+
+            self.duration = time.perf_counter() - self._started
+            log.info('Warm-up completed in %.3fs', self.duration)
+        except BaseException as err:
+            self.error = err
+            log.exception('Warm-up failed')
+        finally:
+            self._done.set()
+
+    # Returns: True if the warm-up is over
+    def is_done(self):
+        return self._done.is_set()
+
+    # Returns: The trained model and the Word2Vec representations
+    #
+    # Blocks until the warm-up is over.
+    def wait(self):
+        if not self._done.is_set():
+            log.info('Waiting for the warm-up to complete')
+            self._done.wait()
+        if self.error is not None:
+            raise RuntimeError('The warm-up failed') from self.error
+        return self.model, self.word2vec
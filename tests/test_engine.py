@@ -0,0 +1,39 @@
+import asyncio
+
+import numpy as np
+
+from src.engine import ConversationEngine
+from src.scheduler import InferenceScheduler
+from src.sentence_cache import SentenceCache
+
+
+# A model that predicts the same label for every input
+class ConstantModel:
+
+    def __init__(self, label):
+        self.label = label
+
+    def predict(self, doc_embeddings):
+        return np.full(len(doc_embeddings), self.label)
+
+
+async def classify_during_swap(engine):
+    engine.scheduler.start()
+    task = asyncio.ensure_future(engine.classify_async('I feel fine'))
+    # The input is queued with the old model, and classified after the swap
+    await asyncio.sleep(0)
+    engine.swap_model(ConstantModel(1), 'new')
+    label = await task
+    await engine.scheduler.stop()
+    return label
+
+
+def test_swapped_model_never_caches_a_stale_label():
+    word2vec = {'fine': np.ones(300, dtype=np.float32)}
+    scheduler = InferenceScheduler(ConstantModel(0), word2vec, max_wait_ms=50)
+    cache = SentenceCache()
+    engine = ConversationEngine(ConstantModel(0), word2vec, scheduler=scheduler, cache=cache, model_key='old')
+
+    assert asyncio.run(classify_during_swap(engine)) == 1
+    key = cache.key('I feel fine')
+    assert cache.predictions.get(key, cache.prediction_generation(None, word2vec, 'old')) is None
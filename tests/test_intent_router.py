@@ -0,0 +1,59 @@
+import re
+import random
+
+import pytest
+
+import src.bot_fsa as fsa
+
+# The serial regexes of the original check_next_state
+LEGACY_PATTERNS = [
+    (fsa.QUIT, re.compile(r"((n\'t|don\'t|not).+(continue|repeat))|(quit|terminate|exit|end|bye)"),
+     re.compile(r"(n\'t|don\'t|not).+(quit|terminate|exit|end|bye)")),
+    (fsa.HEALTH_CHECK, re.compile(r"(((^|.* )(re)?(do|take) )?.*(health([ -]?check| analysis)))"),
+     re.compile(r"((n\'t|don\'t|not).+ (re)?(do|take) .*(health([ -]?check| analysis)))")),
+    (fsa.STYLISTIC_ANALYSIS, re.compile(r"(((^|.* )(re)?(do|take) )?.*(stylistic (check|analysis)))"),
+     re.compile(r"((n\'t|don\'t|not).+ (re)?(do|take) .*(stylistic (check|analysis)))")),
+]
+
+WORDS = ["i", "don't", "do", "not", "n't", "want", "to", "redo", "take", "retake", "the", "health", "check",
+         "health-check", "healthcheck", "analysis", "stylistic", "quit", "exit", "end", "bye", "terminate",
+         "continue", "repeat", "please", "again", "let's", "a", "b", "c", "friend", "weekend", "?", "!"]
+
+
+# in_user: A lowercase string longer than one character
+# Returns: The state chosen by the original menu logic, or ''
+def legacy_route(in_user):
+    matches = [(state, pos.search(in_user), neg.search(in_user)) for state, pos, neg in LEGACY_PATTERNS]
+    matched = [(state, neg) for state, pos, neg in matches if pos is not None]
+    if len(matched) != 1 or matched[0][1] is not None:
+        return ''
+    return matched[0][0]
+
+
+@pytest.mark.parametrize('letter, state', [('a', fsa.QUIT), ('b', fsa.HEALTH_CHECK), ('c', fsa.STYLISTIC_ANALYSIS),
+                                           ('d', ''), ('?', '')])
+def test_letters(letter, state):
+    assert fsa.ROUTER.route(letter) == state
+
+
+@pytest.mark.parametrize('in_user, state', [
+    ("i want to quit", fsa.QUIT),
+    ("i don't want to continue", fsa.QUIT),
+    ("i don't want to quit", ''),
+    ("let's redo the health check", fsa.HEALTH_CHECK),
+    ("i don't want to redo the health check", ''),
+    ("take the stylistic analysis again", fsa.STYLISTIC_ANALYSIS),
+    ("health check and stylistic analysis", ''),
+    ("see you at the weekend", fsa.QUIT),
+    ("hello there", ''),
+])
+def test_sentences(in_user, state):
+    assert fsa.ROUTER.route(in_user) == state
+    assert legacy_route(in_user) == state
+
+
+def test_same_as_legacy_regexes():
+    rng = random.Random(0)
+    for _ in range(20000):
+        in_user = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 12)))
+        assert fsa.ROUTER.route(in_user) == legacy_route(in_user), in_user
@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+import pytest
+from sklearn.linear_model import LogisticRegression
+
+import src.utils as utils
+import src.logit_table as logit
+import src.embedding_store as store
+
+WORDS = ['i', 'feel', 'sick', 'fine', 'healthy', 'cough']
+TEXTS = ['I feel sick', 'I feel fine', 'cough cough', 'healthy and fine', 'sick with a cough', 'I feel healthy']
+LABELS = [1, 0, 1, 0, 1, 0]
+
+
+@pytest.fixture
+def trained(tmp_path):
+    rng = np.random.default_rng(0)
+    store.write_store(str(tmp_path / 'store'), WORDS, rng.standard_normal((len(WORDS), 300)), 300)
+    word2vec = store.load_store(str(tmp_path / 'store'))
+    model = LogisticRegression().fit(utils.string2vec_batch(word2vec, TEXTS), LABELS)
+    with open(str(tmp_path / 'test.csv'), 'w') as fout:
+        fout.write('Lexicon,Label\n' + ''.join('{0},{1}\n'.format(text, label) for text, label in zip(TEXTS, LABELS)))
+    return model, word2vec, str(tmp_path / 'test.csv')
+
+
+def test_publish_replaces_the_table(tmp_path, trained):
+    model, word2vec, test_path = trained
+    path = str(tmp_path / 'table')
+    logit.publish_logit_table(model, word2vec, path, 'first', test_path)
+    report = logit.publish_logit_table(model, word2vec, path, 'second', test_path)
+
+    assert report['mismatches'] == 0
+    table = logit.LogitTable(path, 'second', word2vec.fingerprint)
+    assert list(table.predict(TEXTS)) == list(model.predict(utils.string2vec_batch(word2vec, TEXTS)))
+    assert sorted(os.listdir(str(tmp_path))) == ['store', 'table', 'test.csv']
+
+
+def test_failed_parity_keeps_the_old_table(tmp_path, trained, monkeypatch):
+    model, word2vec, test_path = trained
+    path = str(tmp_path / 'table')
+    logit.publish_logit_table(model, word2vec, path, 'first', test_path)
+
+    monkeypatch.setattr(logit, 'check_parity', lambda *args: {'documents': 6, 'mismatches': 1})
+    with pytest.raises(ValueError):
+        logit.publish_logit_table(model, word2vec, path, 'second', test_path)
+    assert logit.LogitTable(path, 'first').meta['model_key'] == 'first'
+    assert sorted(os.listdir(str(tmp_path))) == ['store', 'table', 'test.csv']
+
+
+def test_table_of_another_model_is_rejected(tmp_path, trained):
+    model, word2vec, test_path = trained
+    path = str(tmp_path / 'table')
+    logit.publish_logit_table(model, word2vec, path, 'first', test_path)
+    with pytest.raises(ValueError):
+        logit.LogitTable(path, 'second')
+    with pytest.raises(ValueError):
+        logit.LogitTable(path, embedding_fingerprint='other')
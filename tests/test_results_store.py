@@ -0,0 +1,88 @@
+import os
+import time
+
+import numpy as np
+
+import src.results_store as results
+
+
+def make_record(session_id, features=True):
+    return results.SessionRecord(str(session_id), time.time(), 'quit', 'John Smith', '01/02/90', 1,
+                                 ['Inhibition', 'Informal, personal', 'Personal, social'],
+                                 [float(idx) for idx in range(9)] if features else None)
+
+
+def test_close_writes_pending_records(tmp_path):
+    log = results.ResultsLog(str(tmp_path), batch_size=1000, flush_interval=60)
+    for idx in range(10):
+        assert log.append(make_record(idx))
+    log.close()
+
+    records = list(results.read_records(str(tmp_path)))
+    assert [record.session_id for record in records] == [str(idx) for idx in range(10)]
+    assert records[0].to_row()[3:] == make_record(0).to_row()[3:]
+    assert log.stats()['written'] == 10 and log.stats()['pending'] == 0
+
+
+def test_flush_interval(tmp_path):
+    log = results.ResultsLog(str(tmp_path), batch_size=1000, flush_interval=0.05)
+    log.append(make_record(0))
+    deadline = time.monotonic() + 5
+    while log.stats()['written'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert log.stats()['written'] == 1
+    log.close()
+
+
+def test_two_writers_use_separate_segments(tmp_path):
+    first = results.ResultsLog(str(tmp_path), flush_interval=0.01)
+    second = results.ResultsLog(str(tmp_path), flush_interval=0.01)
+    for idx in range(100):
+        first.append(make_record('a{0}'.format(idx)))
+        second.append(make_record('b{0}'.format(idx)))
+    first.close()
+    second.close()
+
+    segments = results.list_segments(str(tmp_path))
+    assert len(segments) == 2
+    ids = [record.session_id for record in results.read_records(str(tmp_path))]
+    assert sorted(ids) == sorted(['a{0}'.format(idx) for idx in range(100)] + ['b{0}'.format(idx) for idx in range(100)])
+
+
+def test_segments_rotate(tmp_path):
+    log = results.ResultsLog(str(tmp_path), batch_size=10, flush_interval=0.01, segment_bytes=1000)
+    for idx in range(100):
+        log.append(make_record(idx))
+    log.close()
+
+    assert len(results.list_segments(str(tmp_path))) > 1
+    assert len(list(results.read_records(str(tmp_path)))) == 100
+
+
+def test_malformed_lines_are_skipped(tmp_path):
+    log = results.ResultsLog(str(tmp_path))
+    log.append(make_record(0))
+    log.close()
+    with open(results.list_segments(str(tmp_path))[0], 'a') as fout:
+        fout.write('["torn", 1\n{"not": "a record"}\n["partial"')
+
+    assert [record.session_id for record in results.read_records(str(tmp_path))] == ['0']
+
+
+def test_closed_log_leaves_no_empty_segment(tmp_path):
+    results.ResultsLog(str(tmp_path)).close()
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_export_columns(tmp_path):
+    log = results.ResultsLog(str(tmp_path / 'log'))
+    log.append(make_record(0))
+    log.append(results.SessionRecord('1', time.time(), 'get_info'))
+    log.close()
+
+    path = str(tmp_path / 'results.npz')
+    assert results.export_columns(str(tmp_path / 'log'), path) == 2
+    columns = np.load(path)
+    assert list(columns['health_label']) == [1, -1]
+    assert columns['features'].shape == (2, 9) and np.isnan(columns['features'][1]).all()
+    assert list(columns['correlates'][1]) == ['', '', '']
@@ -0,0 +1,43 @@
+from src.sentence_cache import LRUCache
+
+
+def test_get_and_put():
+    cache = LRUCache(10)
+    assert cache.get('x', 'g1') is None
+    cache.put('x', 'g1', 1)
+    assert cache.get('x', 'g1') == 1
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.get('a', 'g1')
+    cache.put('a', 'g1', 1)
+    cache.put('b', 'g1', 2)
+    cache.get('a', 'g1')
+    cache.put('c', 'g1', 3)
+    assert len(cache) == 2
+    assert cache.get('b', 'g1') is None
+    assert cache.get('a', 'g1') == 1 and cache.get('c', 'g1') == 3
+    assert cache.evictions == 1
+
+
+def test_new_generation_invalidates():
+    cache = LRUCache(10)
+    cache.get('x', 'g1')
+    cache.put('x', 'g1', 1)
+    assert cache.get('x', 'g2') is None
+    assert cache.generation == 'g2'
+    assert len(cache) == 0 and cache.invalidations == 1
+
+
+def test_stale_put_is_dropped():
+    cache = LRUCache(10)
+    cache.get('x', 'g2')
+    cache.put('x', 'g2', 1)
+    # Computed by a lookup that started before the generation changed
+    cache.put('y', 'g1', 0)
+    assert cache.generation == 'g2'
+    assert cache.get('x', 'g2') == 1
+    assert cache.get('y', 'g2') is None
+    assert cache.invalidations == 0
@@ -0,0 +1,42 @@
+import asyncio
+
+from src.engine import ConversationEngine
+from src.server import serve_client, ERROR_REPLY
+
+
+# An engine whose health checks fail the first time
+class FailingEngine(ConversationEngine):
+
+    def __init__(self):
+        super().__init__(None, None)
+        self.failures = 1
+
+    async def classify_async(self, user_input):
+        if self.failures > 0:
+            self.failures -= 1
+            raise ValueError('Input contains NaN')
+        return 0
+
+
+async def converse(engine, lines):
+    server = await asyncio.start_server(lambda reader, writer: serve_client(engine, reader, writer), '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        for line in lines:
+            writer.write((line + '\n').encode('utf-8'))
+        await writer.drain()
+        writer.write_eof()
+        output = await asyncio.wait_for(reader.read(), 10)
+        writer.close()
+    return output.decode('utf-8')
+
+
+def test_failed_turn_gets_an_error_reply():
+    engine = FailingEngine()
+    output = asyncio.run(converse(engine, ['John Smith 01/02/90', 'I feel fine', 'I feel fine']))
+
+    assert ERROR_REPLY in output
+    # The health check is asked again, and the conversation goes on
+    assert "Great! It sounds like you're healthy." in output
+    assert engine.active_sessions == 0
@@ -0,0 +1,39 @@
+import numpy as np
+
+import src.embedding_store as store
+from src.similarity import OOVResolver, SimilarityIndex
+
+# Sorted by frequency, like the word2vec stores
+WORDS = ['the', 'head', 'ache', 'headache', 'Paris', 'fever', 'sick']
+
+
+def make_resolver(tmp_path):
+    vectors = np.random.default_rng(0).standard_normal((len(WORDS), 300)).astype(np.float32)
+    store.write_store(str(tmp_path / 'store'), WORDS, vectors, 300)
+    word2vec = store.load_store(str(tmp_path / 'store'))
+    return word2vec, OOVResolver(word2vec, SimilarityIndex(word2vec))
+
+
+def test_longest_subword_wins(tmp_path):
+    word2vec, resolver = make_resolver(tmp_path)
+    assert word2vec.word(resolver.resolve('headacheeeee')) == 'headache'
+    assert word2vec.word(resolver.resolve('myheadache')) == 'headache'
+    assert word2vec.word(resolver.resolve('headxyzw')) == 'head'
+
+
+def test_capitalization_and_edits(tmp_path):
+    word2vec, resolver = make_resolver(tmp_path)
+    assert word2vec.word(resolver.resolve('paris')) == 'Paris'
+    assert word2vec.word(resolver.resolve('fevr')) == 'fever'
+    assert resolver.resolve('qqqq') == -1
+
+
+def test_search_matches_brute_force():
+    vectors = np.random.default_rng(1).standard_normal((1000, 20)).astype(np.float32)
+    queries = vectors[:5] + 0.1
+    rows, sims = SimilarityIndex(vectors, block_size=128).search(queries, 7)
+
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    expected = (queries / np.linalg.norm(queries, axis=1, keepdims=True)) @ normalized.T
+    np.testing.assert_array_equal(rows, np.argsort(-expected, axis=1, kind='stable')[:, :7])
+    np.testing.assert_allclose(sims, np.take_along_axis(expected, rows, axis=1), rtol=1e-5)
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+import src.utils as utils
+import src.embedding_store as store
+
+WORDS = ['i', 'feel', 'sick', 'fine', 'headache']
+DOCUMENTS = ['I feel sick', 'I feel FINE!', 'zzz qqq', '.', '?!', '', 'headache headache unknown', 'feel, fine.']
+
+
+@pytest.fixture(params=['dict', 'store'])
+def word2vec(request, tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((len(WORDS), 300)).astype(np.float32)
+    if request.param == 'dict':
+        return {word: vector for word, vector in zip(WORDS, vectors)}
+    store.write_store(str(tmp_path / 'store'), WORDS, vectors, 300)
+    return store.load_store(str(tmp_path / 'store'))
+
+
+def test_string2vec_matches_batch(word2vec):
+    batch = utils.string2vec_batch(word2vec, DOCUMENTS)
+    for doc, expected in zip(DOCUMENTS, batch):
+        embedding = utils.string2vec(word2vec, doc)
+        assert np.isfinite(embedding).all(), doc
+        np.testing.assert_allclose(embedding, expected, rtol=1e-5, atol=1e-6, err_msg=doc)
+
+
+def test_documents_without_known_tokens_are_zero(word2vec):
+    for doc in ['.', '', 'zzz qqq']:
+        assert not utils.string2vec(word2vec, doc).any()
+
+
+def test_string2vec_uses_the_dimension_of_the_embeddings():
+    word2vec = {'fine': np.ones(50, dtype=np.float32)}
+    assert utils.string2vec(word2vec, 'fine thanks').shape == (50,)
+    assert utils.w2v(word2vec, 'thanks').shape == (50,)
+    np.testing.assert_allclose(utils.string2vec(word2vec, 'fine thanks'), 0.5)